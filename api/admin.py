@@ -1,5 +1,18 @@
 from django.contrib import admin
 
 from api.models import Post
+from api.uploads import hashing_uploads
 
-admin.site.register(Post)
+
+class PostAdmin(admin.ModelAdmin):
+    def get_urls(self):
+        urls = super().get_urls()
+        info = self.opts.app_label, self.opts.model_name
+        for pattern in urls:
+            if pattern.name in ('%s_%s_add' % info, '%s_%s_change' % info):
+                # around admin_view, whose CSRF check reads the body
+                pattern.callback = hashing_uploads(pattern.callback)
+        return urls
+
+
+admin.site.register(Post, PostAdmin)
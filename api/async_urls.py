@@ -0,0 +1,14 @@
+from django.urls import path
+
+from api.async_views import post_list_view, post_detail_view, subjob_list_view, subjob_detail_view, \
+    category_detail_view, products_by_search_view, login_view
+
+urlpatterns = [
+    path('post', post_list_view),
+    path('post/<int:pk>', post_detail_view),
+    path('subjob/', subjob_list_view),
+    path('subjob-detail', subjob_detail_view),
+    path('category/<int:pk>', category_detail_view),
+    path('search/', products_by_search_view),
+    path('login/', login_view),
+]
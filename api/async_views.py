@@ -0,0 +1,138 @@
+"""
+Async versions of the read-heavy endpoints, served under /api/async/. They use the async ORM and plain
+Django responses (DRF views are sync only), so under ASGI a slow client doesn't hold a worker thread.
+Responses have the same shape as their sync counterparts in api.views.
+
+Serializers are synchronous and read relations lazily when they aren't prefetched, so they run through
+`serialize()` (sync_to_async) rather than on the event loop.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import alogin
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.fields import empty
+from rest_framework.status import HTTP_200_OK, HTTP_404_NOT_FOUND
+
+from api.auth import acheck_password
+from api.models import Post, SubJob, Category, User
+from api.pagination import PostKeysetPagination, SubJobKeysetPagination
+from api.renderers import JsonResponse
+from api.search import asearch_products
+from api.serializers import PostModelSerializer, PostDetailModelSerializer, SubJobModelSerializer, \
+    CategoryDetailModelSerializer, ProductBySearchModelSerializer, LoginSerializer
+
+
+async def serialize(serializer_class, instance, many=False):
+    return await sync_to_async(lambda: serializer_class(instance=instance, many=many).data)()
+
+
+async def paginate(paginator, queryset, request):
+    try:
+        return await paginator.apaginate_queryset(queryset, request), None
+    except NotFound as e:
+        return None, JsonResponse({"detail": str(e.detail)}, status=HTTP_404_NOT_FOUND)
+
+
+@require_GET
+async def post_list_view(request):
+    posts = Post.objects.open().prefetch_related('jobs').order_by(*PostKeysetPagination.ordering)
+    paginator = PostKeysetPagination()
+    if paginator.is_requested(request):
+        page, error = await paginate(paginator, posts, request)
+        if error:
+            return error
+        s = await serialize(PostModelSerializer, page, many=True)
+        return JsonResponse({"response": s, "next": paginator.get_next_link()}, status=HTTP_200_OK)
+    s = await serialize(PostModelSerializer, [post async for post in posts], many=True)
+    return JsonResponse({"response": s}, status=HTTP_200_OK)
+
+
+@require_GET
+async def post_detail_view(request, pk):
+    post = await Post.objects.select_related('user').filter(pk=pk).afirst()
+    if post is None:
+        return JsonResponse({"message": f"Post with id {pk} not found!"})
+    s = await serialize(PostDetailModelSerializer, post)
+    return JsonResponse(s, status=HTTP_200_OK)
+
+
+@require_GET
+async def subjob_list_view(request):
+    subjobs = SubJob.objects.order_by('id')
+    paginator = SubJobKeysetPagination()
+    if paginator.is_requested(request):
+        page, error = await paginate(paginator, subjobs, request)
+        if error:
+            return error
+        s = await serialize(SubJobModelSerializer, page, many=True)
+        return JsonResponse({'next': paginator.get_next_link(), 'results': s})
+    s = await serialize(SubJobModelSerializer, [subjob async for subjob in subjobs], many=True)
+    return JsonResponse(s, safe=False)
+
+
+@require_GET
+async def subjob_detail_view(request):
+    pk = request.GET.get('pk')
+    subjobs = [subjob async for subjob in SubJob.objects.filter(job_id=pk)]
+    if not subjobs:
+        return JsonResponse({"message": f"Subjob with job_id {pk} id not found!"})
+    s = await serialize(SubJobModelSerializer, subjobs, many=True)
+    return JsonResponse(s, safe=False)
+
+
+@require_GET
+async def category_detail_view(request, pk):
+    category = await Category.objects.prefetch_related('products').filter(id=pk).afirst()
+    if category is None:
+        return JsonResponse({"message": f"Category with id {pk} not found!"})
+    s = await serialize(CategoryDetailModelSerializer, category)
+    return JsonResponse(s, status=HTTP_200_OK)
+
+
+@require_GET
+async def products_by_search_view(request):
+    search = request.GET.get('search', None)
+    if search:
+        try:
+            limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+        except ValueError:
+            limit = 50
+        products = await asearch_products(search, limit=limit)
+        s = await serialize(ProductBySearchModelSerializer, products, many=True)
+        return JsonResponse(s, safe=False, status=HTTP_200_OK)
+    return JsonResponse({"message": "Please send request with serach!"})
+
+
+@csrf_exempt
+@require_POST
+async def login_view(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = {}
+    else:
+        data = request.POST
+
+    # field validation from LoginSerializer; the user lookup and the hash check are done async here
+    fields = LoginSerializer().fields
+    attrs, errors = {}, {}
+    for name in ('email', 'password'):
+        try:
+            attrs[name] = fields[name].run_validation(data.get(name, empty))
+        except ValidationError as e:
+            errors[name] = e.detail
+    if errors:
+        return JsonResponse(errors)
+
+    user = await User.objects.filter(email=attrs['email']).afirst()
+    password_ok = user is not None and await acheck_password(user, attrs['password'])
+    try:
+        LoginSerializer.check_user(attrs, user, password_ok)
+    except ValidationError as e:
+        return JsonResponse(e.detail)
+    await alogin(request, user)
+    return JsonResponse({"message": "successfully login!"})
@@ -0,0 +1,46 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+
+from api.middleware import record_timing
+
+# PBKDF2 holds the CPU for hundreds of milliseconds: under ASGI it runs here, never on the event loop,
+# and the pool size caps how many logins hash at the same time
+HASH_EXECUTOR = ThreadPoolExecutor(max_workers=getattr(settings, 'PASSWORD_HASH_WORKERS', 4),
+                                   thread_name_prefix='password-hash')
+
+
+def check_password_timed(user, password, setter=None):
+    """
+    user.check_password(), timed. A hash upgrade is passed to `setter` instead of saved, when there is one.
+    """
+    started = perf_counter()
+    try:
+        if setter is None:
+            return user.check_password(password)
+        return check_password(password, user.password, setter)
+    finally:
+        record_timing('password_hash', perf_counter() - started)
+
+
+async def acheck_password(user, password):
+    upgraded = []
+
+    def setter(raw_password):
+        # rehashed on the pool thread too, but saved by the caller: a save here would open a database
+        # connection in the pool thread that nothing ever closes
+        user.set_password(raw_password)
+        # hash upgrades aren't password changes
+        user._password = None
+        upgraded.append(True)
+
+    context = contextvars.copy_context()
+    password_ok = await asyncio.get_running_loop().run_in_executor(
+        HASH_EXECUTOR, context.run, check_password_timed, user, password, setter)
+    if upgraded:
+        await user.asave(update_fields=['password'])
+    return password_ok
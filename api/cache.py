@@ -0,0 +1,59 @@
+from hashlib import sha1
+from time import time_ns
+
+from django.core.cache import cache
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+
+from api.routers import use_primary
+
+RESPONSE_TIMEOUT = 60 * 60
+
+
+def version_key(label, pk):
+    return f'api:version:{label}:{pk}'
+
+
+def get_version(label, pk):
+    # a missing (or evicted) version starts at a fresh value, so entries cached under an older one never match
+    version = cache.get_or_set(version_key(label, pk), time_ns, timeout=None)
+    # evicted again before it could be read back: a value of its own, nothing is cached under it yet
+    return version if version is not None else time_ns()
+
+
+def bump_version(label, pk):
+    try:
+        cache.incr(version_key(label, pk))
+    except ValueError:
+        cache.set(version_key(label, pk), time_ns(), timeout=None)
+
+
+def cached_detail_response(request, label, pk, build):
+    """
+    Serves `build()` (serialized data, or None for "not found") from the cache under the current version of
+    (label, pk), with a strong ETag; answers `If-None-Match` with 304. signals.py bumps the version on writes.
+    Returns None when `build()` does, or without calling it when `pk` (taken from the URL) is not an id.
+    """
+    try:
+        # '7', '07' and ' 7' are one entry, anything else never reaches the cache keys
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    version = get_version(label, pk)
+    entry_key = f'api:response:{label}:{pk}:{version}'
+    entry = cache.get(entry_key)
+    if entry is None:
+        # built from the primary: a lagging replica would cache stale data under the new version
+        with use_primary():
+            data = build()
+        if data is None:
+            return None
+        etag = quote_etag(sha1(f'{label}:{pk}:{version}'.encode()).hexdigest())
+        entry = {'etag': etag, 'data': data}
+        cache.set(entry_key, entry, timeout=RESPONSE_TIMEOUT)
+
+    headers = {'ETag': entry['etag']}
+    if entry['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+        return Response(status=HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(entry['data'], status=HTTP_200_OK, headers=headers)
@@ -0,0 +1,171 @@
+"""
+Catalog snapshot: every category with its products (CategoryDetailModelSerializer) rendered into one gzipped
+JSON file, `catalog-<version>.json.gz` in settings.CATALOG_SNAPSHOT_DIR, where the version is the hash of the
+JSON. A `current` file names the latest version. Product/Category writes schedule a rebuild through Celery,
+debounced to one per CATALOG_SNAPSHOT_DELAY seconds, and `catalog_response()` serves the file as it is: no
+database work, no serialization, no compression per request. Only while there is no snapshot file to serve
+is the catalog rendered in the request.
+"""
+import gzip
+import logging
+import os
+import re
+import tempfile
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import FileResponse, HttpResponse
+from django.utils.http import parse_etags, quote_etag
+
+from api.models import Category, Product
+from api.renderers import dumps
+from api.routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'current'
+SCHEDULED_KEY = 'api:catalog:scheduled'
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def snapshot_path(version):
+    return os.path.join(settings.CATALOG_SNAPSHOT_DIR, f'catalog-{version}.json.gz')
+
+
+def write_atomic(path, content):
+    # readers see the old file or the new one, never a partial write
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def current_version():
+    try:
+        with open(os.path.join(settings.CATALOG_SNAPSHOT_DIR, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def render_catalog():
+    # imported here: api.serializers imports this module
+    from api.serializers import CategoryDetailModelSerializer
+
+    products = Product.objects.only('id', 'name', 'price', 'category_id').order_by('id')
+    with use_primary():
+        categories = Category.objects.prefetch_related(Prefetch('products', queryset=products)).order_by('id')
+        return dumps(CategoryDetailModelSerializer(instance=categories, many=True).data)
+
+
+def build_snapshot():
+    """
+    Renders the catalog and makes it the current snapshot. Returns its version; an unchanged catalog keeps
+    its file and version.
+    """
+    content = render_catalog()
+    version = sha256(content).hexdigest()[:20]
+
+    os.makedirs(settings.CATALOG_SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(version)
+    if not os.path.exists(path):
+        # mtime=0: the same catalog always gives the same bytes
+        write_atomic(path, gzip.compress(content, compresslevel=9, mtime=0))
+    write_atomic(os.path.join(settings.CATALOG_SNAPSHOT_DIR, CURRENT_FILE), version.encode())
+    remove_old_snapshots(version)
+    return version
+
+
+def remove_old_snapshots(version):
+    # a few old versions stay for the responses still reading them
+    directory = settings.CATALOG_SNAPSHOT_DIR
+    names = [name for name in os.listdir(directory)
+             if name.startswith('catalog-') and name != os.path.basename(snapshot_path(version))]
+    names.sort(key=lambda name: os.path.getmtime(os.path.join(directory, name)), reverse=True)
+    for name in names[settings.CATALOG_SNAPSHOT_KEEP:]:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def schedule_snapshot():
+    """
+    Rebuilds the snapshot after the current transaction commits, once for all the writes of the next
+    CATALOG_SNAPSHOT_DELAY seconds.
+    """
+    transaction.on_commit(_schedule)
+
+
+def _schedule():
+    from api.tasks import build_catalog_snapshot_task
+
+    delay = settings.CATALOG_SNAPSHOT_DELAY
+    # The task runs after the key has expired, so every write that found the key is in its snapshot and
+    # every later one schedules the next task. The key lives in the default cache: with the per-process
+    # LocMemCache every worker process debounces on its own, a shared cache (Redis) makes it one task for all.
+    if not cache.add(SCHEDULED_KEY, 1, timeout=delay):
+        return
+    try:
+        if build_catalog_snapshot_task.app.conf.task_always_eager:
+            build_catalog_snapshot_task.apply_async(countdown=delay + 1)
+            return
+        with build_catalog_snapshot_task.app.connection_for_write() as connection:
+            # a single attempt: kombu's own retry loop would hold up the request that wrote for seconds
+            connection.ensure_connection(max_retries=0)
+            build_catalog_snapshot_task.apply_async(countdown=delay + 1, connection=connection, retry=False)
+    except Exception:
+        # the write is committed already; the snapshot stays stale until the next write schedules a rebuild
+        cache.delete(SCHEDULED_KEY)
+        logger.exception('Could not schedule the catalog snapshot rebuild')
+
+
+def catalog_response(request):
+    """
+    The current snapshot with its version as a strong ETag, 304 on a matching If-None-Match. Sent gzipped
+    to clients that accept it, decompressed for the others. Without a snapshot the first one is scheduled and
+    the catalog is rendered for this request only, with no ETag and not to be cached.
+    """
+    # a rebuild may remove the file of the version just read (remove_old_snapshots), `current` names the
+    # new one by then
+    for _ in range(2):
+        version = current_version()
+        if version is None:
+            break
+        try:
+            return snapshot_response(request, version)
+        except FileNotFoundError:
+            continue
+
+    schedule_snapshot()
+    response = HttpResponse(render_catalog(), content_type='application/json')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def snapshot_response(request, version):
+    gzipped = bool(accepts_gzip.search(request.headers.get('Accept-Encoding', '')))
+    # a strong ETag names one exact body, so the gzipped and the plain one each get their own
+    etag = quote_etag(f'{version}-gz' if gzipped else version)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponse(status=304)
+    else:
+        path = snapshot_path(version)
+        if gzipped:
+            response = FileResponse(open(path, 'rb'), content_type='application/json', filename='catalog.json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            with gzip.open(path) as file:
+                response = HttpResponse(file.read(), content_type='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    # clients revalidate every time, a 304 costs a stat and a small read
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
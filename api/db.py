@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def apply_sqlite_pragmas(sender=None, connection=None, **kwargs):
+    """
+    Runs settings.SQLITE_PRAGMAS on every new SQLite connection (see DATABASE_PROFILE in settings).
+    """
+    if connection.vendor != 'sqlite':
+        return
+    # straight on the sqlite3 connection, so the execute wrappers don't count them as request queries
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+connection_created.connect(apply_sqlite_pragmas)
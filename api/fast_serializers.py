@@ -0,0 +1,221 @@
+"""
+Read-only fast path for list serializers. A serializer's readable fields are compiled once into the
+`values_list()` columns they read and a converter per column, so a list is serialized straight from tuples:
+no model instances, no per-row field binding or `get_attribute` traversal. The output is the same as
+`Serializer(instance=queryset, many=True).data`; `benchmark_serializers` checks it byte for byte.
+
+Supported: model fields and forward relations by (dotted) source, primary key related fields, many-to-many
+primary key lists. Serializers with nested serializers, method fields, properties or a custom
+`to_representation` raise UnsupportedField when compiled.
+"""
+from copy import copy
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import FileField as ModelFileField
+from rest_framework.fields import FileField, ReadOnlyField, CharField, IntegerField, DateTimeField
+from rest_framework.relations import PrimaryKeyRelatedField, ManyRelatedField
+from rest_framework.serializers import Serializer, BaseSerializer
+
+from api.middleware import serializer_timing
+
+CHUNK_SIZE = 2000
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+def identity(value):
+    return value
+
+
+# A converter factory is called once per chunk of rows and returns the function that converts one value,
+# so what DRF would look up for every value (the active timezone, the storage URL of a file) is looked up
+# once per chunk.
+
+def file_converter(field, model_field):
+    attr_class = model_field.attr_class
+
+    def prepare():
+        urls = {}
+
+        def convert(name):
+            # DRF's FileField reads `.url` of the FieldFile, which only depends on the name
+            if name not in urls:
+                urls[name] = field.to_representation(attr_class(None, model_field, name))
+            return urls[name]
+        return convert
+    return prepare
+
+
+def datetime_converter(field):
+    def prepare():
+        # to_representation looks up the current timezone for every value unless the field has its own
+        bound = copy(field)
+        bound.timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        return bound.to_representation
+    return prepare
+
+
+def converter(field, model_field):
+    if isinstance(field, PrimaryKeyRelatedField):
+        if field.pk_field is not None:
+            return constant(field.pk_field.to_representation)
+        return constant(identity)
+    if isinstance(field, FileField):
+        return file_converter(field, model_field)
+    if isinstance(field, DateTimeField):
+        return datetime_converter(field)
+    # the same result as their to_representation, without the method call
+    if type(field) is ReadOnlyField:
+        return constant(identity)
+    if type(field) is CharField:
+        return constant(str)
+    if type(field) is IntegerField:
+        return constant(int)
+    return constant(field.to_representation)
+
+
+def constant(convert):
+    return lambda: convert
+
+
+class FastReader:
+    def __init__(self, serializer_class):
+        if serializer_class.to_representation is not Serializer.to_representation:
+            raise UnsupportedField(f'{serializer_class.__name__} overrides to_representation')
+        self.model = serializer_class.Meta.model
+        self.columns = ['pk']
+        # (field_name, column index, converter factory, index of the nullable relation column or None,
+        #  many-to-many model field or None)
+        self.fields = []
+        for field in serializer_class()._readable_fields:
+            self.compile_field(serializer_class, field)
+
+    def column(self, path):
+        if path not in self.columns:
+            self.columns.append(path)
+        return self.columns.index(path)
+
+    def compile_field(self, serializer_class, field):
+        name = f'{serializer_class.__name__}.{field.field_name}'
+        if isinstance(field, BaseSerializer) or field.source == '*':
+            raise UnsupportedField(f'{name}: nested serializers and source="*" are not supported')
+
+        model = self.model
+        skip_if_null = None
+        for i, attr in enumerate(field.source_attrs):
+            try:
+                model_field = model._meta.pk if attr == 'pk' else model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                raise UnsupportedField(f'{name}: {attr} is not a model field')
+            last = i == len(field.source_attrs) - 1
+
+            if model_field.many_to_many and last:
+                if not (isinstance(field, ManyRelatedField) and isinstance(field.child_relation,
+                                                                           PrimaryKeyRelatedField)):
+                    raise UnsupportedField(f'{name}: only primary key lists of many-to-many fields')
+                if i:
+                    raise UnsupportedField(f'{name}: many-to-many fields behind a relation are not supported')
+                # read from the primary key column, converted through the related pks fetched per chunk
+                self.fields.append((field.field_name, 0, converter(field.child_relation, None), None, model_field))
+                return
+            if not model_field.concrete or model_field.many_to_many:
+                raise UnsupportedField(f'{name}: {attr} is not a column')
+            if last:
+                break
+            if not (model_field.many_to_one or model_field.one_to_one):
+                raise UnsupportedField(f'{name}: {attr} is not a forward relation')
+            # DRF leaves the key out when a relation on the way is null
+            if model_field.null and skip_if_null is None:
+                skip_if_null = self.column('__'.join(field.source_attrs[:i + 1]))
+            model = model_field.related_model
+
+        if model_field.is_relation and not isinstance(field, PrimaryKeyRelatedField):
+            raise UnsupportedField(f'{name}: only primary key related fields are supported')
+        if isinstance(field, FileField) and not isinstance(model_field, ModelFileField):
+            raise UnsupportedField(f'{name}: file fields need a model FileField')
+        index = self.column('__'.join(field.source_attrs))
+        self.fields.append((field.field_name, index, converter(field, model_field), skip_if_null, None))
+
+    def convert_chunk(self, rows):
+        fields = []
+        for name, index, prepare, skip_if_null, many_field in self.fields:
+            convert = prepare()
+            if many_field is not None:
+                convert = self.fetch_many(many_field, convert, [row[0] for row in rows])
+            fields.append((name, index, convert, skip_if_null))
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, index, convert, skip_if_null in fields:
+                if skip_if_null is not None and row[skip_if_null] is None:
+                    continue
+                value = row[index]
+                item[name] = None if value is None else convert(value)
+            data.append(item)
+        return data
+
+    @staticmethod
+    def fetch_many(model_field, convert, pks):
+        """
+        Converter of the rows' primary keys into their lists of related primary keys.
+        """
+        through = model_field.remote_field.through
+        source, target = model_field.m2m_column_name(), model_field.m2m_reverse_name()
+        values = {}
+        # ordered like the rows of prefetch_related() on SQLite, which reads the (source, target) unique index
+        pairs = through.objects.filter(**{f'{source}__in': pks}).order_by(source, target) \
+            .values_list(source, target)
+        for pk, related_pk in pairs:
+            values.setdefault(pk, []).append(convert(related_pk))
+        return lambda pk: values.get(pk, [])
+
+    def rows(self, queryset):
+        # prefetch_related() would be run on the tuples
+        return queryset.prefetch_related(None).values_list(*self.columns)
+
+    # timed like BaseSerializer.data (api.middleware), query included
+
+    def data(self, queryset):
+        with serializer_timing():
+            return self.convert_chunk(list(self.rows(queryset)))
+
+    def iter_data(self, queryset, chunk_size=CHUNK_SIZE):
+        rows = self.rows(queryset).iterator(chunk_size=chunk_size)
+        while True:
+            with serializer_timing():
+                data = self.convert_chunk(list(islice(rows, chunk_size)))
+            if not data:
+                return
+            yield from data
+
+
+@lru_cache(maxsize=None)
+def compile_reader(serializer_class):
+    return FastReader(serializer_class)
+
+
+def fast_enabled():
+    return getattr(settings, 'API_FAST_SERIALIZERS', True)
+
+
+class FastReadMixin:
+    """
+    `SomeSerializer.fast_data(queryset)` is `SomeSerializer(instance=queryset, many=True).data` computed from
+    `values_list()` tuples. settings.API_FAST_SERIALIZERS = False switches back to the regular serializers.
+    """
+
+    @classmethod
+    def fast_data(cls, queryset):
+        if not fast_enabled():
+            return cls(instance=queryset, many=True).data
+        return compile_reader(cls).data(queryset)
+
+    @classmethod
+    def fast_iter_data(cls, queryset, chunk_size=CHUNK_SIZE):
+        return compile_reader(cls).iter_data(queryset, chunk_size=chunk_size)
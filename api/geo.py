@@ -0,0 +1,180 @@
+"""
+Geohash cells for the nearby-order lookups. Every Order/TestOrder stores the geohash of its coordinates in an
+indexed column (GeohashField, filled in on save and bulk_create). A radius or bounding box query is turned into
+the few geohash prefixes covering the box, each one an index range `geohash >= start AND geohash < stop`, and
+only the rows in those ranges get their exact distance checked.
+
+Geohash: the longitude and latitude are each split into 2^n equal steps and the bits of both step numbers are
+interleaved, longitude first, 5 bits per base32 character. Cells sharing a prefix are inside the prefix's cell,
+so they are one contiguous range of the index.
+"""
+import math
+from decimal import Decimal, ROUND_FLOOR, ROUND_CEILING
+
+from django.db.models import CharField
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# 9 characters: cells of about 4.8 x 4.8 m
+PRECISION = 9
+# a query is covered by at most this many cells of the coarsest precision that fits, less precise cells mean
+# fewer index ranges but more rows outside the radius to check
+MAX_CELLS = 24
+EARTH_RADIUS = 6_371_008.8
+# degrees are stored with 6 decimal places
+COORDINATE_STEP = Decimal('0.000001')
+
+
+def bit_counts(precision):
+    bits = precision * 5
+    return (bits + 1) // 2, bits // 2
+
+
+def cell_index(value, low, span, bits):
+    return min(max(int((value - low) / span * 2 ** bits), 0), 2 ** bits - 1)
+
+
+def cell_hash(lon_index, lat_index, precision):
+    lon_bits, lat_bits = bit_counts(precision)
+    number = 0
+    for bit in range(precision * 5):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            number = number << 1 | (lon_index >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            number = number << 1 | (lat_index >> lat_bits) & 1
+    return ''.join(BASE32[number >> shift & 31] for shift in range(precision * 5 - 5, -1, -5))
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    lon_bits, lat_bits = bit_counts(precision)
+    return cell_hash(cell_index(float(longitude), -180, 360, lon_bits),
+                     cell_index(float(latitude), -90, 180, lat_bits), precision)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """
+    Great-circle (haversine) distance in meters.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius):
+    """
+    (min_lat, min_lon, max_lat, max_lon) around a circle of `radius` meters. Longitudes may run past +-180,
+    split_box() wraps them.
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    delta_lat = math.degrees(radius / EARTH_RADIUS)
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # the circle contains a pole: every longitude
+        return max(min_lat, -90), -180, min(max_lat, 90), 180
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(radius / EARTH_RADIUS) / math.cos(math.radians(latitude)))))
+    return min_lat, longitude - delta_lon, max_lat, longitude + delta_lon
+
+
+def split_box(min_lat, min_lon, max_lat, max_lon):
+    """
+    The box as one or two boxes inside -180..180, split where it crosses the antimeridian.
+    """
+    min_lat, max_lat = max(min_lat, -90), min(max_lat, 90)
+    if max_lon - min_lon >= 360:
+        return [(min_lat, -180, max_lat, 180)]
+    if min_lon < -180:
+        return [(min_lat, min_lon + 360, max_lat, 180), (min_lat, -180, max_lat, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, min_lon, max_lat, 180), (min_lat, -180, max_lat, max_lon - 360)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def cover(min_lat, min_lon, max_lat, max_lon):
+    """
+    [(start, stop)] geohash ranges whose cells together contain the box (inside -180..180). Neighbouring cells
+    that follow each other in geohash order are merged into one range.
+    """
+    for precision in range(PRECISION, 0, -1):
+        lon_bits, lat_bits = bit_counts(precision)
+        lon_first, lon_last = (cell_index(value, -180, 360, lon_bits) for value in (min_lon, max_lon))
+        lat_first, lat_last = (cell_index(value, -90, 180, lat_bits) for value in (min_lat, max_lat))
+        if (lon_last - lon_first + 1) * (lat_last - lat_first + 1) <= MAX_CELLS or precision == 1:
+            break
+
+    cells = sorted(
+        cell_hash(lon_index, lat_index, precision)
+        for lon_index in range(lon_first, lon_last + 1)
+        for lat_index in range(lat_first, lat_last + 1)
+    )
+    ranges = []
+    for cell in cells:
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = next_prefix(cell)
+        else:
+            ranges.append([cell, next_prefix(cell)])
+    return [tuple(bounds) for bounds in ranges]
+
+
+def next_prefix(cell):
+    """
+    The first geohash after every geohash starting with `cell` (a cell of the same length when there is one).
+    """
+    for i in range(len(cell) - 1, -1, -1):
+        position = BASE32.index(cell[i])
+        if position < len(BASE32) - 1:
+            return cell[:i] + BASE32[position + 1]
+        cell = cell[:i]
+    return '~'
+
+
+def column_range(low, high):
+    """
+    Box edges as 6 decimal place coordinates. Stored coordinates have 6 decimal places, so rounding the edges
+    inwards keeps exactly the rows inside the box.
+    """
+    return (Decimal(repr(low)).quantize(COORDINATE_STEP, ROUND_CEILING),
+            Decimal(repr(high)).quantize(COORDINATE_STEP, ROUND_FLOOR))
+
+
+class GeohashField(CharField):
+    """
+    Read-only geohash of the model's latitude/longitude fields, computed in pre_save() so it is filled in by
+    save() and bulk_create() alike. Queryset update() of the coordinates doesn't recompute it, and neither does
+    save(update_fields=...) without the geohash field.
+    """
+
+    def __init__(self, latitude_field='latitude', longitude_field='longitude', **kwargs):
+        self.latitude_field = latitude_field
+        self.longitude_field = longitude_field
+        kwargs.setdefault('max_length', PRECISION)
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('editable', False)
+        super().__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.latitude_field != 'latitude':
+            kwargs['latitude_field'] = self.latitude_field
+        if self.longitude_field != 'longitude':
+            kwargs['longitude_field'] = self.longitude_field
+        # (name, this field's default, Field's default)
+        for key, default, field_default in (('max_length', PRECISION, None), ('null', True, False),
+                                            ('blank', True, False), ('editable', False, True)):
+            value = kwargs.pop(key, field_default)
+            if value != default:
+                kwargs[key] = value
+        return name, path, args, kwargs
+
+    def compute(self, instance):
+        latitude = getattr(instance, self.latitude_field)
+        longitude = getattr(instance, self.longitude_field)
+        if latitude is None or longitude is None:
+            return None
+        return encode(latitude, longitude, self.max_length)
+
+    def pre_save(self, model_instance, add):
+        value = self.compute(model_instance)
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,182 @@
+import json
+import logging
+import smtplib
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.signals import setting_changed
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'api:mail:queue'
+# the batch being sent: moved here from the queue and only removed once every message is sent or rejected
+PROCESSING_KEY = 'api:mail:processing'
+FLUSH_SCHEDULED_KEY = 'api:mail:flush-scheduled'
+# held for the whole flush, so only one worker at a time uses PROCESSING_KEY
+FLUSH_LOCK_KEY = 'api:mail:flush-lock'
+# renewed after every message: a flush that makes no progress for this long is taken for dead, and the next
+# one sends its batch again
+FLUSH_LOCK_TIMEOUT = 300  # seconds
+
+_connection = None  # (EMAIL_BACKEND, connection)
+_redis = None
+
+
+def get_pooled_connection():
+    """
+    One mail connection per worker process, opened on first use and reused by every batch. A different
+    EMAIL_BACKEND gets a new connection.
+    """
+    global _connection
+    backend = settings.EMAIL_BACKEND
+    if _connection is not None and _connection[0] != backend:
+        close_pooled_connection()
+    if _connection is None:
+        connection = get_connection(backend, fail_silently=False)
+        connection.open()
+        _connection = (backend, connection)
+    return _connection[1]
+
+
+def close_pooled_connection(**kwargs):
+    global _connection
+    if _connection is not None:
+        try:
+            _connection[1].close()
+        finally:
+            _connection = None
+
+
+def email_setting_changed(setting, **kwargs):
+    # override_settings of the host, port or credentials
+    if setting.startswith('EMAIL_'):
+        close_pooled_connection()
+
+
+setting_changed.connect(email_setting_changed)
+
+
+def send_messages(messages):
+    emails = [EmailMessage(connection=None, **message) for message in messages]
+    try:
+        return get_pooled_connection().send_messages(emails)
+    except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, ConnectionError):
+        # the relay dropped the idle connection: reconnect once
+        logger.info('Mail connection lost, reconnecting')
+        close_pooled_connection()
+        return get_pooled_connection().send_messages(emails)
+
+
+def is_queued():
+    # only SMTP pays for connection setup; locmem/console/file backends (tests, dev) send right away
+    return bool(settings.EMAIL_QUEUE_URL) and settings.EMAIL_BACKEND.endswith('smtp.EmailBackend')
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        from redis import Redis
+        _redis = Redis.from_url(settings.EMAIL_QUEUE_URL)
+    return _redis
+
+
+def enqueue(message):
+    """
+    Queues `message` (EmailMessage kwargs) and makes sure one flush is scheduled within EMAIL_BATCH_WINDOW
+    seconds, so a burst of registrations is sent as a few batches over one connection.
+    Returns True when a flush has to be scheduled by the caller.
+    """
+    redis = get_redis()
+    redis.rpush(QUEUE_KEY, json.dumps(message))
+    # the flag expires in case the scheduled flush is lost
+    return bool(redis.set(FLUSH_SCHEDULED_KEY, 1, nx=True, ex=max(int(settings.EMAIL_BATCH_WINDOW) * 10, 60)))
+
+
+def pop_batch(size):
+    """
+    Moves at most `size` messages from the queue to the processing list and returns them (raw JSON).
+    """
+    with get_redis().pipeline() as pipe:
+        for _ in range(size):
+            pipe.lmove(QUEUE_KEY, PROCESSING_KEY, 'LEFT', 'RIGHT')
+        return [item for item in pipe.execute() if item is not None]
+
+
+def requeue(items):
+    # back to the front of the queue, in their order, and out of the processing list in one transaction
+    with get_redis().pipeline() as pipe:
+        if items:
+            pipe.lpush(QUEUE_KEY, *reversed(items))
+        pipe.delete(PROCESSING_KEY)
+        pipe.execute()
+
+
+def is_rejected(error):
+    # the server refused this message for good (5xx): retrying it would only hold up the rest of the queue
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def send_batch(items, lock=None):
+    """
+    Sends the raw queued messages one by one. A rejected message is logged and dropped; any other error puts
+    the message and the ones after it back in the queue and is raised. `lock` (the flush lock) is renewed
+    after every message.
+    """
+    sent = 0
+    for position, item in enumerate(items):
+        try:
+            sent += send_messages([json.loads(item)])
+        except Exception as error:
+            if not is_rejected(error):
+                requeue(items[position:])
+                raise
+            logger.warning('Verification email rejected: %s', error)
+        if lock is not None:
+            lock.reacquire()
+    get_redis().delete(PROCESSING_KEY)
+    return sent
+
+
+def flush():
+    """
+    Sends one batch of at most EMAIL_BATCH_SIZE messages. Returns (sent, countdown) where countdown is the
+    delay before the next flush (None when the queue is empty), chosen to keep under EMAIL_RATE_LIMIT per second.
+    Raises when the SMTP server can't be reached; the unsent messages are back in the queue by then.
+    While another worker is flushing nothing is sent and the flush is tried again after EMAIL_BATCH_WINDOW.
+    """
+    from redis.exceptions import LockError
+
+    redis = get_redis()
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT, blocking=False)
+    if not lock.acquire():
+        # the other flush may already have checked the queue for the messages that scheduled this one
+        return 0, settings.EMAIL_BATCH_WINDOW
+    try:
+        return _flush(redis, lock)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            logger.warning('Mail flush lock expired before the flush ended')
+
+
+def _flush(redis, lock):
+    # a batch left behind by a worker that died while sending it
+    requeue(redis.lrange(PROCESSING_KEY, 0, -1))
+    messages = pop_batch(settings.EMAIL_BATCH_SIZE)
+    sent = send_batch(messages, lock) if messages else 0
+    if not redis.llen(QUEUE_KEY):
+        redis.delete(FLUSH_SCHEDULED_KEY)
+        # a message pushed between llen and delete would have seen the flag and not scheduled a flush
+        if not redis.llen(QUEUE_KEY) or not redis.set(FLUSH_SCHEDULED_KEY, 1, nx=True):
+            return sent, None
+    countdown = max(settings.EMAIL_BATCH_WINDOW, len(messages) / settings.EMAIL_RATE_LIMIT)
+    redis.expire(FLUSH_SCHEDULED_KEY, max(int(countdown) * 10, 60))
+    return sent, countdown
+
+
+def clear_scheduled():
+    # the next enqueue() schedules a flush again
+    get_redis().delete(FLUSH_SCHEDULED_KEY)
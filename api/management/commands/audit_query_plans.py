@@ -0,0 +1,101 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.management.commands.benchmark_endpoints import bench_client, route_requests, send
+from api.urls import urlpatterns
+
+# SQLite: "SCAN api_post", "SCAN TABLE api_post" before 3.36 (PostgreSQL: "Seq Scan on api_post"). Walking an
+# index in order (ORDER BY ... LIMIT) and FTS virtual tables are not reported, neither are scans of subqueries,
+# SQLite names them in parentheses, as a CO-ROUTINE or, before 3.36, as "SUBQUERY n"
+FULL_SCAN = re.compile(
+    r'^SCAN (TABLE )?(?!\(|SUBQUERY |.*VIRTUAL TABLE|.*USING (COVERING )?INDEX)(?P<table>\S+)|Seq Scan')
+COROUTINE = re.compile(r'^(CO-ROUTINE|MATERIALIZE) (?P<name>\S+)')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+class QueryCollector:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(EXPLAINED):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    # SQLite rows are (id, parent, notused, detail), other backends return the plan text in the first column
+    return [str(row[-1] if connection.vendor == 'sqlite' else row[0]) for row in rows]
+
+
+def is_full_scan(line, plan):
+    match = FULL_SCAN.search(line)
+    if match is None:
+        return False
+    subqueries = {m['name'] for m in map(COROUTINE.search, plan) if m}
+    return match['table'] not in subqueries
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every route in api/urls.py (as benchmark_endpoints does), captures its queries and prints "
+        "their query plans, flagging full table scans and temporary sorts. Run it on a database filled by "
+        "generate_fixtures; --fail-on-scan exits with an error when a scan is found, for CI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', action='append', default=None, help='Only audit these routes')
+        parser.add_argument('--fail-on-scan', action='store_true')
+        parser.add_argument('--only-flagged', action='store_true', help='Only print queries with a finding')
+
+    def handle(self, *args, route, fail_on_scan, only_flagged, **options):
+        scans = 0
+        with bench_client() as (client, user):
+            requests = route_requests(user)
+            for pattern in urlpatterns:
+                name = str(pattern.pattern)
+                if (route and name not in route) or name not in requests:
+                    continue
+                collector = QueryCollector()
+                with connection.execute_wrapper(collector):
+                    send(client, *requests[name])
+                scans += self.report(name, collector.queries, only_flagged)
+
+        if scans:
+            message = f'{scans} full table scan(s) found.'
+            if fail_on_scan:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full table scans.'))
+
+    def report(self, name, queries, only_flagged):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{name} ({len(queries)} queries)'))
+        scans = 0
+        seen = set()
+        for sql, params in queries:
+            # django_session and the like are looked up by primary key; only report a statement once per route
+            if sql in seen:
+                continue
+            seen.add(sql)
+            plan = explain(sql, params)
+            full_scans = [line for line in plan if is_full_scan(line, plan)]
+            scans += len(full_scans)
+            if only_flagged and not full_scans and not any(TEMP_SORT.search(line) for line in plan):
+                continue
+            self.stdout.write(f'  {sql}')
+            for line in plan:
+                if line in full_scans:
+                    self.stdout.write(self.style.ERROR(f'    {line}  <-- full scan'))
+                elif TEMP_SORT.search(line):
+                    self.stdout.write(self.style.WARNING(f'    {line}  <-- temp sort'))
+                else:
+                    self.stdout.write(f'    {line}')
+        return scans
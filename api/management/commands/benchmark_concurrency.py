@@ -0,0 +1,160 @@
+import multiprocessing
+import random
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction, OperationalError
+from django.test import Client, override_settings
+
+from api.management.commands.benchmark_endpoints import percentile
+from api.models import Order, User, Product
+
+# what the database looks like without DATABASE_PROFILE=production. journal_mode is stored in the database
+# file, so handle() switches it back to what it was before the first profile.
+DEVELOPMENT_SETTINGS = {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}
+DEVELOPMENT_PRAGMAS = {'journal_mode': 'DELETE'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures read throughput of GET /api/orders/<pk> while other processes insert orders, once per database "
+        "profile (development: rollback journal, a connection per request; production: see DATABASE_PROFILE "
+        "in settings). Needs a file database filled by generate_fixtures; inserted orders are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per profile')
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--profile', action='append', choices=('development', 'production'), default=None)
+
+    def handle(self, *args, duration, readers, writers, profile, **options):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            raise CommandError('Needs a SQLite database file.')
+        order_pks = list(Order.objects.values_list('pk', flat=True)[:10_000])
+        if not order_pks:
+            raise CommandError('No orders, run `manage.py generate_fixtures` first.')
+        self.order_pks = order_pks
+        self.user_pks = list(User.objects.values_list('pk', flat=True)[:1000])
+        self.product_pks = list(Product.objects.values_list('pk', flat=True)[:1000])
+
+        profiles = {
+            'development': (DEVELOPMENT_SETTINGS, DEVELOPMENT_PRAGMAS),
+            'production': (settings.SQLITE_PRODUCTION_SETTINGS, settings.SQLITE_PRODUCTION_PRAGMAS),
+        }
+        journal_mode = self.journal_mode()
+        results = {}
+        try:
+            for name in profile or profiles:
+                results[name] = self.run_profile(*profiles[name], duration, readers, writers)
+                self.report(name, results[name])
+        finally:
+            self.restore_journal_mode(journal_mode)
+
+        if 'development' in results and 'production' in results and results['development']['reads_per_s']:
+            ratio = results['production']['reads_per_s'] / results['development']['reads_per_s']
+            self.stdout.write(self.style.SUCCESS(f'production profile: {ratio:.1f}x the read throughput'))
+
+    def run_profile(self, database_settings, pragmas, duration, readers, writers):
+        settings_dict = connections.settings[connection.alias]
+        saved = {key: settings_dict.get(key) for key in database_settings}
+        settings_dict.update(database_settings)
+        # the connection of this thread was opened with the previous profile
+        connection.close()
+        try:
+            with override_settings(SQLITE_PRAGMAS=pragmas, API_PERF_SAMPLE_RATE=0):
+                journal_mode = self.journal_mode()
+                result = self.run_workers(duration, readers, writers)
+        finally:
+            connection.close()
+            settings_dict.update(saved)
+        result['journal_mode'] = journal_mode
+        return result
+
+    def journal_mode(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+
+    def restore_journal_mode(self, journal_mode):
+        # opened without the pragmas of the last profile, they would switch journal_mode again
+        connection.close()
+        with override_settings(SQLITE_PRAGMAS={}):
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+            connection.close()
+        self.stdout.write(f'journal mode restored to {journal_mode}')
+
+    def run_workers(self, duration, readers, writers):
+        # processes rather than threads, so the readers are not serialized by the GIL instead of the database
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(readers + writers + 1)
+        stop = context.Event()
+        results = context.Queue()
+        # forked children must not share the parent's sqlite3 connection
+        connections.close_all()
+
+        workers = [context.Process(target=self.reader, args=(barrier, stop, results)) for _ in range(readers)]
+        workers += [context.Process(target=self.writer, args=(barrier, stop, results)) for _ in range(writers)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        started = perf_counter()
+        stop.wait(duration)
+        stop.set()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = perf_counter() - started
+
+        read_timings = [ms for kind, values, _ in collected if kind == 'read' for ms in values]
+        written = [pk for kind, values, _ in collected if kind == 'write' for pk in values]
+        Order.objects.filter(pk__in=written).delete()
+        return {
+            'reads_per_s': round(len(read_timings) / elapsed, 1),
+            'read_p50_ms': round(percentile(read_timings, 50), 3) if read_timings else None,
+            'read_p95_ms': round(percentile(read_timings, 95), 3) if read_timings else None,
+            'read_errors': sum(errors for kind, _, errors in collected if kind == 'read'),
+            'writes_per_s': round(len(written) / elapsed, 1),
+            'write_errors': sum(errors for kind, _, errors in collected if kind == 'write'),
+        }
+
+    def reader(self, barrier, stop, results):
+        client = Client(raise_request_exception=False)
+        timings, errors = [], 0
+        barrier.wait()
+        while not stop.is_set():
+            started = perf_counter()
+            response = client.get(f'/api/orders/{random.choice(self.order_pks)}')
+            if response.status_code == 200:
+                timings.append((perf_counter() - started) * 1000)
+            else:
+                errors += 1
+        connections.close_all()
+        results.put(('read', timings, errors))
+
+    def writer(self, barrier, stop, results):
+        pks, errors = [], 0
+        barrier.wait()
+        while not stop.is_set():
+            try:
+                with transaction.atomic():
+                    pks.append(Order.objects.create(
+                        user_id=random.choice(self.user_pks) if self.user_pks else None,
+                        phone_number='+998901234567', longitude='69.240562', latitude='41.311081',
+                        status=Order.OrderStatusChoice.in_process, quantity=1, amount=1000,
+                        product_id=random.choice(self.product_pks) if self.product_pks else None,
+                    ).pk)
+            except OperationalError:
+                errors += 1
+        connections.close_all()
+        results.put(('write', pks, errors))
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:12} journal {result['journal_mode']:7} reads/s {result['reads_per_s']:9}  "
+            f"read p50 {result['read_p50_ms']} ms  p95 {result['read_p95_ms']} ms  "
+            f"read errors {result['read_errors']}  writes/s {result['writes_per_s']:8}  "
+            f"write errors {result['write_errors']}"
+        )
@@ -0,0 +1,213 @@
+import json
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from statistics import mean
+from time import perf_counter
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from api.management.commands.generate_fixtures import BENCH_PASSWORD
+from api.middleware import RequestTimings
+from api.models import User, Post, Job, Employee, Category, Product, Order
+from api.urls import urlpatterns
+from root.celery import app as celery_app
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def first_pk(model, **filters):
+    pk = model.objects.filter(**filters).values_list('pk', flat=True).first()
+    if pk is None:
+        raise CommandError(f'No {model.__name__} rows, run `manage.py generate_fixtures` first.')
+    return pk
+
+
+def route_requests(user):
+    """
+    route -> (method, path, data). `data` of a POST is sent as JSON unless it contains a file.
+    """
+    post = first_pk(Post)
+    category = first_pk(Category)
+    search_word = (Product.objects.values_list('name', flat=True).first() or 'phone').split()[0]
+    return {
+        'post': ('GET', '/api/post', None),
+        'post-create/': ('POST', '/api/post-create/', lambda: {
+            'title': 'Benchmark', 'description': 'Benchmark post', 'deadline': timezone.now() + timedelta(days=1),
+            'user': user.pk, 'file': SimpleUploadedFile('bench.txt', b'benchmark'),
+        }),
+        'subjob/': ('GET', '/api/subjob/', None),
+        'subjob-detail': ('GET', f'/api/subjob-detail?pk={first_pk(Job)}', None),
+        'employee/': ('GET', '/api/employee/', None),
+        'employee/<int:pk>': ('GET', f'/api/employee/{first_pk(Employee)}', None),
+        'post/<int:pk>': ('GET', f'/api/post/{post}', None),
+        'my-posts/': ('GET', '/api/my-posts/', None),
+        'popular-user/': ('GET', '/api/popular-user/', None),
+        'the-best/': ('GET', '/api/the-best/', None),
+        'employee-front-end/': ('GET', '/api/employee-front-end/', None),
+        'expired-posts/': ('GET', '/api/expired-posts/', None),
+        'create-product/': ('POST', '/api/create-product/', lambda: {
+            'name': 'Benchmark product', 'price': 1000, 'category': category,
+        }),
+        'orders/<int:pk>': ('GET', f'/api/orders/{first_pk(Order)}', None),
+        'orders/nearby/': ('GET', '/api/orders/nearby/?latitude=41.311081&longitude=69.240562&radius=2000', None),
+        'reports/revenue/products/': ('GET', '/api/reports/revenue/products/?limit=50', None),
+        'reports/revenue/categories/': ('GET', '/api/reports/revenue/categories/', None),
+        'reports/revenue/statuses/': ('GET', '/api/reports/revenue/statuses/', None),
+        'product/': ('GET', '/api/product/?fields=id,name,price', None),
+        'category/<int:pk>': ('GET', f'/api/category/{category}', None),
+        'catalog/': ('GET', '/api/catalog/', None),
+        'category-create/': ('POST', '/api/category-create/', lambda: {'name': 'Benchmark'}),
+        'order-create/': ('POST', '/api/order-create/', lambda: {
+            'phone_number': '+998901234567', 'longitude': '69.240562', 'latitude': '41.311081',
+            'status': Order.OrderStatusChoice.in_process, 'quantity': 1, 'amount': 1000,
+        }),
+        'profile/': ('POST', '/api/profile/', lambda: {}),
+        'search/': ('GET', f'/api/search/?search={search_word}', None),
+        'products/<int:pk>/activate': ('GET', f'/api/products/{first_pk(Product)}/activate', None),
+        'test-order/': ('POST', '/api/test-order/', lambda: {'is_status': False}),
+        'auth/register/': ('POST', '/api/auth/register/', lambda: {
+            'first_name': 'Bench', 'last_name': 'Mark', 'email': 'benchmark-register@example.com',
+        }),
+        'auth/register/check/': ('POST', '/api/auth/register/check/', lambda: {
+            'code': 123456, 'password': BENCH_PASSWORD, 'confirm_password': BENCH_PASSWORD,
+        }),
+        'auth/forgot_password/': ('POST', '/api/auth/forgot_password/', lambda: {'email': user.email}),
+        'auth/forgot_password/check/': ('POST', '/api/auth/forgot_password/check/', lambda: {
+            'code': 123456, 'new_password': BENCH_PASSWORD,
+        }),
+        'login/': ('POST', '/api/login/', lambda: {'email': user.email, 'password': BENCH_PASSWORD}),
+    }
+
+
+@contextmanager
+def bench_client():
+    """
+    Test client logged in as a generated user, with mail, Celery and uploads kept inside the process.
+    """
+    user = User.objects.filter(email__startswith='bench-').first()
+    if user is None:
+        raise CommandError('No generated users, run `manage.py generate_fixtures` first.')
+
+    # broken routes are reported with their 500 status instead of aborting the run
+    client = Client(raise_request_exception=False)
+    client.force_login(user)
+    # verification emails are sent in-process to the locmem outbox instead of through the broker
+    celery_app.conf.task_always_eager = True
+
+    with tempfile.TemporaryDirectory() as media_root, override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', MEDIA_ROOT=media_root,
+            API_PERF_SAMPLE_RATE=0):
+        yield client, user
+
+
+def send(client, method, path, data):
+    if method == 'GET':
+        response = client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+    payload = data()
+    try:
+        with transaction.atomic():
+            if any(isinstance(value, SimpleUploadedFile) for value in payload.values()):
+                response = client.post(path, data=payload)
+            else:
+                response = client.post(path, data=json.dumps(payload, default=str),
+                                       content_type='application/json')
+            raise Rollback
+    except Rollback:
+        return response
+
+
+class Command(BaseCommand):
+    help = (
+        "Times every route in api/urls.py against the current database (see generate_fixtures) and reports "
+        "p50/p95 latency and query counts. Write requests run inside a rolled back transaction. "
+        "--output saves the results as JSON so runs can be compared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--output', default=None, help='Path of the JSON report')
+        parser.add_argument('--route', action='append', default=None, help='Only benchmark these routes')
+
+    def handle(self, *args, iterations, warmup, output, route, **options):
+        results = {}
+        with bench_client() as (client, user):
+            requests = route_requests(user)
+            for pattern in urlpatterns:
+                name = str(pattern.pattern)
+                if route and name not in route:
+                    continue
+                if name not in requests:
+                    self.stderr.write(f'{name}: no benchmark request defined, skipped')
+                    continue
+                results[name] = self.measure(client, *requests[name], iterations=iterations, warmup=warmup)
+                self.report(name, results[name])
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump({'meta': self.meta(iterations), 'routes': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Saved to {output}'))
+
+    def measure(self, client, method, path, data, iterations, warmup):
+        timings, queries, sql, statuses = [], [], [], set()
+        for i in range(warmup + iterations):
+            counter = RequestTimings()
+            started = perf_counter()
+            with connection.execute_wrapper(counter):
+                response = send(client, method, path, data)
+            elapsed = perf_counter() - started
+            if i < warmup:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(counter.queries)
+            sql.append(counter.sql * 1000)
+            statuses.add(response.status_code)
+        return {
+            'method': method,
+            'path': path,
+            'iterations': iterations,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'mean_ms': round(mean(timings), 3),
+            'sql_ms': round(mean(sql), 3),
+            'queries': round(mean(queries), 1),
+            'max_queries': max(queries),
+            'statuses': sorted(statuses),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{result['method']:4} {name:32} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+            f"queries {result['queries']:7}  status {result['statuses']}"
+        )
+
+    @staticmethod
+    def meta(iterations):
+        try:
+            revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+        except OSError:
+            revision = None
+        return {
+            'created': timezone.now().isoformat(),
+            'revision': revision,
+            'database': connection.vendor,
+            'iterations': iterations,
+            'rows': {model.__name__: model.objects.count() for model in (User, Post, Employee, Product, Order)},
+        }
@@ -0,0 +1,67 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Post, SubJob, Employee, Product
+from api.serializers import PostModelSerializer, SubJobModelSerializer, EmployeeModelSerializer, \
+    MyPostModelSerializer, ExpiredPostModelSerializer, ProductDynamicModelSerializer, RatedEmployeeModelSerializer
+
+
+def cases():
+    return [
+        (PostModelSerializer, Post.objects.prefetch_related('jobs').order_by('id')),
+        (SubJobModelSerializer, SubJob.objects.order_by('id')),
+        (EmployeeModelSerializer, Employee.objects.select_related('user').order_by('id')),
+        (RatedEmployeeModelSerializer, Employee.objects.select_related('user').order_by('id')),
+        (MyPostModelSerializer, Post.objects.order_by('id')),
+        (ExpiredPostModelSerializer, Post.objects.order_by('id')),
+        (ProductDynamicModelSerializer, Product.objects.order_by('id')),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Serializes --rows rows of every list serializer with FastReadMixin both ways, the regular DRF "
+        "serializer and fast_data() (api/fast_serializers.py), and reports the median time of each, queries "
+        "included. Fails if the rendered JSON of the two differs by a single byte. Fill the database with "
+        "generate_fixtures --scale 10000 or more first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--iterations', type=int, default=3)
+
+    def handle(self, *args, rows, iterations, **options):
+        renderer = JSONRenderer()
+        mismatches = []
+        for serializer_class, queryset in cases():
+            queryset = queryset[:rows]
+
+            def regular():
+                return serializer_class(instance=queryset.all(), many=True).data
+
+            def fast():
+                return serializer_class.fast_data(queryset.all())
+
+            results = {}
+            for name, func in (('drf', regular), ('fast', fast)):
+                timings = []
+                for _ in range(iterations):
+                    started = perf_counter()
+                    data = func()
+                    timings.append((perf_counter() - started) * 1000)
+                results[name] = (median(timings), renderer.render(data))
+
+            (drf_ms, drf_json), (fast_ms, fast_json) = results['drf'], results['fast']
+            identical = drf_json == fast_json
+            if not identical:
+                mismatches.append(serializer_class.__name__)
+            self.stdout.write(
+                f'{serializer_class.__name__:32} rows {queryset.count():7}  drf {drf_ms:9.1f} ms  '
+                f'fast {fast_ms:8.1f} ms  {drf_ms / fast_ms:5.1f}x  identical {identical}'
+            )
+
+        if mismatches:
+            raise CommandError(f'Different output: {", ".join(mismatches)}')
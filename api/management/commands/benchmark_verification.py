@@ -0,0 +1,88 @@
+import json
+import re
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password, check_password
+from django.core import mail
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.management.commands.benchmark_endpoints import Rollback, bench_client, percentile, route_requests
+from api.tokens import make_verification_token, check_verification_token, REGISTER
+
+# (issuing route, checking route): the code mailed by the first is sent to the second with its cookie
+FLOWS = (
+    ('auth/register/', 'auth/register/check/'),
+    ('auth/forgot_password/', 'auth/forgot_password/check/'),
+)
+mailed_code = re.compile(r'\d{6}')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the per-request cost of issuing and checking a verification code: the old PBKDF2 "
+        "make_password/check_password pair against the HMAC tokens of api.tokens. Then times the register and "
+        "forgot password endpoints with their check endpoints, each pair inside a rolled back transaction "
+        "(see generate_fixtures)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, iterations, **options):
+        self.compare_hashing(iterations)
+        with bench_client() as (client, user):
+            requests = route_requests(user)
+            for issue, check in FLOWS:
+                timings = self.measure_flow(client, requests[issue], requests[check], iterations)
+                for name, (elapsed, statuses) in zip((issue, check), timings):
+                    self.stdout.write(
+                        f'POST {name:28} p50 {percentile(elapsed, 50):9.2f} ms  '
+                        f'{len(elapsed) / sum(elapsed) * 1000:8.1f} per second  status {sorted(statuses)}'
+                    )
+
+    def compare_hashing(self, iterations):
+        email, code = 'bench@example.com', 123456
+
+        def pbkdf2():
+            assert check_password(code, make_password(str(code)))
+
+        def hmac():
+            assert check_verification_token(make_verification_token(email, code, REGISTER), code, REGISTER) == email
+
+        results = {}
+        for name, func in (('pbkdf2', pbkdf2), ('hmac', hmac)):
+            # the HMAC path is ~10^5 times cheaper, give it enough iterations to measure
+            n = iterations if name == 'pbkdf2' else iterations * 1000
+            started = perf_counter()
+            for _ in range(n):
+                func()
+            elapsed = perf_counter() - started
+            results[name] = n / elapsed
+            self.stdout.write(
+                f'{name:7} {elapsed / n * 1000:10.4f} ms per issue+check  {results[name]:12.1f} per second')
+        self.stdout.write(self.style.SUCCESS(f"HMAC tokens: {results['hmac'] / results['pbkdf2']:.0f}x the throughput"))
+
+    def measure_flow(self, client, issue, check, iterations):
+        """
+        [(timings in ms, statuses)] of the issuing and the checking request.
+        """
+        timings = ([], set()), ([], set())
+        for _ in range(iterations):
+            try:
+                with transaction.atomic():
+                    code = None
+                    for (elapsed, statuses), (method, path, data) in zip(timings, (issue, check)):
+                        payload = data()
+                        if code is not None:
+                            payload['code'] = code
+                        started = perf_counter()
+                        # the test client keeps the verification cookie of the first response for the second
+                        response = client.post(path, data=json.dumps(payload), content_type='application/json')
+                        elapsed.append((perf_counter() - started) * 1000)
+                        statuses.add(response.status_code)
+                        code = int(mailed_code.search(mail.outbox[-1].body).group())
+                    raise Rollback
+            except Rollback:
+                pass
+        return timings
@@ -0,0 +1,164 @@
+import random
+import secrets
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.catalog import build_snapshot
+from api.models import User, Post, Job, SubJob, Employee, Rating, Category, Product, Order, OrderItem
+
+BENCH_PASSWORD = 'bench-password'
+
+WORDS = (
+    'apple', 'phone', 'laptop', 'cable', 'charger', 'case', 'glass', 'screen', 'speaker', 'watch', 'camera',
+    'keyboard', 'mouse', 'monitor', 'tablet', 'router', 'lamp', 'chair', 'desk', 'bag', 'bottle', 'shoe',
+    'shirt', 'jacket', 'book', 'pen', 'notebook', 'headphones', 'battery', 'adapter', 'printer', 'drone',
+)
+CATEGORY_NAMES = (
+    'Electronics', 'Clothes', 'Books', 'Home', 'Garden', 'Sport', 'Toys', 'Beauty', 'Food', 'Auto',
+)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates linked Users, Posts, Jobs/SubJobs, Employees, Ratings, Categories, Products, Orders and "
+        "OrderItems with bulk inserts. --scale is the row count of the biggest tables (posts, orders, ratings); "
+        f"the others are derived from it. Every generated user has the password '{BENCH_PASSWORD}'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=10_000)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, scale, batch_size, seed, **options):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        self.run = secrets.token_hex(4)
+
+        counts = {
+            'users': max(scale // 10, 10),
+            'jobs': max(scale // 100, 5),
+            'subjobs': max(scale // 20, 10),
+            'employees': max(scale // 10, 10),
+            'ratings': scale,
+            'categories': max(scale // 1000, len(CATEGORY_NAMES)),
+            'products': max(scale // 10, 10),
+            'posts': scale,
+            'orders': scale,
+        }
+
+        users = self.create_users(counts['users'])
+        jobs = self.bulk(Job, (Job(name=f'Job {self.run} {i}') for i in range(counts['jobs'])))
+        self.bulk(SubJob, (SubJob(job_id=self.random.choice(jobs), name=f'SubJob {i}')
+                           for i in range(counts['subjobs'])))
+        self.create_posts(counts['posts'], users, jobs)
+        employees = self.bulk(Employee, (
+            Employee(user_id=self.random.choice(users), experience=self.random.randint(0, 15),
+                     linkedin=f'https://linkedin.com/in/bench-{i}', description=self.sentence(12),
+                     cv='user_cv/bench.pdf')
+            for i in range(counts['employees'])
+        ))
+        self.bulk(Rating, (
+            Rating(employee_id=self.random.choice(employees), rating=str(self.random.randint(1, 5)))
+            for _ in range(counts['ratings'])
+        ))
+        categories = self.bulk(Category, (
+            Category(name=f'{CATEGORY_NAMES[i % len(CATEGORY_NAMES)]}{"" if i < len(CATEGORY_NAMES) else i}')
+            for i in range(counts['categories'])
+        ))
+        products = self.create_products(counts['products'], categories)
+        self.create_orders(counts['orders'], users, products)
+
+        # bulk_create skips signals, so rebuild what they would have maintained
+        Employee.rebuild_rating_aggregates()
+        Order.rebuild_revenue()
+        build_snapshot()
+        Post.expire_overdue(batch_size=batch_size)
+        cache.clear()
+
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(self.style.SUCCESS(f'Fixtures generated (run {self.run}).'))
+
+    def bulk(self, model, objects):
+        """
+        Inserts `objects` in batches and returns the new primary keys.
+        """
+        pks = []
+        for chunk in chunked(objects, self.batch_size):
+            with transaction.atomic():
+                pks.extend(obj.pk for obj in model.objects.bulk_create(chunk))
+        return pks
+
+    def sentence(self, words):
+        return ' '.join(self.random.choices(WORDS, k=words))
+
+    def create_users(self, count):
+        password = make_password(BENCH_PASSWORD)
+        return self.bulk(User, (
+            User(email=f'bench-{self.run}-{i}@example.com', password=password, first_name=f'User{i}',
+                 last_name=f'Bench{i}', phone_number=f'+99890{i:07d}', is_active=True)
+            for i in range(count)
+        ))
+
+    def create_posts(self, count, users, jobs):
+        # overdue new posts are expired afterwards, like expire_posts_task does
+        statuses = (Post.PostStatusChoice.NEW, Post.PostStatusChoice.COMPLETED)
+        posts = (
+            Post(title=self.sentence(3), description=self.sentence(20), file='posts/bench.txt',
+                 deadline=self.now + timedelta(hours=self.random.randint(-24 * 30, 24 * 30)),
+                 status=self.random.choice(statuses), user_id=self.random.choice(users))
+            for _ in range(count)
+        )
+        through = Post.jobs.through
+        for chunk in chunked(posts, self.batch_size):
+            with transaction.atomic():
+                created = Post.objects.bulk_create(chunk)
+                through.objects.bulk_create(
+                    through(post_id=post.pk, job_id=job)
+                    for post in created
+                    for job in set(self.random.choices(jobs, k=2))
+                )
+
+    def create_products(self, count, categories):
+        return self.bulk(Product, (
+            Product(name=f'{self.sentence(2).title()} {i}', price=self.random.randint(1_000, 10_000_000),
+                    discount=Decimal(self.random.choice((0, 5, 10, 25, 50))), sale=self.random.random() < 0.2,
+                    description=self.sentence(30), category_id=self.random.choice(categories),
+                    is_active=self.random.random() < 0.9)
+            for i in range(count)
+        ))
+
+    def create_orders(self, count, users, products):
+        statuses = Order.OrderStatusChoice.values
+        orders = (
+            Order(user_id=self.random.choice(users), phone_number=f'+99890{self.random.randint(0, 9_999_999):07d}',
+                  longitude=Decimal(f'{self.random.uniform(69.1, 69.4):.6f}'),
+                  latitude=Decimal(f'{self.random.uniform(41.2, 41.4):.6f}'),
+                  status=self.random.choice(statuses), quantity=self.random.randint(1, 5),
+                  amount=self.random.randint(10, 1_000_000), product_id=self.random.choice(products))
+            for _ in range(count)
+        )
+        for chunk in chunked(orders, self.batch_size):
+            with transaction.atomic():
+                created = Order.objects.bulk_create(chunk)
+                OrderItem.objects.bulk_create(
+                    OrderItem(order_id=order.pk, product_id=self.random.choice(products),
+                              count=self.random.randint(1, 3))
+                    for order in created
+                    for _ in range(self.random.randint(1, 3))
+                )
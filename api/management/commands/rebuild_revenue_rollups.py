@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Order, ProductRevenue, CategoryRevenue, StatusRevenue
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the order revenue rollups (ProductRevenue, CategoryRevenue, StatusRevenue) from the orders in "
+        "one transaction. Run it after writing orders without signals: raw SQL, queryset update(), imports."
+    )
+
+    def handle(self, *args, **options):
+        Order.rebuild_revenue()
+        for model in (ProductRevenue, CategoryRevenue, StatusRevenue):
+            self.stdout.write(f'{model.__name__}: {model.objects.count()} groups')
+        self.stdout.write(self.style.SUCCESS('Revenue rollups rebuilt.'))
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the default SQLite database into the replica files of DATABASE_REPLICAS with the SQLite backup "
+        "API, to try the read/write routing (api/routers.py) locally without real replication. Run it again "
+        "whenever the replicas should catch up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', action='append', default=None, help='Only copy into these aliases')
+
+    def handle(self, *args, replica, **options):
+        replicas = replica or settings.DATABASE_REPLICAS
+        if not replicas:
+            raise CommandError('No replicas, set DATABASE_REPLICAS=/path/to/replica.sqlite3')
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied, replicate other databases with their own tools.')
+
+        primary.ensure_connection()
+        for alias in replicas:
+            if alias not in settings.DATABASE_REPLICAS:
+                raise CommandError(f'{alias} is not in DATABASE_REPLICAS')
+            target = connections[alias]
+            target.ensure_connection()
+            primary.connection.backup(target.connection)
+            target.close()
+            self.stdout.write(self.style.SUCCESS(f"{alias}: copied to {target.settings_dict['NAME']}"))
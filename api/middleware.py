@@ -0,0 +1,213 @@
+import json
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger('api.performance')
+
+current_timings = ContextVar('api_performance_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.sql = 0.0
+        self.serializer = 0.0
+        self.serializer_depth = 0
+        self.render = 0.0
+        self.render_started = None
+        self.extra = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # django.db execute_wrapper: counts every query on every connection
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += perf_counter() - started
+            self.queries += 1
+
+
+def record_timing(name, seconds):
+    """
+    Adds a custom measurement (e.g. password hashing) to the current request's Server-Timing and log line.
+    """
+    timings = current_timings.get()
+    if timings is not None:
+        timings.extra[name] = timings.extra.get(name, 0.0) + seconds
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def install_query_timer(sender=None, connection=None, **kwargs):
+    # installed once per connection; the ContextVar carries the timings into sync_to_async threads too.
+    # Index 0 so the pop() of a later `with connection.execute_wrapper(...)` never removes it.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_timer)
+
+
+@contextmanager
+def serializer_timing():
+    """
+    Counts the block as serialization time of the current request, for serializers that don't go through
+    `BaseSerializer.data` (api/fast_serializers.py). Nested blocks are only counted once.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    timings.serializer_depth += 1
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer_depth -= 1
+        if not timings.serializer_depth:
+            timings.serializer += perf_counter() - started
+
+
+def install_serializer_timer():
+    """
+    Wraps `BaseSerializer.data` so the middleware can report serialization time. Nested `.data` calls
+    (e.g. a serializer serializing its children) are only counted once.
+    """
+    data = BaseSerializer.data
+    if getattr(data.fget, 'timed', False):
+        return
+
+    def timed_data(self):
+        with serializer_timing():
+            return data.fget(self)
+
+    timed_data.timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+class PerformanceMiddleware:
+    """
+    For a sample of requests to the `api` views records query count, SQL time, serializer time and
+    render time, sends them back in a `Server-Timing` header and logs them as one JSON line to the
+    `api.performance` logger. Views going over their query budget are logged as warnings.
+
+    Settings:
+        API_PERF_SAMPLE_RATE          share of requests to measure, 0..1 (default 0.01)
+        API_PERF_QUERY_BUDGET         default max queries per request (default 20)
+        API_PERF_QUERY_BUDGETS        {'view_function_name': max_queries} overrides
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'API_PERF_SAMPLE_RATE', 0.01)
+        self.default_budget = getattr(settings, 'API_PERF_QUERY_BUDGET', 20)
+        self.budgets = getattr(settings, 'API_PERF_QUERY_BUDGETS', {})
+        install_serializer_timer()
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection=connection)
+
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        self.finish(request, response, timings, perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        self.finish(request, response, timings, perf_counter() - started)
+        return response
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def finish(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return
+        # @api_view functions are wrapped in a view class named after the function
+        view = getattr(match.func, 'cls', match.func)
+        if view.__module__.startswith('api.'):
+            timings.view = view.__name__
+            self.report(request, response, timings, total)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        timings = current_timings.get()
+        if timings is not None:
+            timings.render_started = perf_counter()
+            response.add_post_render_callback(lambda r: self.render_finished(timings))
+        return response
+
+    @staticmethod
+    def render_finished(timings):
+        timings.render = perf_counter() - timings.render_started
+
+    def report(self, request, response, timings, total):
+        budget = self.budgets.get(timings.view, self.default_budget)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings.sql * 1000:.2f};desc="{timings.queries} queries"',
+            f'serializer;dur={timings.serializer * 1000:.2f}',
+            f'render;dur={timings.render * 1000:.2f}',
+            *(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.extra.items()),
+            f'total;dur={total * 1000:.2f}',
+        ])
+        record = {
+            'view': timings.view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            # streamed bodies are serialized after the middleware returns and aren't in these numbers
+            'streaming': response.streaming,
+            'queries': timings.queries,
+            'query_budget': budget,
+            'sql_ms': round(timings.sql * 1000, 2),
+            'serializer_ms': round(timings.serializer * 1000, 2),
+            'render_ms': round(timings.render * 1000, 2),
+            **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in timings.extra.items()},
+            'total_ms': round(total * 1000, 2),
+        }
+        if timings.queries > budget:
+            logger.warning(json.dumps({**record, 'over_query_budget': True}))
+        else:
+            logger.info(json.dumps(record))
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_user_managers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', 'deadline', 'id'], name='post_status_deadline_id_idx'),
+        ),
+    ]
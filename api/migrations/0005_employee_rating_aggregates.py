@@ -0,0 +1,46 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:29
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, OuterRef, Subquery
+from django.db.models.fields import IntegerField, FloatField
+from django.db.models.functions import Cast, Coalesce
+
+
+def backfill_ratings(apps, schema_editor):
+    Employee = apps.get_model('api', 'Employee')
+    Rating = apps.get_model('api', 'Rating')
+    per_employee = Rating.objects.filter(employee=OuterRef('pk')).order_by().values('employee')
+    total = Subquery(per_employee.annotate(total=Sum(Cast('rating', IntegerField()))).values('total'))
+    count = Subquery(per_employee.annotate(count=Count('id')).values('count'))
+    Employee.objects.update(rating_sum=Coalesce(total, 0), rating_count=Coalesce(count, 0),
+                            rating_avg=Cast(total, FloatField()) / count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_post_status_deadline_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='rating_avg',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['-rating_avg', '-experience'], name='employee_rating_avg_idx'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
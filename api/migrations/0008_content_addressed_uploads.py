@@ -0,0 +1,24 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:49
+
+import api.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='employee',
+            name='cv',
+            field=models.FileField(storage=api.uploads.ContentAddressedStorage(), upload_to='user_cv/'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='file',
+            field=models.FileField(storage=api.uploads.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+    ]
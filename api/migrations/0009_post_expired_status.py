@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:50
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def expire_overdue_posts(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Post.objects.filter(status='new', deadline__lt=timezone.now()).update(status='expired')
+
+
+def unexpire_posts(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Post.objects.filter(status='expired').update(status='new')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_content_addressed_uploads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='status',
+            field=models.CharField(choices=[('new', 'New'), ('completed', 'Completed'), ('expired', 'Expired')], default='new', max_length=55),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('status', 'expired')), fields=['id'], name='post_expired_idx'),
+        ),
+        migrations.RunPython(expire_overdue_posts, unexpire_posts),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:59
+
+import api.geo
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def fill_geohashes(apps, schema_editor):
+    for name in ('Order', 'TestOrder'):
+        model = apps.get_model('api', name)
+        rows = model.objects.filter(latitude__isnull=False, longitude__isnull=False).order_by('pk') \
+            .only('pk', 'latitude', 'longitude')
+        last_pk = 0
+        while batch := list(rows.filter(pk__gt=last_pk)[:BATCH_SIZE]):
+            for obj in batch:
+                obj.geohash = api.geo.encode(obj.latitude, obj.longitude)
+            model.objects.bulk_update(batch, ['geohash'])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_post_expired_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='geohash',
+            field=api.geo.GeohashField(),
+        ),
+        migrations.AddField(
+            model_name='testorder',
+            name='geohash',
+            field=api.geo.GeohashField(),
+        ),
+        migrations.RunPython(fill_geohashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['geohash'], name='order_geohash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testorder',
+            index=models.Index(fields=['geohash'], name='testorder_geohash_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.5 on 2026-10-17 16:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def fill_rollups(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    rollups = [
+        ('ProductRevenue', ['product_id', 'status'], Order.objects.filter(product__isnull=False)),
+        ('CategoryRevenue', ['category_id', 'status'], Order.objects.filter(product__isnull=False)
+         .annotate(category_id=F('product__category_id'))),
+        ('StatusRevenue', ['status'], Order.objects.all()),
+    ]
+    for name, keys, orders in rollups:
+        model = apps.get_model('api', name)
+        totals = orders.order_by().values(*keys).annotate(
+            order_count=Count('id'), total_quantity=Sum('quantity'), revenue=Sum('amount'))
+        model.objects.bulk_create((
+            model(order_count=row['order_count'], quantity=row['total_quantity'], revenue=row['revenue'],
+                  **{key: row[key] for key in keys})
+            for row in totals.iterator()
+        ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_order_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_count', models.IntegerField(default=0)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('status', models.CharField(max_length=128, unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_count', models.IntegerField(default=0)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('status', models.CharField(max_length=128)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue', to='api.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'status'), name='category_revenue_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_count', models.IntegerField(default=0)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('status', models.CharField(max_length=128)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue', to='api.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'status'), name='product_revenue_key')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,18 @@
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction, connections, router
+from django.db.models import F, Q, Case, When, Value, QuerySet, OuterRef, Subquery
 from django.db.models import Model, TextField, FileField, DateTimeField, BooleanField, CharField, ForeignKey, CASCADE, \
     ManyToManyField, DecimalField, PositiveSmallIntegerField, Sum, Count, ImageField, SET_NULL, EmailField
 from django.db.models.enums import TextChoices
-from django.db.models.fields import PositiveIntegerField, IntegerField
+from django.db.models.fields import PositiveIntegerField, IntegerField, FloatField, BigIntegerField
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from api import geo
+from api.geo import GeohashField
+from api.uploads import content_storage
 
 
 class CustomUserManager(UserManager):
@@ -53,19 +60,63 @@ class User(AbstractUser):
         return f"{self.first_name}"
 
 
+class PostQuerySet(QuerySet):
+    # Both include the new posts past their deadline that expire_posts_task hasn't reached yet, through the
+    # (status, deadline) index, so the lists are right between two runs of the task.
+
+    def open(self):
+        return self.filter(status=Post.PostStatusChoice.NEW, deadline__gte=timezone.now())
+
+    def expired(self):
+        return self.filter(
+            Q(status=Post.PostStatusChoice.EXPIRED) | Q(status=Post.PostStatusChoice.NEW, deadline__lt=timezone.now())
+        )
+
+
 class Post(Model):
     class PostStatusChoice(TextChoices):
         NEW = 'new', "New"
         COMPLETED = 'completed', 'Completed'
+        EXPIRED = 'expired', 'Expired'
 
     title = CharField(max_length=128)
     description = TextField()
-    file = FileField(upload_to='posts/')
+    file = FileField(upload_to='posts/', storage=content_storage)
     deadline = DateTimeField()
     status = CharField(max_length=55, choices=PostStatusChoice.choices, default=PostStatusChoice.NEW)
     user = ForeignKey(User, on_delete=CASCADE, related_name='posts')
     jobs = ManyToManyField('Job', related_name='posts')
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the post list: status = 'new' ORDER BY deadline, id; also finds overdue posts
+            models.Index(fields=['status', 'deadline', 'id'], name='post_status_deadline_id_idx'),
+            # expired_posts
+            models.Index(fields=['id'], condition=Q(status='expired'), name='post_expired_idx'),
+        ]
+
+    @classmethod
+    def expire_overdue(cls, batch_size=1000):
+        """
+        Moves new posts past their deadline to `expired`, `batch_size` rows per UPDATE so the write lock is
+        only held briefly. Returns the number of expired posts. Like every queryset update it sends no signals;
+        no cached response contains the status.
+        """
+        now = timezone.now()
+        expired = 0
+        while True:
+            with transaction.atomic():
+                pks = list(
+                    cls.objects.filter(status=cls.PostStatusChoice.NEW, deadline__lt=now)
+                    .values_list('pk', flat=True)[:batch_size]
+                )
+                if not pks:
+                    return expired
+                expired += cls.objects.filter(pk__in=pks, status=cls.PostStatusChoice.NEW) \
+                    .update(status=cls.PostStatusChoice.EXPIRED)
+
 
 class Job(Model):
     name = CharField(max_length=255)
@@ -81,7 +132,52 @@ class Employee(Model):
     linkedin = TextField()
     description = TextField()
     user = ForeignKey(User, on_delete=CASCADE, related_name='employees')
-    cv = FileField(upload_to='user_cv/')
+    cv = FileField(upload_to='user_cv/', storage=content_storage)
+    # Rating aggregates, kept up to date by api.signals on every Rating write
+    rating_sum = PositiveIntegerField(default=0)
+    rating_count = PositiveIntegerField(default=0)
+    rating_avg = FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating_avg', '-experience'], name='employee_rating_avg_idx'),
+        ]
+
+    @classmethod
+    def rebuild_rating_aggregates(cls):
+        # for rows written without signals (bulk_create, raw SQL, backfills); one UPDATE, so readers see the
+        # old aggregates or the new ones
+        with transaction.atomic():
+            cls.objects.update(**rating_aggregates(Rating.objects))
+
+    @classmethod
+    def apply_rating(cls, employee_id, rating, count=1):
+        rating_sum = F('rating_sum') + rating * count
+        rating_count = F('rating_count') + count
+        cls.objects.filter(pk=employee_id).update(
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            rating_avg=Case(
+                When(rating_count=-count, then=Value(None)),
+                default=Cast(rating_sum, FloatField()) / rating_count,
+            ),
+        )
+
+
+def rating_aggregates(ratings):
+    """
+    update() kwargs that set every employee's aggregates from `ratings` (a Rating manager) with correlated
+    subqueries. Migration 0005 has its own copy, against the historical models.
+    """
+    per_employee = ratings.filter(employee=OuterRef('pk')).order_by().values('employee')
+    total = Subquery(per_employee.annotate(total=Sum(Cast('rating', IntegerField()))).values('total'))
+    count = Subquery(per_employee.annotate(count=Count('id')).values('count'))
+    return {
+        'rating_sum': Coalesce(total, 0),
+        'rating_count': Coalesce(count, 0),
+        # NULL without ratings
+        'rating_avg': Cast(total, FloatField()) / count,
+    }
 
 
 class Rating(Model):
@@ -95,10 +191,38 @@ class Rating(Model):
     employee = ForeignKey(Employee, on_delete=CASCADE, related_name='ratings')
     rating = CharField(max_length=1, choices=RatingChoice.choices)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'employee_id' in instance.__dict__ and 'rating' in instance.__dict__:
+            instance._loaded_rating = (instance.employee_id, instance.rating)
+        return instance
+
+    def load_stored_rating(self):
+        # loaded with deferred fields or built by hand: what the aggregates hold is in the database
+        if not self._state.adding and getattr(self, '_loaded_rating', None) is None:
+            self._loaded_rating = Rating.objects.filter(pk=self.pk).values_list('employee_id', 'rating').first()
+
+    def save(self, *args, **kwargs):
+        # keep the Employee aggregates (updated from post_save) in the same transaction as the rating
+        with transaction.atomic():
+            self.load_stored_rating()
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.load_stored_rating()
+            return super().delete(*args, **kwargs)
+
 
 class Category(Model):
     name = CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='category_name_idx'),
+        ]
+
 
 class Product(Model):
     name = CharField(max_length=128)
@@ -111,6 +235,46 @@ class Product(Model):
     category = ForeignKey(Category, on_delete=CASCADE, related_name='products')
     is_active = BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='product_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # keep the category revenue rollups (moved from post_save) in the same transaction as the product
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class GeoQuerySet(QuerySet):
+    """
+    Location lookups through the indexed `geohash` column (see api/geo.py).
+    """
+
+    def in_box(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Rows inside the box: the geohash ranges of the cells covering it, then the exact coordinates.
+        """
+        boxes = []
+        for box in geo.split_box(min_lat, min_lon, max_lat, max_lon):
+            cells = Q(*(Q(geohash__gte=start, geohash__lt=stop) for start, stop in geo.cover(*box)), _connector=Q.OR)
+            boxes.append(cells & Q(latitude__range=geo.column_range(box[0], box[2]),
+                                   longitude__range=geo.column_range(box[1], box[3])))
+        return self.filter(Q(*boxes, _connector=Q.OR))
+
+    def within(self, latitude, longitude, radius, limit=None):
+        """
+        List of the rows at most `radius` meters away, nearest first, each with its `distance` in meters.
+        """
+        rows = []
+        for obj in self.in_box(*geo.bounding_box(latitude, longitude, radius)):
+            distance = geo.distance(latitude, longitude, obj.latitude, obj.longitude)
+            if distance <= radius:
+                obj.distance = distance
+                rows.append(obj)
+        rows.sort(key=lambda obj: (obj.distance, obj.pk))
+        return rows[:limit]
+
 
 class Order(Model):
     class OrderStatusChoice(TextChoices):
@@ -127,6 +291,76 @@ class Order(Model):
     quantity = PositiveSmallIntegerField(default=1)
     amount = IntegerField()
     product = ForeignKey(Product, on_delete=SET_NULL, related_name='orders', null=True, blank=True)
+    geohash = GeohashField()
+
+    objects = GeoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geohash'], name='order_geohash_idx'),
+        ]
+
+    # what an order adds to the revenue rollups
+    REVENUE_FIELDS = ('product_id', 'status', 'quantity', 'amount')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in instance.__dict__ for name in cls.REVENUE_FIELDS):
+            instance._loaded_revenue = instance.revenue_entry()
+        return instance
+
+    def revenue_entry(self):
+        return tuple(getattr(self, name) for name in self.REVENUE_FIELDS)
+
+    def save(self, *args, **kwargs):
+        # keep the revenue rollups (updated from post_save) in the same transaction as the order
+        with transaction.atomic():
+            if not self._state.adding and getattr(self, '_loaded_revenue', None) is None:
+                # loaded with deferred fields or built by hand: what the rollups hold is in the database
+                self._loaded_revenue = Order.objects.filter(pk=self.pk).values_list(*self.REVENUE_FIELDS).first()
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def apply_revenue(cls, added=(), removed=()):
+        """
+        Adds the revenue_entry() tuples in `added` to the rollups and takes the ones in `removed` out, one upsert
+        per changed group.
+        """
+        entries = [(entry, 1) for entry in added] + [(entry, -1) for entry in removed]
+        category_ids = dict(Product.objects.filter(pk__in={entry[0] for entry, _ in entries if entry[0]})
+                            .values_list('pk', 'category_id'))
+        products, categories, statuses = {}, {}, {}
+        for (product_id, status, quantity, amount), sign in entries:
+            totals = (sign, sign * quantity, sign * amount)
+            add_totals(statuses, (status,), totals)
+            # orders without a product only count by status
+            if product_id in category_ids:
+                add_totals(products, (product_id, status), totals)
+                add_totals(categories, (category_ids[product_id], status), totals)
+        ProductRevenue.apply(products)
+        CategoryRevenue.apply(categories)
+        StatusRevenue.apply(statuses)
+
+    @classmethod
+    def rebuild_revenue(cls):
+        # for rows written without signals (raw SQL, queryset update(), backfills)
+        rollups = [
+            (ProductRevenue, ['product_id', 'status'], cls.objects.filter(product__isnull=False)),
+            (CategoryRevenue, ['category_id', 'status'], cls.objects.filter(product__isnull=False)
+             .annotate(category_id=F('product__category_id'))),
+            (StatusRevenue, ['status'], cls.objects.all()),
+        ]
+        with transaction.atomic():
+            for model, keys, orders in rollups:
+                model.objects.all().delete()
+                totals = orders.order_by().values(*keys).annotate(
+                    order_count=Count('id'), total_quantity=Sum('quantity'), revenue=Sum('amount'))
+                model.objects.bulk_create((
+                    model(order_count=row['order_count'], quantity=row['total_quantity'], revenue=row['revenue'],
+                          **{key: row[key] for key in keys})
+                    for row in totals.iterator()
+                ), batch_size=500)
 
 
 class OrderItem(Model):
@@ -140,3 +374,97 @@ class TestOrder(Model):
     latitude = DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     phone_number = CharField(max_length=128, null=True, blank=True)
     is_status = BooleanField()
+    geohash = GeohashField()
+
+    objects = GeoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geohash'], name='testorder_geohash_idx'),
+        ]
+
+
+def add_totals(groups, key, totals):
+    current = groups.get(key, (0, 0, 0))
+    groups[key] = tuple(a + b for a, b in zip(current, totals))
+
+
+class RevenueRollup(Model):
+    """
+    Totals of the orders of one group, changed by Order.apply_revenue() in the transaction of every order write
+    (api.signals), so reports read a row per group instead of aggregating the orders.
+    """
+    order_count = IntegerField(default=0)
+    quantity = BigIntegerField(default=0)
+    revenue = BigIntegerField(default=0)
+
+    # the columns of a group, unique together
+    key_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def apply(cls, deltas):
+        """
+        Adds {key: (order_count, quantity, revenue)} to the groups with INSERT ... ON CONFLICT DO UPDATE, so
+        concurrent writers never overwrite each other's increments.
+        """
+        rows = [(*key, *totals) for key, totals in deltas.items() if any(totals)]
+        if not rows:
+            return
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        table = quote(cls._meta.db_table)
+        keys = [quote(cls._meta.get_field(name).column) for name in cls.key_fields]
+        totals = [quote(name) for name in ('order_count', 'quantity', 'revenue')]
+        sql = (
+            f"INSERT INTO {table} ({', '.join(keys + totals)}) VALUES ({', '.join(['%s'] * len(keys + totals))}) "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET "
+            + ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in totals)
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+class ProductRevenue(RevenueRollup):
+    product = ForeignKey(Product, on_delete=CASCADE, related_name='revenue')
+    status = CharField(max_length=128)
+
+    key_fields = ('product', 'status')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'status'], name='product_revenue_key'),
+        ]
+
+
+class CategoryRevenue(RevenueRollup):
+    category = ForeignKey(Category, on_delete=CASCADE, related_name='revenue')
+    status = CharField(max_length=128)
+
+    key_fields = ('category', 'status')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'status'], name='category_revenue_key'),
+        ]
+
+    @classmethod
+    def move_product(cls, product_id, old_category_id, new_category_id=None):
+        """
+        Moves the totals of a product's orders to its new category, or only takes them out without one.
+        """
+        deltas = {}
+        for status, *totals in ProductRevenue.objects.filter(product_id=product_id) \
+                .values_list('status', 'order_count', 'quantity', 'revenue'):
+            add_totals(deltas, (old_category_id, status), [-total for total in totals])
+            if new_category_id is not None:
+                add_totals(deltas, (new_category_id, status), totals)
+        cls.apply(deltas)
+
+
+class StatusRevenue(RevenueRollup):
+    status = CharField(max_length=128, unique=True)
+
+    key_fields = ('status',)
@@ -0,0 +1,116 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination: every page is `WHERE (ordering) > (last row) ORDER BY ordering LIMIT n`,
+    so the cost of a page does not depend on how deep the client is paging.
+    `ordering` must be unique, so it always ends with `id`.
+    """
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @staticmethod
+    def get_query_params(request):
+        # DRF requests have `query_params`; the plain Django requests of the async views only `GET`
+        return getattr(request, 'query_params', request.GET)
+
+    def is_requested(self, request):
+        params = self.get_query_params(request)
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            size = int(self.get_query_params(request).get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.get_page_queryset(queryset, request))
+        return self.set_page(rows)
+
+    async def apaginate_queryset(self, queryset, request):
+        rows = [row async for row in self.get_page_queryset(queryset, request)]
+        return self.set_page(rows)
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.model = queryset.model
+        self.page_size_value = self.get_page_size(request)
+
+        cursor = self.get_query_params(request).get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode_cursor(cursor)))
+        return queryset.order_by(*self.ordering)[:self.page_size_value + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size_value
+        self.page = rows[:self.page_size_value]
+        return self.page
+
+    def after(self, values):
+        # (a, b) > (x, y)  ==>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            equal = {self.ordering[j]: values[j] for j in range(i)}
+            condition |= Q(**equal, **{f'{name}__gt': values[i]})
+        return condition
+
+    def encode_cursor(self, instance):
+        values = [self.model._meta.get_field(name).value_to_string(instance) for name in self.ordering]
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [self.model._meta.get_field(name).to_python(value) for name, value in zip(self.ordering, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size_value)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PostKeysetPagination(KeysetPagination):
+    ordering = ('deadline', 'id')
+
+
+class SubJobKeysetPagination(KeysetPagination):
+    ordering = ('id',)
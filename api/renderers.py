@@ -0,0 +1,78 @@
+"""
+orjson for everything the API encodes: DRF responses (ORJSONRenderer, the default in REST_FRAMEWORK), the
+views' JsonResponse and the streamed lists. datetime, date, time and UUID are encoded by orjson itself, like
+DRF's encoder does (microseconds, `Z` for UTC); `default` covers what DRF's encoder adds on top (Decimal, lazy
+translations, querysets, ...). JsonResponse keeps the output of django.http.JsonResponse instead: datetimes
+and times cut to milliseconds, durations in ISO 8601.
+NaN and infinity are encoded as null, where DRF's encoder raised and Django's wrote invalid JSON.
+"""
+from datetime import date, time, timedelta
+from decimal import Decimal
+
+import orjson
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.query import QuerySet
+from django.http import HttpResponse
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import JSONRenderer
+
+OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+# JsonResponse: datetimes go through django_default
+DJANGO_OPTIONS = OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME
+LINE_SEPARATORS = (b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+
+
+def default(obj):
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, Decimal):
+        # as a string, like DecimalField in the serializers, so no precision is lost
+        return str(obj)
+    if isinstance(obj, timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, QuerySet):
+        return tuple(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__getitem__') and hasattr(obj, 'keys'):
+        return dict(obj)
+    if hasattr(obj, '__iter__'):
+        return tuple(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def django_default(obj):
+    if isinstance(obj, (date, time, timedelta)):
+        return DjangoJSONEncoder().default(obj)
+    return default(obj)
+
+
+def dumps(data, indent=False, default=default, option=OPTIONS):
+    content = orjson.dumps(data, default=default, option=option | (orjson.OPT_INDENT_2 if indent else 0))
+    # like DRF's renderer: escaped, so the output stays a valid JavaScript string
+    if any(separator in content for separator in LINE_SEPARATORS):
+        content = content.replace(LINE_SEPARATORS[0], b'\\u2028').replace(LINE_SEPARATORS[1], b'\\u2029')
+    return content
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # orjson only indents by 2, any requested indent (e.g. the browsable API's) becomes 2
+        return dumps(data, indent=bool(self.get_indent(accepted_media_type, renderer_context or {})))
+
+
+class JsonResponse(HttpResponse):
+    """
+    django.http.JsonResponse encoded with orjson.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data, default=django_default, option=DJANGO_OPTIONS), **kwargs)
@@ -0,0 +1,36 @@
+from django.db.models import Sum
+
+from api.models import ProductRevenue, CategoryRevenue, StatusRevenue
+
+# rollup -> {key of a report row: the column it is read from}, besides the totals
+REVENUE_GROUPS = {
+    ProductRevenue: {'product': 'product_id', 'product_name': 'product__name'},
+    CategoryRevenue: {'category': 'category_id', 'category_name': 'category__name'},
+    StatusRevenue: {'status': 'status'},
+}
+
+
+def revenue_report(rollup, status=None, limit=None):
+    """
+    Order count, item quantity and revenue per group, biggest revenue first. Reads the rollup rows (one per
+    group and status), never the orders.
+    """
+    rows = rollup.objects.all()
+    if status:
+        rows = rows.filter(status=status)
+    group = REVENUE_GROUPS[rollup]
+    # the totals of the statuses of a group are added up, so the sums are named apart from the rollup columns
+    rows = rows.values(*group.values()).annotate(
+        total_orders=Sum('order_count'), total_quantity=Sum('quantity'), total_revenue=Sum('revenue'),
+    ).filter(total_orders__gt=0).order_by('-total_revenue', *group.values())
+    if limit:
+        rows = rows[:limit]
+    return [
+        {
+            **{name: row[column] for name, column in group.items()},
+            'order_count': row['total_orders'],
+            'quantity': row['total_quantity'],
+            'revenue': row['total_revenue'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,118 @@
+"""
+Read/write splitting. Inside a GET/HEAD request reads go to one of settings.DATABASE_REPLICAS and writes to
+`default`. A request is pinned to `default`
+    - for its whole duration when it is not a safe method (validation reads must see the latest data),
+    - after its first write (read-your-writes for the rest of the request),
+    - inside `transaction.atomic()` and `use_primary()`,
+    - for DATABASE_REPLICA_LAG seconds after a write, through a cookie, so the client's next requests
+      don't read from a replica that hasn't caught up yet.
+Outside a request (Celery, management commands) everything goes to `default`.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'api_db_primary'
+
+current_route = ContextVar('api_db_route', default=None)
+
+
+class RequestRoute:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+    def read_alias(self):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if self.pinned or not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # one replica per request, so all its reads see the same snapshot
+        if self.replica is None:
+            self.replica = random.choice(replicas)
+        return self.replica
+
+
+@contextmanager
+def use_primary():
+    """
+    Reads inside the block go to `default`, for code that can't tolerate replica lag.
+    """
+    route = current_route.get()
+    if route is None or route.pinned:
+        yield
+        return
+    route.pinned = True
+    try:
+        yield
+    finally:
+        # a write inside the block pins the rest of the request
+        route.pinned = route.wrote
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        route = current_route.get()
+        if route is None:
+            return DEFAULT_DB_ALIAS
+        return route.read_alias()
+
+    def db_for_write(self, model, **hints):
+        route = current_route.get()
+        if route is not None:
+            route.pinned = route.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Opens the routing context of a request (see the module docstring). Has no effect while
+    settings.DATABASE_REPLICAS is empty.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lag = getattr(settings, 'DATABASE_REPLICA_LAG', 5)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        route = self.start(request)
+        token = current_route.set(route)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_route.reset(token)
+        return self.finish(route, response)
+
+    async def __acall__(self, request):
+        route = self.start(request)
+        token = current_route.set(route)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_route.reset(token)
+        return self.finish(route, response)
+
+    @staticmethod
+    def start(request):
+        return RequestRoute(pinned=request.method not in ('GET', 'HEAD', 'OPTIONS') or PIN_COOKIE in request.COOKIES)
+
+    def finish(self, route, response):
+        if route.wrote and getattr(settings, 'DATABASE_REPLICAS', []):
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.lag, httponly=True, samesite='Lax')
+        return response
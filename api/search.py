@@ -0,0 +1,56 @@
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.db.models import Q
+
+from api.models import Product
+
+FTS_TABLE = 'api_product_fts'
+# bm25 column weights: a hit in the name counts more than one in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+_fts_available = {}
+
+
+def fts_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    # looked up once per database file instead of introspecting on every search
+    name = connection.settings_dict['NAME']
+    if name not in _fts_available:
+        _fts_available[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[name]
+
+
+def match_expression(search):
+    # every word is a quoted prefix query, so "iph 1" matches "iPhone 15" and FTS syntax can't leak in
+    terms = re.findall(r'\w+', search)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_products(search, limit=50):
+    # the database the raw query will run on (a replica inside a read request, see api.routers)
+    if not fts_available(connections[router.db_for_read(Product)]):
+        return Product.objects.filter(Q(name__icontains=search) | Q(description__icontains=search))[:limit]
+
+    match = match_expression(search)
+    if not match:
+        return Product.objects.none()
+    return Product.objects.raw(
+        f"""
+        SELECT api_product.* FROM {FTS_TABLE}
+        JOIN api_product ON api_product.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s
+        ORDER BY bm25({FTS_TABLE}, %s, %s)
+        LIMIT %s
+        """,
+        [match, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit],
+    )
+
+
+async def asearch_products(search, limit=50):
+    # raw queries have no async API, so the FTS lookup runs through sync_to_async like the rest of the async ORM
+    return await sync_to_async(lambda: list(search_products(search, limit=limit)))()
@@ -1,13 +1,97 @@
-from django.contrib.auth.hashers import check_password
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from rest_framework.fields import CharField, ReadOnlyField, IntegerField, DecimalField, BooleanField, EmailField
-from rest_framework.serializers import ModelSerializer
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.fields import CharField, ReadOnlyField, IntegerField, DecimalField, BooleanField, EmailField, \
+    FloatField, ChoiceField
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import ModelSerializer, ListSerializer
 from rest_framework.serializers import ValidationError, Serializer
 
+from api.auth import check_password_timed
+from api.cache import bump_version
+from api.catalog import schedule_snapshot
+from api.fast_serializers import FastReadMixin
 from api.models import Post, SubJob, Employee, User, Product, Category, OrderItem, Order, TestOrder
-
-
-class PostModelSerializer(ModelSerializer):
+from api.tokens import check_verification_token, REGISTER, FORGOT_PASSWORD
+
+
+class CachedPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    Resolves the pk from the objects BulkCreateListSerializer loaded for the whole batch, if there are any.
+    """
+
+    def to_internal_value(self, data):
+        objects = self.context.get('related_objects', {}).get(self.field_name)
+        if objects is None:
+            return super().to_internal_value(data)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            return super().to_internal_value(data)
+        if pk not in objects:
+            self.fail('does_not_exist', pk_value=data)
+        return objects[pk]
+
+
+class BulkCreateListSerializer(ListSerializer):
+    """
+    `many=True` creation with set-based validation: one `name IN (...)` query for the uniqueness checks of
+    the whole batch, one query per foreign key, and a single bulk_create in one transaction.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            items = [item for item in data if isinstance(item, dict)]
+            if hasattr(self.child, 'name_taken'):
+                names = {item['name'] for item in items if isinstance(item.get('name'), str)}
+                model = self.child.Meta.model
+                self._context['existing_names'] = set(
+                    model.objects.filter(name__in=names).values_list('name', flat=True))
+            self._context['related_objects'] = {
+                name: field.get_queryset().in_bulk(self.related_pks(field, name, items))
+                for name, field in self.child.fields.items()
+                if isinstance(field, CachedPrimaryKeyRelatedField) and not field.read_only
+            }
+        return super().to_internal_value(data)
+
+    @staticmethod
+    def related_pks(field, name, items):
+        to_python = field.get_queryset().model._meta.pk.to_python
+        pks = set()
+        for item in items:
+            try:
+                pks.add(to_python(item.get(name)))
+            except DjangoValidationError:
+                pass
+        pks.discard(None)
+        return pks
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        with transaction.atomic():
+            objects = model.objects.bulk_create([model(**attrs) for attrs in validated_data], batch_size=500)
+            # bulk_create sends no post_save, so the child does what the signal receivers would have done
+            if hasattr(self.child, 'after_bulk_create'):
+                self.child.after_bulk_create(objects)
+        return objects
+
+
+class UniqueNameMixin:
+    def name_taken(self, value):
+        existing = self.context.get('existing_names')
+        if existing is None:
+            return self.Meta.model.objects.filter(name=value).exists()
+        if value in existing:
+            return True
+        # a later row of the same batch with this name is a duplicate too
+        existing.add(value)
+        return False
+
+
+class PostModelSerializer(FastReadMixin, ModelSerializer):
     class Meta:
         model = Post
         fields = '__all__'
@@ -16,25 +100,32 @@ class PostModelSerializer(ModelSerializer):
         }
 
 
-class SubJobModelSerializer(ModelSerializer):
+class SubJobModelSerializer(FastReadMixin, ModelSerializer):
     class Meta:
         model = SubJob
         fields = '__all__'
 
 
-class EmployeeModelSerializer(ModelSerializer):
+class EmployeeModelSerializer(FastReadMixin, ModelSerializer):
     user_first_name = ReadOnlyField(source='user.first_name')
     user_last_name = ReadOnlyField(source='user.last_name')
-    rating = DecimalField(max_digits=5, decimal_places=2, read_only=True)
 
     class Meta:
         model = Employee
-        fields = 'user_first_name', 'user_last_name', 'rating', 'experience', 'linkedin'
+        fields = 'user_first_name', 'user_last_name', 'experience', 'linkedin'
         # extra_kwargs = {
         #     "experience": {'write_only': True}
         # }
 
 
+class RatedEmployeeModelSerializer(EmployeeModelSerializer):
+    # only the leaderboard shows the rating
+    rating = DecimalField(max_digits=5, decimal_places=2, read_only=True, source='rating_avg')
+
+    class Meta(EmployeeModelSerializer.Meta):
+        fields = 'user_first_name', 'user_last_name', 'rating', 'experience', 'linkedin'
+
+
 class PostDetailModelSerializer(ModelSerializer):
     user_first_name = ReadOnlyField(source='user.first_name')
     user_last_name = ReadOnlyField(source='user.last_name')
@@ -44,7 +135,7 @@ class PostDetailModelSerializer(ModelSerializer):
         fields = 'title', 'description', 'user_first_name', 'user_last_name'
 
 
-class MyPostModelSerializer(ModelSerializer):
+class MyPostModelSerializer(FastReadMixin, ModelSerializer):
     class Meta:
         model = Post
         fields = 'title', 'status', 'deadline', 'description'
@@ -58,13 +149,14 @@ class TheMostPopularUserModelSerializer(ModelSerializer):
         fields = 'full_name', 'posts_count'
 
 
-class ExpiredPostModelSerializer(ModelSerializer):
+class ExpiredPostModelSerializer(FastReadMixin, ModelSerializer):
     class Meta:
         model = Post
         fields = 'title', 'description', 'deadline'
 
 
-class ProductModelSerializer(ModelSerializer):
+class ProductModelSerializer(UniqueNameMixin, ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
     discount = DecimalField(max_digits=3, decimal_places=0, validators=[MaxValueValidator(100), MinValueValidator(0)],
                             required=False)
     sale = BooleanField(default=False, required=False)
@@ -75,11 +167,12 @@ class ProductModelSerializer(ModelSerializer):
         extra_kwargs = {
             'category': {'write_only': True}
         }
+        list_serializer_class = BulkCreateListSerializer
 
     def validate_name(self, value):
         if len(value) < 3:
             raise ValidationError("Name is too short!")
-        if Product.objects.filter(name=value).exists():
+        if self.name_taken(value):
             raise ValidationError("Bu mahsulot nomi allaqachon mavjud!")
         return value
 
@@ -88,10 +181,17 @@ class ProductModelSerializer(ModelSerializer):
             raise ValidationError("Narx manfiy bo'lishi mumkin emas!")
         return value
 
-    def validate_sale(self, value):
-        if value and int(self.root.initial_data.get("discount")) <= 0:
-            raise ValidationError("Invalid discount!")
-        return value
+    def validate(self, attrs):
+        # not in validate_sale: with many=True root.initial_data is the whole list
+        if attrs.get('sale') and (attrs.get('discount') or 0) <= 0:
+            raise ValidationError({'sale': ["Invalid discount!"]})
+        return attrs
+
+    @staticmethod
+    def after_bulk_create(products):
+        for category_id in {product.category_id for product in products}:
+            bump_version('category', category_id)
+        schedule_snapshot()
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -100,13 +200,18 @@ class ProductModelSerializer(ModelSerializer):
         return data
 
 
-class CategoryModelSerializer(ModelSerializer):
+class CategoryModelSerializer(UniqueNameMixin, ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
+        list_serializer_class = BulkCreateListSerializer
+
+    @staticmethod
+    def after_bulk_create(categories):
+        schedule_snapshot()
 
     def validate_name(self, value):
-        if Category.objects.filter(name=value).exists():
+        if self.name_taken(value):
             raise ValidationError("Category with this name already exists!")
         if not value.isalpha():
             raise ValidationError("Name must contains only letters!")
@@ -128,9 +233,12 @@ class OrderItemModelSerializer(ModelSerializer):
 
 
 class OrderModelSerializer(ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
+
     class Meta:
         model = Order
-        fields = '__all__'
+        exclude = ['geohash']
+        list_serializer_class = BulkCreateListSerializer
 
     def validate(self, attr):
         quantity = attr.get('quantity')
@@ -144,9 +252,21 @@ class OrderModelSerializer(ModelSerializer):
         #     raise ValidationError(f"Product with id {product_id} not found1")
         return attr
 
+    @staticmethod
+    def after_bulk_create(orders):
+        Order.apply_revenue(added=[order.revenue_entry() for order in orders])
+        for order in orders:
+            order._loaded_revenue = order.revenue_entry()
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # orders + users, items, products + categories: 2 queries for any number of orders/items
+        items = OrderItem.objects.select_related('product__category')
+        return queryset.select_related('user').prefetch_related(Prefetch('order_items', queryset=items))
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        items = OrderItem.objects.filter(order=instance).all()
+        items = instance.order_items.all()
         serialized_user = UserModelSerializer(instance=instance.user).data
         serialized_items = OrderItemModelSerializer(instance=items, many=True).data
         data['user'] = serialized_user
@@ -154,7 +274,51 @@ class OrderModelSerializer(ModelSerializer):
         return data
 
 
-class ProductDynamicModelSerializer(ModelSerializer):
+class NearbyOrderModelSerializer(ModelSerializer):
+    # only set by radius queries
+    distance = FloatField(read_only=True)
+
+    class Meta:
+        model = Order
+        exclude = ['geohash']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'distance' in data:
+            data['distance'] = round(data['distance'], 1)
+        return data
+
+
+class NearbyQuerySerializer(Serializer):
+    latitude = FloatField(required=False, min_value=-90, max_value=90)
+    longitude = FloatField(required=False, min_value=-180, max_value=180)
+    radius = FloatField(required=False, min_value=1, max_value=100_000)
+    bbox = CharField(required=False)
+    status = ChoiceField(choices=Order.OrderStatusChoice.choices, required=False)
+    limit = IntegerField(required=False, min_value=1, max_value=1000, default=100)
+
+    def validate_bbox(self, value):
+        try:
+            min_lon, min_lat, max_lon, max_lat = map(float, value.split(','))
+        except ValueError:
+            raise ValidationError("bbox: min_lon,min_lat,max_lon,max_lat")
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+            raise ValidationError("bbox is out of range")
+        if max_lon < min_lon:
+            # crosses the antimeridian
+            max_lon += 360
+        return min_lat, min_lon, max_lat, max_lon
+
+    def validate(self, attrs):
+        circle = [attrs.get(name) is not None for name in ('latitude', 'longitude', 'radius')]
+        if attrs.get('bbox') is None and not all(circle):
+            raise ValidationError("Send latitude, longitude and radius, or bbox!")
+        if attrs.get('bbox') is not None and any(circle):
+            raise ValidationError("Send either a radius or a bbox, not both!")
+        return attrs
+
+
+class ProductDynamicModelSerializer(FastReadMixin, ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
@@ -168,14 +332,27 @@ class ProductDynamicModelSerializer(ModelSerializer):
             # Query params orqali fieldlarni olish
             fields = request.query_params.get('fields')
             if fields:
-                # Fieldlarni ajratish va filtrlash
-                allowed = set(fields.split(','))
-                existing = set(self.fields.keys())
-
                 # Ruxsat berilmagan fieldlarni olib tashlash
-                for field_name in existing - allowed:
+                allowed = self.select_fields(fields.split(','))
+                for field_name in set(self.fields.keys()) - set(allowed):
                     self.fields.pop(field_name)
 
+    @staticmethod
+    def select_fields(requested):
+        requested = set(requested)
+        return tuple(field.name for field in Product._meta.concrete_fields if field.name in requested)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def for_fields(cls, fields):
+        """
+        Serializer class that only declares `fields` (a tuple from `select_fields`), built once per field set.
+        Unbounded, like compile_reader() which is keyed by these classes: there are 2^len(concrete fields)
+        field sets at most, and a class built again after an eviction would get a second reader.
+        """
+        meta = type('Meta', (cls.Meta,), {'fields': fields})
+        return type(f'{cls.__name__}_{"_".join(fields)}', (cls,), {'Meta': meta})
+
 
 class ProductByCategoryModelSerializer(ModelSerializer):
     class Meta:
@@ -190,7 +367,8 @@ class CategoryDetailModelSerializer(ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        products = Product.objects.filter(category=instance)
+        # uses the prefetched products when the queryset has prefetch_related('products')
+        products = instance.products.all()
         s = ProductByCategoryModelSerializer(instance=products, many=True).data
         data['products'] = s
         return data
@@ -229,7 +407,7 @@ class ProductBySearchModelSerializer(ModelSerializer):
 class TestOrderModelSerializer(ModelSerializer):
     class Meta:
         model = TestOrder
-        fields = '__all__'
+        exclude = ['geohash']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -289,7 +467,7 @@ class RegisterCheckModelSerializer(ModelSerializer):
 
     def validate_code(self, value):
         verify_code = self.initial_data.get('verify_code')
-        if not check_password(value, verify_code):
+        if check_verification_token(verify_code, value, REGISTER) != self.initial_data.get('email'):
             raise ValidationError("Incorrect code!")
 
     def validate_verify_code(self, value):
@@ -333,7 +511,8 @@ class ForgotPasswordCheckSerializer(Serializer):
         return value
 
     def validate_code(self, value):
-        if not check_password(value, self.initial_data.get('verify_code')):
+        email = check_verification_token(self.initial_data.get('verify_code'), value, FORGOT_PASSWORD)
+        if email is None or email != self.initial_data.get('email'):
             raise ValidationError("Incorrect code!")
 
         return value
@@ -350,15 +529,17 @@ class LoginSerializer(Serializer):
     email = EmailField(required=True)
     password = CharField()
 
-    def validate_email(self, value):
-        if not User.objects.filter(email=value).exists():
-            raise ValidationError("Email not found!")
-
-        return value
-
-    def validate_password(self, value):
-        user = User.objects.filter(email=self.initial_data.get('email')).first()
-        if user:
-            if not user.check_password(value):
-                raise ValidationError("Incorrect password!")
-        return value
+    def validate(self, attrs):
+        # one User query for the whole login; the view gets the user from validated_data
+        user = User.objects.filter(email=attrs.get('email')).first()
+        password_ok = user is not None and check_password_timed(user, attrs.get('password'))
+        return self.check_user(attrs, user, password_ok)
+
+    @staticmethod
+    def check_user(attrs, user, password_ok):
+        if user is None:
+            raise ValidationError({'email': ["Email not found!"]})
+        if not password_ok:
+            raise ValidationError({'password': ["Incorrect password!"]})
+        attrs['user'] = user
+        return attrs
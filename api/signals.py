@@ -0,0 +1,137 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+
+from api.cache import bump_version
+from api.catalog import schedule_snapshot
+from api.models import Rating, Employee, Post, User, Category, Product, Job, SubJob, Order, CategoryRevenue
+
+POPULAR_USERS_CACHE_KEY = 'api:popular-users'
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_rating', None)
+    if not created and loaded and loaded[1] is not None:
+        Employee.apply_rating(loaded[0], int(loaded[1]), count=-1)
+    Employee.apply_rating(instance.employee_id, int(instance.rating))
+    instance._loaded_rating = (instance.employee_id, instance.rating)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    employee_id, rating = getattr(instance, '_loaded_rating', None) or (instance.employee_id, instance.rating)
+    Employee.apply_rating(employee_id, int(rating), count=-1)
+
+
+# Revenue rollups, in the transaction of the order write (Order.save, the delete collector)
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_revenue', None)
+    current = instance.revenue_entry()
+    if loaded != current:
+        Order.apply_revenue(added=[current], removed=[loaded] if loaded else [])
+    instance._loaded_revenue = current
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    Order.apply_revenue(removed=[getattr(instance, '_loaded_revenue', None) or instance.revenue_entry()])
+
+
+@receiver(post_save, sender=Product)
+def product_moved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_category_id', None)
+    if not created and previous is not None and previous != instance.category_id:
+        CategoryRevenue.move_product(instance.pk, previous, instance.category_id)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance, **kwargs):
+    # its orders keep only their status totals, the ProductRevenue rows go with the product
+    CategoryRevenue.move_product(instance.pk, instance.category_id)
+
+
+@receiver(pre_save, sender=Post)
+def post_moving(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_user_id = Post.objects.filter(pk=instance.pk).values_list('user_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_popular_users(sender, instance, created=True, **kwargs):
+    # The counts only change when a post is created, deleted (a deleted user's posts are deleted with it) or
+    # given to another user, which changes the counts of both owners.
+    previous = getattr(instance, '_previous_user_id', None)
+    if created or (previous is not None and previous != instance.user_id):
+        cache.delete(POPULAR_USERS_CACHE_KEY)
+
+
+@receiver(post_save, sender=User)
+def popular_user_renamed(sender, update_fields=None, **kwargs):
+    # the leaderboard shows full names; logins only touch last_login
+    if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+        return
+    cache.delete(POPULAR_USERS_CACHE_KEY)
+
+
+# Versions of the cached detail responses (api.cache.cached_detail_response)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    bump_version('post', instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # post detail shows the author's name; logins only touch last_login
+    if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+        return
+    for pk in Post.objects.filter(user=instance).values_list('pk', flat=True).iterator():
+        bump_version('post', pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_version('category', instance.pk)
+
+
+@receiver(pre_save, sender=Product)
+def product_moving(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_category_id = (
+            Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    bump_version('category', instance.category_id)
+    previous = getattr(instance, '_previous_category_id', None)
+    if previous is not None and previous != instance.category_id:
+        bump_version('category', previous)
+
+
+@receiver(post_save, sender=Job)
+@receiver(post_delete, sender=Job)
+def job_changed(sender, instance, **kwargs):
+    bump_version('job', instance.pk)
+
+
+@receiver(post_save, sender=SubJob)
+@receiver(post_delete, sender=SubJob)
+def subjob_changed(sender, instance, **kwargs):
+    bump_version('job', instance.job_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def catalog_changed(sender, **kwargs):
+    schedule_snapshot()
@@ -0,0 +1,59 @@
+from django.http import StreamingHttpResponse
+
+from api.fast_serializers import FastReadMixin, fast_enabled
+from api.renderers import dumps
+
+STREAM_QUERY_PARAM = 'stream'
+CHUNK_SIZE = 500
+
+
+def is_stream_requested(request):
+    return request.query_params.get(STREAM_QUERY_PARAM) in ('1', 'true')
+
+
+def iter_json_array(queryset, serializer_class, chunk_size=CHUNK_SIZE):
+    """
+    Yields a JSON array piece by piece. Rows are fetched with `iterator(chunk_size)` and serialized one
+    chunk at a time, so memory is bounded by `chunk_size` rather than by the size of the result.
+    """
+    separator = b''
+    yield b'['
+    for item in _serialized(queryset, serializer_class, chunk_size):
+        yield separator + dumps(item)
+        separator = b','
+    yield b']'
+
+
+def _serialized(queryset, serializer_class, chunk_size):
+    if issubclass(serializer_class, FastReadMixin) and fast_enabled():
+        yield from serializer_class.fast_iter_data(queryset, chunk_size=chunk_size)
+        return
+    for chunk in _chunks(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        yield from serializer_class(instance=chunk, many=True).data
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_json_response(queryset, serializer_class, key=None, chunk_size=CHUNK_SIZE, status=200):
+    """
+    `key` wraps the array in an object, e.g. key='response' streams {"response": [...]}.
+    """
+    body = iter_json_array(queryset, serializer_class, chunk_size=chunk_size)
+    if key is not None:
+        body = _wrap(body, key)
+    return StreamingHttpResponse(body, content_type='application/json', status=status)
+
+
+def _wrap(body, key):
+    yield b'{' + dumps(key) + b':'
+    yield from body
+    yield b'}'
@@ -1,8 +1,13 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from celery.signals import worker_process_shutdown
+from django.conf import settings
 
+from api import mail, catalog
+from api.models import Post
 from root.settings import EMAIL_HOST_USER
 
+worker_process_shutdown.connect(mail.close_pooled_connection)
+
 
 @shared_task()
 def send_email_task(to_email, code):
@@ -10,5 +15,38 @@ def send_email_task(to_email, code):
     message = f"Your verification code: {code}"
     from_email = EMAIL_HOST_USER
     recipient_list = [to_email]
-    send_mail(subject=subject, message=message, from_email=from_email, recipient_list=recipient_list)
-    return "Send"
+    email = {'subject': subject, 'body': message, 'from_email': from_email, 'to': recipient_list}
+    if not mail.is_queued():
+        mail.send_messages([email])
+        return "Send"
+    if mail.enqueue(email):
+        flush_email_queue_task.apply_async(countdown=settings.EMAIL_BATCH_WINDOW)
+    return "Queued"
+
+
+@shared_task(bind=True, max_retries=5)
+def flush_email_queue_task(self):
+    try:
+        sent, countdown = mail.flush()
+    except Exception as error:
+        # the batch is back in the queue: retry while the flag still marks a flush as scheduled, then clear it
+        # so the next enqueue schedules one
+        if self.request.retries >= self.max_retries:
+            mail.clear_scheduled()
+            raise
+        raise self.retry(exc=error, countdown=settings.EMAIL_BATCH_WINDOW * 2 ** self.request.retries)
+    if countdown is not None:
+        flush_email_queue_task.apply_async(countdown=countdown)
+    return f"Send {sent}"
+
+
+@shared_task()
+def expire_posts_task():
+    expired = Post.expire_overdue(batch_size=settings.POST_EXPIRY_BATCH_SIZE)
+    return f"Expired {expired}"
+
+
+@shared_task()
+def build_catalog_snapshot_task():
+    version = catalog.build_snapshot()
+    return f"Catalog {version}"
@@ -1,3 +1,1774 @@
-from django.test import TestCase
+import gzip
+import json
+import logging
+import os
+import re
+import smtplib
+import tempfile
+import threading
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from hashlib import sha256
+from itertools import combinations
+from io import BytesIO, StringIO
+from random import Random
+from unittest.mock import patch
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core import mail as django_mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.mail.backends.dummy import EmailBackend as DummyEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db.models import Count, F, Sum
+from django.db import connection, connections, router
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.http import HttpResponse, JsonResponse as DjangoJsonResponse
+from django.test import Client, TestCase, SimpleTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api import catalog, geo, mail, views
+from api.db import apply_sqlite_pragmas
+from api.async_views import serialize
+from api.fast_serializers import compile_reader
+from api.management.commands.audit_query_plans import FULL_SCAN, is_full_scan
+from api.management.commands.benchmark_serializers import cases
+from api.management.commands.generate_fixtures import BENCH_PASSWORD
+from api.models import User, Post, Job, SubJob, Employee, Rating, Category, Product, Order, OrderItem, \
+    ProductRevenue, CategoryRevenue, StatusRevenue
+from api.parsers import ORJSONParser
+from api.renderers import dumps, JsonResponse, ORJSONRenderer
+from api.routers import PIN_COOKIE, ReplicaRoutingMiddleware, use_primary
+from api.search import fts_available
+from api.serializers import OrderModelSerializer, SubJobModelSerializer, PostDetailModelSerializer, \
+    CategoryDetailModelSerializer, ProductDynamicModelSerializer
+from api.streaming import iter_json_array
+from api.tasks import expire_posts_task
+from api.tokens import make_verification_token, check_verification_token, REGISTER, FORGOT_PASSWORD
+from api.uploads import HashingFileUploadHandler
+from api.urls import urlpatterns
+from root.celery import app as celery_app
+
+# PerformanceMiddleware logs the requests it samples; the tests that check those lines use assertLogs
+logging.getLogger('api.performance').setLevel(logging.CRITICAL)
+
+
+class BaseTestCase(TestCase):
+    """
+    Keeps media and catalog snapshots in a temporary directory and starts every test with an empty cache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.media_root = directory.name
+        files = override_settings(MEDIA_ROOT=cls.media_root,
+                                  CATALOG_SNAPSHOT_DIR=os.path.join(cls.media_root, 'snapshots'))
+        files.enable()
+        cls.addClassCleanup(files.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+
+
+class FixturesTestCase(BaseTestCase):
+    """
+    Runs against a small generate_fixtures database, for the tests that need every route to have data.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_fixtures', scale=200, seed=1, stdout=StringIO())
+        cls.user = User.objects.filter(email__startswith='bench-').order_by('id').first()
+
+
+PASSWORD = 'test-password'
+PRODUCT_NAMES = ('Phone case', 'Laptop stand', 'Desk lamp', 'Cotton shirt', 'Rain jacket', 'Garden hose', 'Road atlas')
+
+
+def create_users(count):
+    password = make_password(PASSWORD)
+    return User.objects.bulk_create(
+        User(email=f'user{i}@example.com', password=password, first_name=f'User{i}', last_name=f'Test{i}',
+             phone_number=f'+99890{i:07d}', is_active=True)
+        for i in range(count)
+    )
+
+
+def create_jobs(count, subjobs=2):
+    jobs = Job.objects.bulk_create(Job(name=f'Job {i}') for i in range(count))
+    SubJob.objects.bulk_create(SubJob(job=job, name=f'SubJob {i}') for job in jobs for i in range(subjobs))
+    return jobs
+
+
+def create_posts(users, jobs, hours, status=Post.PostStatusChoice.NEW):
+    """
+    One post per deadline, `hours` from now, with the users taking turns as the author.
+    """
+    now = timezone.now()
+    posts = Post.objects.bulk_create(
+        Post(title=f'Post {i}', description='A test post', file='posts/test.txt',
+             deadline=now + timedelta(hours=hour), status=status, user=users[i % len(users)])
+        for i, hour in enumerate(hours)
+    )
+    Post.jobs.through.objects.bulk_create(
+        Post.jobs.through(post_id=post.pk, job_id=jobs[i % len(jobs)].pk) for i, post in enumerate(posts)
+    )
+    return posts
+
+
+def create_employees(users, ratings):
+    """
+    An employee per list of ratings; the aggregates are rebuilt, as generate_fixtures does.
+    """
+    employees = Employee.objects.bulk_create(
+        Employee(user=users[i % len(users)], experience=i, linkedin=f'https://linkedin.com/in/test-{i}',
+                 description='A test employee', cv='user_cv/test.pdf')
+        for i in range(len(ratings))
+    )
+    Rating.objects.bulk_create(
+        Rating(employee=employee, rating=str(rating))
+        for employee, values in zip(employees, ratings)
+        for rating in values
+    )
+    Employee.rebuild_rating_aggregates()
+    return employees
+
+
+def create_catalog(products, categories=('Electronics', 'Clothes', 'Books')):
+    categories = Category.objects.bulk_create(Category(name=name) for name in categories)
+    return Product.objects.bulk_create(
+        Product(name=f'{PRODUCT_NAMES[i % len(PRODUCT_NAMES)]} {i}', price=1000 * (i + 1),
+                discount=Decimal(i % 3 * 10) if i % 4 else None, sale=i % 5 == 0,
+                description=f'Test product {i}', category=categories[i % len(categories)], is_active=i % 6 != 5)
+        for i in range(products)
+    )
+
+
+def create_orders(count, products, users=(None,), seed=0):
+    """
+    Orders around Tashkent with one to three items each; the revenue rollups are rebuilt.
+    """
+    rng = Random(seed)
+    statuses = Order.OrderStatusChoice.values
+    orders = Order.objects.bulk_create(
+        Order(user=users[i % len(users)], phone_number=f'+99891{i:07d}',
+              longitude=Decimal(f'{rng.uniform(69.1, 69.4):.6f}'), latitude=Decimal(f'{rng.uniform(41.2, 41.4):.6f}'),
+              status=statuses[i % len(statuses)], quantity=i % 5 + 1, amount=rng.randint(10, 1_000_000),
+              product=products[i % len(products)] if i % 7 != 6 else None)
+        for i in range(count)
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=products[(i + j) % len(products)], count=j + 1)
+        for i, order in enumerate(orders)
+        for j in range(i % 3 + 1)
+    )
+    Order.rebuild_revenue()
+    return orders
+
+
+class FixtureGeneratorTests(FixturesTestCase):
+    def test_row_counts_follow_the_scale(self):
+        generated = User.objects.filter(email__startswith='bench-')
+        self.assertEqual(generated.count(), 20)
+        self.assertEqual(Post.objects.filter(user__in=generated).count(), 200)
+        self.assertEqual(Order.objects.filter(user__in=generated).count(), 200)
+        self.assertTrue(OrderItem.objects.filter(order__user__in=generated).exists())
+        self.assertTrue(self.user.check_password(BENCH_PASSWORD))
+
+    def test_benchmark_reports_every_route(self):
+        eager = celery_app.conf.task_always_eager
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+        output = os.path.join(self.media_root, 'bench.json')
+        call_command('benchmark_endpoints', iterations=1, warmup=0, output=output, stdout=StringIO(),
+                     stderr=StringIO())
+        with open(output) as file:
+            report = json.load(file)
+        routes = {str(pattern.pattern) for pattern in urlpatterns}
+        self.assertLessEqual({'post', 'catalog/', 'login/', 'orders/nearby/'}, set(report['routes']))
+        self.assertLessEqual(set(report['routes']), routes)
+        for name, result in report['routes'].items():
+            # routed to employee_list_apiview since the baseline, which takes no pk
+            if name == 'employee/<int:pk>':
+                continue
+            with self.subTest(route=name):
+                self.assertTrue(all(status < 500 for status in result['statuses']), result['statuses'])
+
+
+class KeysetPaginationTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        jobs = create_jobs(5)
+        users = create_users(3)
+        # repeated deadlines: pages are ordered by (deadline, id)
+        create_posts(users, jobs, [hour % 6 + 1 for hour in range(20)])
+        create_posts(users, jobs, [-1, -2])
+        create_posts(users, jobs, [5, 6], status=Post.PostStatusChoice.COMPLETED)
+
+    def pages(self, url, key):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [row['id'] for row in body[key]]
+            url = body['next']
+            pages += 1
+        return ids, pages
+
+    def test_subjobs_are_paged_without_duplicates_or_gaps(self):
+        ids, pages = self.pages('/api/subjob/?page_size=3', 'results')
+        self.assertEqual(ids, list(SubJob.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(pages, -(-len(ids) // 3))
+
+    def test_posts_are_paged_by_deadline(self):
+        ids, _ = self.pages('/api/post?page_size=7', 'response')
+        expected = Post.objects.open().order_by('deadline', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_rows_deleted_between_pages_do_not_shift_the_next_page(self):
+        first = self.client.get('/api/subjob/?page_size=4').json()
+        shown = [row['id'] for row in first['results']]
+        # an offset page would skip a row after this
+        SubJob.objects.filter(pk=shown[0]).delete()
+        ids, _ = self.pages(first['next'], 'results')
+        remaining = SubJob.objects.order_by('id').values_list('id', flat=True)
+        self.assertEqual(shown[1:] + ids, list(remaining))
+
+    def test_bad_cursor_is_not_found(self):
+        wrong_length = urlsafe_b64encode(json.dumps(['1', '2', '3']).encode()).decode()
+        for url in ('/api/subjob/?cursor=zzz', f'/api/subjob/?cursor={wrong_length}', '/api/post?cursor=zzz'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class OrderSerializationTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_orders(10, create_catalog(products=25), create_users(2))
+
+    def test_queries_do_not_depend_on_the_items(self):
+        order = Order.objects.first()
+        products = list(Product.objects.all()[:20])
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product) for product in products)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/orders/{order.pk}')
+        self.assertEqual(len(response.json()['items']), order.order_items.count())
+
+    def test_same_output_as_lazy_loading(self):
+        for order in Order.objects.order_by('id')[:5]:
+            with self.subTest(order=order.pk):
+                lazy = json.loads(dumps(OrderModelSerializer(instance=Order.objects.get(pk=order.pk)).data))
+                self.assertEqual(self.client.get(f'/api/orders/{order.pk}').json(), lazy)
+
+    def test_missing_order(self):
+        response = self.client.get('/api/orders/0')
+        self.assertEqual(response.json(), {'message': 'Order with id 0 not found!'})
+
+
+class RatingAggregateTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_employees(create_users(3), [[5, 4, 3], [1, 2], [5], [3, 3, 4, 2], [2, 5], [1]])
+
+    def assertAggregatesMatchRatings(self):
+        ratings = defaultdict(list)
+        for employee_id, rating in Rating.objects.values_list('employee_id', 'rating'):
+            ratings[employee_id].append(int(rating))
+        for employee in Employee.objects.all():
+            values = ratings[employee.pk]
+            with self.subTest(employee=employee.pk):
+                self.assertEqual(employee.rating_sum, sum(values))
+                self.assertEqual(employee.rating_count, len(values))
+                if values:
+                    self.assertAlmostEqual(employee.rating_avg, sum(values) / len(values))
+                else:
+                    self.assertIsNone(employee.rating_avg)
+
+    def test_fixtures_are_rebuilt(self):
+        self.assertAggregatesMatchRatings()
+
+    def test_create(self):
+        employee = Employee.objects.first()
+        Rating.objects.create(employee=employee, rating='5')
+        Rating.objects.create(employee=employee, rating='1')
+        self.assertAggregatesMatchRatings()
+
+    def test_update(self):
+        rating = Rating.objects.first()
+        rating.rating = '1' if rating.rating != '1' else '5'
+        rating.save()
+        self.assertAggregatesMatchRatings()
+
+        rating.employee = Employee.objects.exclude(pk=rating.employee_id).first()
+        rating.save()
+        self.assertAggregatesMatchRatings()
+
+    def test_update_of_a_deferred_rating(self):
+        rating = Rating.objects.only('id').first()
+        rating.rating = '1' if Rating.objects.get(pk=rating.pk).rating != '1' else '5'
+        rating.save()
+        self.assertAggregatesMatchRatings()
+
+        rating = Rating.objects.defer('rating').last()
+        rating.employee = Employee.objects.exclude(pk=rating.employee_id).first()
+        rating.save(update_fields=['employee'])
+        self.assertAggregatesMatchRatings()
+
+    def test_delete(self):
+        Rating.objects.first().delete()
+        Rating.objects.only('id').last().delete()
+        employee = Employee.objects.filter(rating_count__gt=0).first()
+        Rating.objects.filter(employee=employee).delete()
+        self.assertAggregatesMatchRatings()
+        self.assertIsNone(Employee.objects.get(pk=employee.pk).rating_avg)
+
+    def test_rebuild_matches_the_signals(self):
+        Rating.objects.create(employee=Employee.objects.first(), rating='3')
+        Rating.objects.last().delete()
+        columns = ('pk', 'rating_sum', 'rating_count', 'rating_avg')
+        maintained = list(Employee.objects.order_by('pk').values_list(*columns))
+        Employee.rebuild_rating_aggregates()
+        self.assertEqual(list(Employee.objects.order_by('pk').values_list(*columns)), maintained)
+
+    def test_leaderboard_is_ordered_by_rating(self):
+        body = self.client.get('/api/the-best/?k=10').json()
+        expected = Employee.objects.order_by('-rating_avg', '-experience')[:10]
+        self.assertEqual([row['linkedin'] for row in body], [employee.linkedin for employee in expected])
+        self.assertEqual([float(row['rating']) for row in body], [round(e.rating_avg, 2) for e in expected])
+
+    def test_only_the_leaderboard_shows_the_rating(self):
+        # the other employee endpoints keep the fields they had before the aggregates
+        for url in ('/api/employee/', '/api/employee-front-end/'):
+            with self.subTest(url=url):
+                body = self.client.get(url).json()
+                rows = body['employees'] if isinstance(body, dict) else body
+                self.assertEqual(list(rows[0]), ['user_first_name', 'user_last_name', 'experience', 'linkedin'])
+        self.assertIn('rating', self.client.get('/api/the-best/').json()[0])
+
+
+class ProductProjectionTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(products=8)
+
+    def get(self, fields):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/product/?fields={fields}')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query['sql'] for query in queries if 'api_product' in query['sql']]
+
+    def test_only_the_requested_columns_are_selected(self):
+        rows, queries = self.get('name,price')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0])
+        self.assertNotIn('photo', queries[0])
+        everything = self.client.get('/api/product/').json()
+        self.assertEqual(rows, [{'name': row['name'], 'price': row['price']} for row in everything])
+
+    def test_unknown_fields_are_ignored(self):
+        rows, _ = self.get('price,password,name,category__name')
+        # in the order of the model's fields, like the serializer with every field
+        self.assertEqual(list(rows[0]), ['name', 'price'])
+
+
+class ProductSearchTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(products=8)
+
+    def search(self, text):
+        response = self.client.get('/api/search/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()]
+
+    def create(self, name, description=''):
+        return Product.objects.create(name=name, description=description, price=1000,
+                                      category=Category.objects.first())
+
+    def test_the_index_is_used(self):
+        self.assertTrue(fts_available(connection))
+
+    def test_triggers_follow_inserts_updates_and_deletes(self):
+        product = self.create('Zorblax lamp')
+        self.assertEqual(self.search('zorblax'), ['Zorblax lamp'])
+
+        product.name = 'Quinoid lamp'
+        product.save()
+        self.assertEqual(self.search('zorblax'), [])
+        self.assertEqual(self.search('quinoid'), ['Quinoid lamp'])
+
+        product.delete()
+        self.assertEqual(self.search('quinoid'), [])
+
+    def test_name_hits_rank_first(self):
+        self.create('Plain case', 'fits the vexilloid phone')
+        self.create('Vexilloid case', 'a case')
+        self.assertEqual(self.search('vexilloid'), ['Vexilloid case', 'Plain case'])
+
+    def test_words_are_prefixes_and_all_required(self):
+        self.create('Vexilloid Pro 15')
+        self.create('Vexilloid Mini')
+        self.assertEqual(self.search('vexil 15'), ['Vexilloid Pro 15'])
+        self.assertEqual(sorted(self.search('VEXIL')), ['Vexilloid Mini', 'Vexilloid Pro 15'])
+
+    def test_fts_syntax_is_not_interpreted(self):
+        self.create('Vexilloid OR lamp')
+        # operators, quotes and column filters are plain words (or dropped), not FTS syntax
+        for text in ('vexilloid OR', '"vexilloid', 'vexilloid*)', '(lamp OR', '-lamp vexilloid', 'lamp:vexil'):
+            with self.subTest(text=text):
+                self.assertEqual(self.search(text), ['Vexilloid OR lamp'])
+        self.assertEqual(self.search('*'), [])
+
+
+class PopularUsersTests(BaseTestCase):
+    url = '/api/popular-user/'
+
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users(5)
+        cls.user = users[0]
+        # 3, 2, 2, 1 and no posts
+        a, b, c, d, _ = users
+        create_posts([a, a, a, b, b, c, c, d], create_jobs(2), range(1, 9))
+
+    def expected(self):
+        counts = dict(User.objects.annotate(n=Count('posts')).values_list('id', 'n'))
+        top = max(counts.values())
+        return sorted(pk for pk, n in counts.items() if n == top), top
+
+    def ids(self, rows):
+        # the generated full names are unique
+        pks = {user.full_name: user.pk for user in User.objects.all()}
+        return [pks[row['full_name']] for row in rows]
+
+    def test_every_user_tied_for_the_most_posts_in_one_query(self):
+        leader = User.objects.annotate(n=Count('posts')).order_by('-n', 'id').first()
+        runner_up = User.objects.exclude(pk=leader.pk).annotate(n=Count('posts')).order_by('-n', 'id').first()
+        for _ in range(leader.n - runner_up.n):
+            Post.objects.create(title='Tie', description='Tie', file='posts/bench.txt', deadline=timezone.now(),
+                                user=runner_up)
+        cache.clear()
+        with self.assertNumQueries(1):
+            rows = self.client.get(self.url).json()
+        ids, top = self.expected()
+        self.assertEqual(self.ids(rows), ids)
+        self.assertGreaterEqual(len(ids), 2)
+        self.assertEqual({row['posts_count'] for row in rows}, {top})
+
+    def test_cached_until_posts_change(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        ids, top = self.expected()
+        user = User.objects.exclude(pk__in=ids).first()
+        for _ in range(top + 1):
+            Post.objects.create(title='New', description='New', file='posts/bench.txt', deadline=timezone.now(),
+                                user=user)
+        self.assertEqual(self.ids(self.client.get(self.url).json()), [user.pk])
+
+        Post.objects.filter(user=user).delete()
+        self.assertEqual(self.ids(self.client.get(self.url).json()), ids)
+
+    def test_post_given_to_another_user(self):
+        leaders = self.expected()[0]
+        self.client.get(self.url)
+        user = User.objects.exclude(pk__in=leaders).first()
+        # the leaders lose their posts, the new owner gets them all
+        for post in Post.objects.filter(user_id__in=leaders):
+            post.user = user
+            post.save()
+        self.assertEqual(self.ids(self.client.get(self.url).json()), [user.pk])
+
+    def test_logins_keep_the_cache(self):
+        self.client.get(self.url)
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        ids, _ = self.expected()
+        leader = User.objects.get(pk=ids[0])
+        leader.first_name = 'Renamed'
+        leader.save()
+        self.assertIn('Renamed', str(self.client.get(self.url).json()))
+
+
+class StreamingTests(BaseTestCase):
+    urls = ('/api/post', '/api/subjob/', '/api/employee/', '/api/expired-posts/')
+
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users(3)
+        jobs = create_jobs(4)
+        create_posts(users, jobs, range(1, 13))
+        create_posts(users, jobs, range(1, 4), status=Post.PostStatusChoice.EXPIRED)
+        create_posts(users, jobs, [-3, -2, -1])
+        create_employees(users, [[5], [3, 4], [2]])
+
+    def stream(self, url):
+        response = self.client.get(url, {'stream': '1'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_same_body_and_order_as_without_stream(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.stream(url), self.client.get(url).json())
+
+    def test_post_list_in_keyset_page_order(self):
+        ids = [row['id'] for row in self.client.get('/api/post').json()['response']]
+        paged, url = [], '/api/post?page_size=50'
+        while url:
+            body = self.client.get(url).json()
+            paged += [row['id'] for row in body['response']]
+            url = body['next']
+        self.assertEqual(ids, paged)
+        expected = Post.objects.open().order_by('deadline', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    @override_settings(API_FAST_SERIALIZERS=False)
+    def test_regular_serializers(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.stream(url), self.client.get(url).json())
+
+    def test_rows_are_serialized_a_chunk_at_a_time(self):
+        queryset = SubJob.objects.order_by('id')
+        with CaptureQueriesContext(connection) as queries:
+            body = iter_json_array(queryset, SubJobModelSerializer, chunk_size=3)
+            self.assertEqual(next(body), b'[')
+            # nothing is read before the first row is asked for
+            self.assertEqual(len(queries), 0)
+            first = next(body)
+        self.assertEqual(json.loads(first), SubJobModelSerializer(instance=queryset.first()).data)
+        rows = json.loads(b'[' + first + b''.join(body))
+        self.assertEqual([row['id'] for row in rows], list(queryset.values_list('id', flat=True)))
+
+    def test_empty_list(self):
+        self.assertEqual(b''.join(iter_json_array(SubJob.objects.none(), SubJobModelSerializer)), b'[]')
+
+
+@override_settings(API_PERF_SAMPLE_RATE=1)
+class PerformanceMiddlewareTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_users(1)[0]
+        create_jobs(3)
+
+    def get(self, url):
+        with self.assertLogs('api.performance', 'INFO') as logs:
+            response = self.client.get(url)
+        self.assertEqual(len(logs.records), 1)
+        return response, logs.records[0], json.loads(logs.records[0].getMessage())
+
+    def test_server_timing_and_log_line(self):
+        with CaptureQueriesContext(connection) as queries:
+            response, record, line = self.get('/api/subjob/')
+        timing = dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+        self.assertEqual(set(timing), {'db', 'serializer', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertGreater(float(timing['serializer']), 0)
+
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertEqual(line['view'], 'subjob_list_apiview')
+        self.assertEqual((line['method'], line['path'], line['status']), ('GET', '/api/subjob/', 200))
+        self.assertEqual(line['queries'], len(queries))
+        self.assertEqual(line['query_budget'], 5)
+        self.assertFalse(line['streaming'])
+
+    @override_settings(API_PERF_QUERY_BUDGETS={'subjob_list_apiview': 0})
+    def test_over_the_query_budget(self):
+        _, record, line = self.get('/api/subjob/')
+        self.assertEqual(record.levelname, 'WARNING')
+        self.assertTrue(line['over_query_budget'])
+
+    def test_custom_timings(self):
+        response, _, line = self.get('/api/subjob/')
+        self.assertNotIn('password_hash', response['Server-Timing'])
+        response = self.client.post('/api/login/', {'email': self.user.email, 'password': PASSWORD},
+                                    content_type='application/json')
+        self.assertIn('password_hash;dur=', response['Server-Timing'])
+
+    @override_settings(API_PERF_SAMPLE_RATE=0)
+    def test_requests_that_are_not_sampled(self):
+        with self.assertNoLogs('api.performance'):
+            response = self.client.get('/api/subjob/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_only_api_views(self):
+        with self.assertNoLogs('api.performance'):
+            response = self.client.get('/admin/login/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class DetailCacheTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_users(2)[0]
+        jobs = create_jobs(3)
+        create_posts([cls.user], jobs, [1, 2])
+        create_catalog(products=6)
+
+    def get(self, url, etag=None):
+        return self.client.get(url, headers={'If-None-Match': etag} if etag else {})
+
+    def test_not_modified(self):
+        url = f'/api/category/{Category.objects.first().pk}'
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(self.get(url).headers['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.get(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_product_writes_bump_their_categories(self):
+        old, new = Category.objects.order_by('id')[:2]
+        urls = [f'/api/category/{old.pk}', f'/api/category/{new.pk}']
+        etags = [self.get(url).headers['ETag'] for url in urls]
+
+        product = Product.objects.filter(category=old).first()
+        product.category = new
+        product.save()
+        for url, etag in zip(urls, etags):
+            response = self.get(url, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn(product.name, [row['name'] for row in self.get(urls[1]).json()['products']])
+
+    def test_author_rename_bumps_posts_but_login_does_not(self):
+        post = Post.objects.filter(user=self.user).first()
+        url = f'/api/post/{post.pk}'
+        etag = self.get(url).headers['ETag']
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_ids_are_normalised(self):
+        job = SubJob.objects.values_list('job_id', flat=True).first()
+        etag = self.get(f'/api/subjob-detail?pk={job}').headers['ETag']
+        self.assertEqual(self.get(f'/api/subjob-detail?pk=0{job}', etag).status_code, 304)
+        for pk in ('', 'x', '1.5', '1%3A2'):
+            with self.subTest(pk=pk):
+                response = self.get(f'/api/subjob-detail?pk={pk}')
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('not found', response.json()['message'])
+        self.assertEqual(self.get('/api/subjob-detail').json(), {'message': 'Subjob with job_id None id not found!'})
+
+    def test_evicted_version(self):
+        url = f'/api/category/{Category.objects.first().pk}'
+        etag = self.get(url).headers['ETag']
+        # the version is gone between the add and the get of get_or_set
+        with patch.object(cache, 'get_or_set', return_value=None):
+            response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+
+class AsyncViewTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users(2)
+        cls.user = users[0]
+        jobs = create_jobs(4)
+        create_posts(users, jobs, range(1, 11))
+        create_catalog(products=6)
+
+    async def assertSameAsSync(self, url):
+        response = await self.async_client.get(f'/api/async{url}')
+        self.assertEqual(response.status_code, 200)
+        sync = await sync_to_async(self.client.get)(f'/api{url}')
+        # `next` links point at their own prefix
+        self.assertEqual(json.loads(response.content.replace(b'/api/async/', b'/api/')), sync.json())
+
+    async def test_same_responses_as_the_sync_views(self):
+        post = await Post.objects.order_by('id').afirst()
+        job = await SubJob.objects.values_list('job_id', flat=True).afirst()
+        category = await Category.objects.filter(products__isnull=False).values_list('id', flat=True).afirst()
+        product = await Product.objects.order_by('id').afirst()
+        for url in ('/post', '/post?page_size=7', '/subjob/', '/subjob/?page_size=3', f'/post/{post.pk}',
+                    f'/subjob-detail?pk={job}', f'/category/{category}', f'/search/?search={product.name.split()[0]}',
+                    '/post/0', '/category/0'):
+            with self.subTest(url=url):
+                await self.assertSameAsSync(url)
+
+    async def test_bad_cursor_is_not_found(self):
+        response = await self.async_client.get('/api/async/subjob/?cursor=zzz')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_relations_that_are_not_prefetched(self):
+        # a lazy relation read on the event loop would raise SynchronousOnlyOperation
+        post = await Post.objects.order_by('id').afirst()
+        data = await serialize(PostDetailModelSerializer, post)
+        self.assertEqual(data['user_first_name'], (await User.objects.aget(pk=post.user_id)).first_name)
+        category = await Category.objects.filter(products__isnull=False).afirst()
+        data = await serialize(CategoryDetailModelSerializer, [category], many=True)
+        self.assertTrue(data[0]['products'])
+
+    async def test_login(self):
+        response = await self.async_client.post('/api/async/login/', {'email': self.user.email,
+                                                                      'password': PASSWORD},
+                                                content_type='application/json')
+        self.assertEqual(response.json(), {'message': 'successfully login!'})
+        self.assertIn('sessionid', response.cookies)
+        response = await self.async_client.post('/api/async/login/', {'email': self.user.email,
+                                                                      'password': 'wrong'},
+                                                content_type='application/json')
+        self.assertNotEqual(response.json(), {'message': 'successfully login!'})
+
+
+class FakeRedis:
+    """
+    The list, string and lock commands api.mail uses, in memory.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def list(self, key):
+        return self.data.setdefault(key, [])
+
+    def rpush(self, key, *values):
+        self.list(key).extend(value.encode() if isinstance(value, str) else value for value in values)
+        return len(self.data[key])
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.list(key).insert(0, value.encode() if isinstance(value, str) else value)
+        return len(self.data[key])
+
+    def lmove(self, source, destination, where_from, where_to):
+        if not self.data.get(source):
+            return None
+        value = self.data[source].pop(0 if where_from == 'LEFT' else -1)
+        self.list(destination).insert(0 if where_to == 'LEFT' else len(self.list(destination)), value)
+        return value
+
+    def lrange(self, key, start, end):
+        values = self.data.get(key, [])
+        return values[start:None if end == -1 else end + 1]
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None, blocking=True):
+        return FakeLock(self, name)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((getattr(self.redis, name), args, kwargs))
+
+    def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class FakeLock:
+    def __init__(self, redis, name):
+        self.redis = redis
+        self.name = name
+
+    def acquire(self):
+        return bool(self.redis.set(self.name, 1, nx=True))
+
+    def reacquire(self):
+        pass
+
+    def release(self):
+        self.redis.delete(self.name)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_BATCH_SIZE=10)
+class MailQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch.object(mail, '_redis', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(mail.close_pooled_connection)
+
+    def enqueue(self, *names):
+        return [mail.enqueue({'subject': 'Verify', 'body': name, 'to': [f'{name}@example.com']}) for name in names]
+
+    def queued(self, key=mail.QUEUE_KEY):
+        return [json.loads(item)['body'] for item in self.redis.lrange(key, 0, -1)]
+
+    def sent(self):
+        return [message.body for message in django_mail.outbox]
+
+    def test_batch(self):
+        self.assertEqual(self.enqueue('a', 'b', 'c'), [True, False, False])
+        self.assertEqual(mail.flush(), (3, None))
+        self.assertEqual(self.sent(), ['a', 'b', 'c'])
+        self.assertEqual(self.queued(), [])
+        self.assertEqual(self.queued(mail.PROCESSING_KEY), [])
+        # the queue is empty, so the next message schedules a flush again
+        self.assertEqual(self.enqueue('d'), [True])
+
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_a_full_batch_schedules_the_next_flush(self):
+        self.enqueue('a', 'b', 'c')
+        sent, countdown = mail.flush()
+        self.assertEqual((sent, self.queued()), (2, ['c']))
+        self.assertIsNotNone(countdown)
+        self.assertEqual(mail.flush(), (1, None))
+
+    def test_connection_error_requeues_the_rest(self):
+        self.enqueue('a', 'b', 'c', 'd')
+        original = mail.send_messages
+
+        def send_messages(messages):
+            if messages[0]['body'] == 'b':
+                raise smtplib.SMTPServerDisconnected('gone')
+            return original(messages)
+
+        with patch.object(mail, 'send_messages', side_effect=send_messages):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                mail.flush()
+        self.assertEqual(self.sent(), ['a'])
+        self.assertEqual(self.queued(), ['b', 'c', 'd'])
+        self.assertEqual(self.queued(mail.PROCESSING_KEY), [])
+
+        self.assertEqual(mail.flush(), (3, None))
+        self.assertEqual(self.sent(), ['a', 'b', 'c', 'd'])
+
+    def test_rejected_message_is_dropped(self):
+        self.enqueue('a', 'b', 'c')
+        original = mail.send_messages
+
+        def send_messages(messages):
+            if messages[0]['body'] == 'b':
+                raise smtplib.SMTPRecipientsRefused({'b@example.com': (550, b'No such user')})
+            return original(messages)
+
+        with patch.object(mail, 'send_messages', side_effect=send_messages), \
+                self.assertLogs('api.mail', 'WARNING'):
+            self.assertEqual(mail.flush(), (2, None))
+        self.assertEqual(self.sent(), ['a', 'c'])
+        self.assertEqual(self.queued(), [])
+        self.assertEqual(self.queued(mail.PROCESSING_KEY), [])
+
+    def test_batch_left_by_a_dead_worker_is_sent_first(self):
+        self.enqueue('b')
+        self.redis.rpush(mail.PROCESSING_KEY, json.dumps({'subject': 'Verify', 'body': 'a', 'to': ['a@x.com']}))
+        self.assertEqual(mail.flush(), (2, None))
+        self.assertEqual(self.sent(), ['a', 'b'])
+
+    def test_flush_while_another_worker_is_sending(self):
+        self.enqueue('a', 'b')
+        mail.pop_batch(1)
+        self.redis.lock(mail.FLUSH_LOCK_KEY).acquire()
+        # the other worker's batch stays where it is and is not sent twice
+        self.assertEqual(mail.flush(), (0, settings.EMAIL_BATCH_WINDOW))
+        self.assertEqual(self.queued(mail.PROCESSING_KEY), ['a'])
+        self.assertEqual(self.queued(), ['b'])
+        self.assertEqual(self.sent(), [])
+
+    def test_pooled_connection_follows_the_backend(self):
+        connection = mail.get_pooled_connection()
+        self.assertIs(mail.get_pooled_connection(), connection)
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend'):
+            self.assertIsInstance(mail.get_pooled_connection(), DummyEmailBackend)
+        self.assertIsInstance(mail.get_pooled_connection(), LocmemEmailBackend)
+
+
+class VerificationTokenTests(BaseTestCase):
+    email, code = 'token@example.com', 123456
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_users(1)[0]
+
+    def setUp(self):
+        super().setUp()
+        # verification emails are sent in-process to the locmem outbox
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+
+    @staticmethod
+    def edit(token, **changes):
+        payload = json.loads(urlsafe_b64decode(token.encode()))
+        return urlsafe_b64encode(json.dumps({**payload, **changes}).encode()).decode()
+
+    def test_valid_token(self):
+        token = make_verification_token(self.email, self.code, REGISTER)
+        self.assertEqual(check_verification_token(token, self.code, REGISTER), self.email)
+
+    def test_wrong_code(self):
+        token = make_verification_token(self.email, self.code, REGISTER)
+        self.assertIsNone(check_verification_token(token, self.code + 1, REGISTER))
+
+    def test_tampered_token(self):
+        token = make_verification_token(self.email, self.code, REGISTER)
+        payload = json.loads(urlsafe_b64decode(token.encode()))
+        for tampered in (self.edit(token, email='other@example.com'), self.edit(token, exp=payload['exp'] + 3600),
+                         self.edit(token, mac='0' * 64), self.edit(token, exp=str(payload['exp'])),
+                         token[:-4], 'not a token', None):
+            with self.subTest(token=tampered):
+                self.assertIsNone(check_verification_token(tampered, self.code, REGISTER))
+
+    def test_expired_token(self):
+        token = make_verification_token(self.email, self.code, REGISTER, max_age=-1)
+        self.assertIsNone(check_verification_token(token, self.code, REGISTER))
+
+    def test_token_of_another_purpose(self):
+        token = make_verification_token(self.email, self.code, REGISTER)
+        self.assertIsNone(check_verification_token(token, self.code, FORGOT_PASSWORD))
+
+    def mailed_code(self):
+        return int(re.search(r'\d{6}', django_mail.outbox[-1].body).group())
+
+    def test_register_check(self):
+        data = {'first_name': 'Token', 'last_name': 'Test', 'email': self.email}
+        self.assertEqual(self.client.post('/api/auth/register/', data, content_type='application/json').status_code,
+                         200)
+        data = {'code': self.mailed_code(), 'password': 'new-password', 'confirm_password': 'new-password'}
+        response = self.client.post('/api/auth/register/check/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.get(email=self.email).is_active)
+
+    def test_forgot_password_rejects_a_register_token(self):
+        self.client.post('/api/auth/forgot_password/', {'email': self.user.email}, content_type='application/json')
+        code = self.mailed_code()
+        self.client.cookies['sedrfgvbhhytfrfgvbh'] = make_verification_token(self.user.email, code, REGISTER)
+        response = self.client.post('/api/auth/forgot_password/check/', {'code': code, 'new_password': 'changed'},
+                                    content_type='application/json')
+        self.assertEqual(response.json(), {'code': ['Incorrect code!']})
+        self.assertFalse(User.objects.get(pk=self.user.pk).check_password('changed'))
+
+    def test_forgot_password_check(self):
+        self.client.post('/api/auth/forgot_password/', {'email': self.user.email}, content_type='application/json')
+        response = self.client.post('/api/auth/forgot_password/check/',
+                                    {'code': self.mailed_code(), 'new_password': 'changed'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('changed'))
+
+
+class LoginTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_users(1)[0]
+
+    def login(self, password, email=None, url='/api/login/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'email': email or self.user.email, 'password': password},
+                                        content_type='application/json')
+        user_selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and '"api_user"' in q['sql']]
+        return response.json(), len(queries), user_selects
+
+    def test_one_user_query(self):
+        for url in ('/api/login/', '/api/async/login/'):
+            with self.subTest(url=url):
+                body, _, user_selects = self.login(PASSWORD, url=url)
+                self.assertEqual(body, {'message': 'successfully login!'})
+                self.assertEqual(len(user_selects), 1)
+
+    def test_failed_logins_are_one_query(self):
+        for url in ('/api/login/', '/api/async/login/'):
+            with self.subTest(url=url):
+                body, queries, _ = self.login('wrong', url=url)
+                self.assertEqual(body, {'password': ['Incorrect password!']})
+                self.assertEqual(queries, 1)
+                body, queries, _ = self.login(PASSWORD, email='nobody@example.com', url=url)
+                self.assertEqual(body, {'email': ['Email not found!']})
+                self.assertEqual(queries, 1)
+
+    def test_async_login_hashes_off_the_event_loop(self):
+        threads = []
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return check_password(*args, **kwargs)
+
+        with patch('api.auth.check_password', record_thread):
+            self.login(PASSWORD, url='/api/async/login/')
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('password-hash'))
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_hash_upgrade_is_saved_outside_the_hash_pool(self):
+        # a salt too short for MD5PasswordHasher: checking the password upgrades the hash
+        old = make_password(PASSWORD, 'short', 'md5')
+        User.objects.filter(pk=self.user.pk).update(password=old)
+        saves = []
+        save = User.save
+
+        def record_thread(user, *args, **kwargs):
+            saves.append((threading.current_thread().name, kwargs.get('update_fields')))
+            return save(user, *args, **kwargs)
+
+        with patch.object(User, 'save', record_thread):
+            body, _, _ = self.login(PASSWORD, url='/api/async/login/')
+        self.assertEqual(body, {'message': 'successfully login!'})
+        password = User.objects.get(pk=self.user.pk).password
+        self.assertNotEqual(password, old)
+        self.assertTrue(check_password(PASSWORD, password))
+        name, update_fields = saves[0]
+        self.assertEqual(update_fields, ['password'])
+        self.assertFalse(name.startswith('password-hash'))
+
+
+class BulkCreateTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(products=3)
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def products(self, count, prefix='Bulk'):
+        category = Category.objects.first()
+        return [{'name': f'{prefix} product {i}', 'price': 1000 + i, 'category': category.pk} for i in range(count)]
+
+    def errors(self, response):
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        # DRF before 3.16 returns an object per item ({} when valid), later versions {position: errors}
+        if isinstance(errors, list):
+            return {position: error for position, error in enumerate(errors) if error}
+        return {int(position): error for position, error in errors.items()}
+
+    def test_error_map_by_position(self):
+        existing = Category.objects.first().name
+        categories = Category.objects.count()
+        errors = self.errors(self.post('/api/category-create/', [
+            {'name': 'Alpha'}, {'name': 'Beta'}, {'name': 'Alpha'}, {'name': existing}, {'name': 'Bad1'}, {},
+        ]))
+        self.assertEqual(set(errors), {2, 3, 4, 5})
+        self.assertEqual(errors[2], {'name': ['Category with this name already exists!']})
+        self.assertEqual(errors[3], {'name': ['Category with this name already exists!']})
+        self.assertEqual(errors[4], {'name': ['Name must contains only letters!']})
+        self.assertEqual(list(errors[5]), ['name'])
+        # nothing is created when any row is invalid
+        self.assertEqual(Category.objects.count(), categories)
+
+    def test_unknown_foreign_key(self):
+        rows = self.products(3)
+        rows[1]['category'] = 0
+        rows[2]['category'] = 'x'
+        errors = self.errors(self.post('/api/create-product/', rows))
+        self.assertEqual(set(errors), {1, 2})
+        self.assertEqual(list(errors[1]), ['category'])
+        self.assertEqual(list(errors[2]), ['category'])
+
+    def test_queries_do_not_depend_on_the_batch_size(self):
+        counts = []
+        for size in (5, 50):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post('/api/create-product/', self.products(size, prefix=f'Batch{size}'))
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()['Products created']), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Product.objects.filter(name__startswith='Batch50 ').count(), 50)
+
+    def test_orders_update_the_revenue_rollups(self):
+        product = Product.objects.first()
+        before = ProductRevenue.objects.filter(product=product, status='delivered').values_list('revenue', flat=True)
+        before = before.first() or 0
+        order = {'phone_number': '+998901234567', 'longitude': '69.240562', 'latitude': '41.311081',
+                 'status': 'delivered', 'quantity': 1, 'amount': 500, 'product': product.pk}
+        response = self.post('/api/order-create/', [order, {**order, 'amount': 700}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row['items'] for row in response.json()], [[], []])
+        self.assertEqual(ProductRevenue.objects.get(product=product, status='delivered').revenue, before + 1200)
+
+    def test_too_many_rows(self):
+        with patch.object(views, 'BULK_CREATE_MAX_ITEMS', 3):
+            response = self.post('/api/create-product/', self.products(4))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ['non_field_errors'])
+
+    def test_single_object_keeps_its_response(self):
+        response = self.post('/api/category-create/', {'name': 'Single'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'Single')
+
+
+class QueryPlanTests(FixturesTestCase):
+    def test_full_scan_lines(self):
+        for line, table in [
+            ('SCAN api_post', 'api_post'),
+            ('SCAN TABLE api_post', 'api_post'),
+            ('SCAN api_post AS U0', 'api_post'),
+            ('Seq Scan on api_post  (cost=0.00..35.50 rows=2550 width=4)', None),
+        ]:
+            with self.subTest(line=line):
+                match = FULL_SCAN.search(line)
+                self.assertIsNotNone(match)
+                self.assertEqual(match['table'], table)
+                self.assertTrue(is_full_scan(line, [line]))
+
+    def test_lines_that_are_not_full_scans(self):
+        for line in ('SCAN api_post USING INDEX post_status_deadline_id_idx',
+                     'SCAN TABLE api_post USING COVERING INDEX post_expired_idx',
+                     'SCAN api_product_fts VIRTUAL TABLE INDEX 0:M1',
+                     'SCAN TABLE api_product_fts VIRTUAL TABLE INDEX 0:M1',
+                     'SCAN (subquery-1)', 'SCAN SUBQUERY 1',
+                     'SEARCH api_post USING INTEGER PRIMARY KEY (rowid=?)',
+                     'SEARCH TABLE api_post USING INDEX post_status_deadline_id_idx (status=?)'):
+            with self.subTest(line=line):
+                self.assertFalse(is_full_scan(line, [line]))
+        plan = ['CO-ROUTINE v1', 'SCAN api_post', 'SCAN v1']
+        self.assertEqual([line for line in plan if is_full_scan(line, plan)], ['SCAN api_post'])
+
+    def test_audited_routes_have_no_full_scans(self):
+        eager = celery_app.conf.task_always_eager
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+        output = StringIO()
+        # routes served from an index (a whole-table list like subjob/ is a scan by design)
+        routes = ['post', 'post/<int:pk>', 'the-best/', 'expired-posts/', 'category/<int:pk>', 'orders/<int:pk>',
+                  'orders/nearby/']
+        call_command('audit_query_plans', route=routes, fail_on_scan=True, only_flagged=True, stdout=output)
+        self.assertIn('No full table scans.', output.getvalue())
+
+    def test_models_and_migrations_agree(self):
+        call_command('makemigrations', 'api', check=True, dry_run=True, stdout=StringIO())
+
+
+class SQLitePragmaTests(SimpleTestCase):
+    def open(self, **database_settings):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = {**connections['default'].settings_dict, **database_settings,
+                         'NAME': os.path.join(directory.name, 'db.sqlite3')}
+        wrapper = SQLiteDatabaseWrapper(settings_dict, alias='pragmas')
+        self.addCleanup(wrapper.close)
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper.ensure_connection()
+        # applied on the sqlite3 connection, not logged as queries of the request that opened it
+        self.assertEqual(len(queries), 0)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    @override_settings(SQLITE_PRAGMAS=settings.SQLITE_PRODUCTION_PRAGMAS)
+    def test_production_profile(self):
+        wrapper = self.open(**settings.SQLITE_PRODUCTION_SETTINGS)
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), settings.SQLITE_PRODUCTION_PRAGMAS['cache_size'])
+        self.assertEqual(self.pragma(wrapper, 'mmap_size'), settings.SQLITE_PRODUCTION_PRAGMAS['mmap_size'])
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_development_profile(self):
+        wrapper = self.open()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 2)  # FULL
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL'})
+    def test_other_databases_are_left_alone(self):
+        # no sqlite3 connection to run them on, an AttributeError if it tried
+        other = type('Connection', (), {'vendor': 'postgresql', 'connection': None})()
+        apply_sqlite_pragmas(connection=other)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], DATABASE_REPLICA_LAG=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    def handle(self, request, view):
+        return ReplicaRoutingMiddleware(view)(request)
+
+    def test_reads_go_to_a_replica(self):
+        aliases = []
+
+        def view(request):
+            aliases.extend(router.db_for_read(Post) for _ in range(3))
+            return HttpResponse()
+
+        response = self.handle(RequestFactory().get('/'), view)
+        self.assertIn(aliases[0], ['replica1', 'replica2'])
+        # one replica for the whole request
+        self.assertEqual(set(aliases), {aliases[0]})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_reads_after_a_write_are_pinned(self):
+        aliases = []
+
+        def view(request):
+            aliases.append(router.db_for_read(Post))
+            self.assertEqual(router.db_for_write(Post), 'default')
+            aliases.append(router.db_for_read(Post))
+            return HttpResponse()
+
+        response = self.handle(RequestFactory().get('/'), view)
+        self.assertNotEqual(aliases[0], 'default')
+        self.assertEqual(aliases[1], 'default')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+    def test_pin_cookie_keeps_reads_on_the_primary(self):
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        response = self.handle(request, lambda request: HttpResponse(router.db_for_read(Post)))
+        self.assertEqual(response.content, b'default')
+
+    def test_unsafe_methods_and_use_primary_read_the_primary(self):
+        response = self.handle(RequestFactory().post('/'), lambda request: HttpResponse(router.db_for_read(Post)))
+        self.assertEqual(response.content, b'default')
+
+        def view(request):
+            with use_primary():
+                return HttpResponse(router.db_for_read(Post))
+
+        self.assertEqual(self.handle(RequestFactory().get('/'), view).content, b'default')
+
+    def test_use_primary_restores_the_route(self):
+        aliases = []
+
+        def view(request):
+            with use_primary():
+                aliases.append(router.db_for_read(Post))
+            aliases.append(router.db_for_read(Post))
+            with use_primary():
+                router.db_for_write(Post)
+            aliases.append(router.db_for_read(Post))
+            with use_primary():
+                aliases.append(router.db_for_read(Post))
+            aliases.append(router.db_for_read(Post))
+            return HttpResponse()
+
+        response = self.handle(RequestFactory().get('/'), view)
+        self.assertEqual(aliases[0], 'default')
+        self.assertIn(aliases[1], ['replica1', 'replica2'])
+        # the write inside the block pins the rest of the request, a later use_primary() doesn't unpin it
+        self.assertEqual(aliases[2:], ['default'] * 3)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_outside_a_request_everything_is_on_the_primary(self):
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_cookie_without_replicas(self):
+        def view(request):
+            router.db_for_write(Post)
+            return HttpResponse()
+
+        self.assertNotIn(PIN_COOKIE, self.handle(RequestFactory().get('/'), view).cookies)
+
+
+class UploadTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_users(1)[0]
+        create_jobs(1)
+        create_catalog(products=1)
+
+    def upload(self, content, name='report.txt', field='file'):
+        return self.client.post('/api/post-create/', {
+            'title': 'Upload', 'description': 'Upload test', 'deadline': timezone.now() + timedelta(days=1),
+            'user': self.user.pk, field: SimpleUploadedFile(name, content),
+        })
+
+    def stored_files(self):
+        # the media directory is shared by the tests of the class
+        directory = os.path.join(self.media_root, 'posts')
+        return {os.path.join(root, name) for root, _, names in os.walk(directory) for name in names}
+
+    def test_same_content_is_stored_once(self):
+        stored = self.stored_files()
+        self.assertEqual(self.upload(b'same content').status_code, 200)
+        self.assertEqual(self.upload(b'same content', name='copy.TXT').status_code, 200)
+        self.assertEqual(self.upload(b'other content').status_code, 200)
+
+        first, second, third = Post.objects.order_by('-id')[:3][::-1]
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, third.file.name)
+        self.assertEqual(len(self.stored_files() - stored), 2)
+        with first.file.open('rb') as file:
+            self.assertEqual(file.read(), b'same content')
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=100)
+    def test_file_over_the_limit(self):
+        posts, stored = Post.objects.count(), self.stored_files()
+        response = self.upload(b'x' * 101)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Post.objects.count(), posts)
+        self.assertEqual(self.stored_files(), stored)
+        self.assertEqual(self.upload(b'x' * 100).status_code, 200)
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=100, UPLOAD_MAX_FILE_SIZES={}, DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    def test_request_over_the_limit(self):
+        response = self.client.post('/api/post-create/', data=b'x' * 2000,
+                                    content_type='multipart/form-data; boundary=boundary')
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=100)
+    def test_admin_uploads_are_hashed(self):
+        self.client.force_login(User.objects.create_superuser('upload-admin@example.com', 'x'))
+        data = {'title': 'Upload', 'description': 'Admin upload', 'user': self.user.pk, 'status': 'new',
+                'jobs': [SubJob.objects.first().job_id],
+                'deadline_0': timezone.localdate() + timedelta(days=1), 'deadline_1': '12:00:00'}
+        response = self.client.post('/admin/api/post/add/', {**data, 'file': SimpleUploadedFile('big.txt', b'x' * 101)})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/admin/api/post/add/', {**data, 'file': SimpleUploadedFile('ok.txt', b'admin')})
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.latest('id')
+        self.assertEqual(post.file.name, f'posts/{post.file.name.split("/")[1]}/{sha256(b"admin").hexdigest()}.txt')
+
+    def test_admin_forms_keep_their_csrf_check(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_superuser('csrf-admin@example.com', 'x'))
+        data = {'title': 'Upload', 'description': 'Admin upload', 'user': self.user.pk, 'status': 'new',
+                'jobs': [SubJob.objects.first().job_id],
+                'deadline_0': timezone.localdate() + timedelta(days=1), 'deadline_1': '12:00:00',
+                'file': SimpleUploadedFile('csrf.txt', b'csrf')}
+        self.assertEqual(client.post('/admin/api/post/add/', data).status_code, 403)
+        token = client.get('/admin/api/post/add/').context['csrf_token']
+        data['file'].seek(0)
+        response = client.post('/admin/api/post/add/', {**data, 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+        # the API stays as it was: an anonymous client sends no token
+        self.assertEqual(Client(enforce_csrf_checks=True).post('/api/post-create/', {
+            'title': 'Upload', 'description': 'Upload test', 'deadline': timezone.now() + timedelta(days=1),
+            'user': self.user.pk, 'file': SimpleUploadedFile('api.txt', b'api'),
+        }).status_code, 200)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_one_temporary_file_per_upload(self):
+        # too big for MemoryFileUploadHandler, TemporaryFileUploadHandler would take it after the hashing one
+        with patch.object(TemporaryFileUploadHandler, 'new_file') as default_new_file:
+            self.assertEqual(self.upload(b'x' * 5000).status_code, 200)
+        default_new_file.assert_not_called()
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=100, FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_other_uploads_keep_the_default_handlers(self):
+        with patch.object(HashingFileUploadHandler, 'new_file') as new_file:
+            response = self.client.post('/api/create-product/', {
+                'name': 'Upload', 'price': 1, 'category': Category.objects.first().pk,
+                'photo': SimpleUploadedFile('photo.png', b'x' * 200),
+            })
+        self.assertNotEqual(response.status_code, 413)
+        new_file.assert_not_called()
+
+
+class PostExpiryTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users(3)
+        jobs = create_jobs(2)
+        # 25 of the new posts are made overdue in setUp
+        create_posts(users, jobs, range(1, 31))
+        create_posts(users, jobs, range(1, 6), status=Post.PostStatusChoice.COMPLETED)
+        create_posts(users, jobs, range(-5, 0), status=Post.PostStatusChoice.EXPIRED)
+
+    def setUp(self):
+        super().setUp()
+        new = Post.objects.filter(status=Post.PostStatusChoice.NEW)
+        self.overdue = set(new.order_by('id').values_list('id', flat=True)[:25])
+        new.filter(id__in=self.overdue).update(deadline=timezone.now() - timedelta(hours=1))
+        new.exclude(id__in=self.overdue).update(deadline=timezone.now() + timedelta(days=1))
+
+    def ids(self, queryset):
+        return set(queryset.values_list('id', flat=True))
+
+    def test_overdue_posts_are_expired_before_the_task_runs(self):
+        open_ids, expired_ids = self.ids(Post.objects.open()), self.ids(Post.objects.expired())
+        self.assertFalse(open_ids & self.overdue)
+        self.assertLessEqual(self.overdue, expired_ids)
+        self.assertEqual(open_ids | expired_ids, self.ids(Post.objects.exclude(status=Post.PostStatusChoice.COMPLETED)))
+
+    def test_expire_overdue_in_batches(self):
+        open_ids, expired_ids = self.ids(Post.objects.open()), self.ids(Post.objects.expired())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Post.expire_overdue(batch_size=10), len(self.overdue))
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(self.ids(Post.objects.filter(id__in=self.overdue, status=Post.PostStatusChoice.EXPIRED)),
+                         self.overdue)
+        # the lists don't change, only where their rows come from
+        self.assertEqual(self.ids(Post.objects.open()), open_ids)
+        self.assertEqual(self.ids(Post.objects.expired()), expired_ids)
+        self.assertEqual(Post.expire_overdue(), 0)
+
+    @override_settings(POST_EXPIRY_BATCH_SIZE=7)
+    def test_expire_posts_task(self):
+        self.assertEqual(expire_posts_task(), f'Expired {len(self.overdue)}')
+        self.assertFalse(Post.objects.filter(id__in=self.overdue, status=Post.PostStatusChoice.NEW).exists())
+        expired = Post.objects.filter(status=Post.PostStatusChoice.EXPIRED).count()
+        self.assertEqual(len(self.client.get('/api/expired-posts/').json()), expired)
+
+
+class FastSerializerTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users(3)
+        jobs = create_jobs(3)
+        create_posts(users, jobs, range(-3, 6))
+        create_posts(users, jobs, range(1, 4), status=Post.PostStatusChoice.EXPIRED)
+        create_employees(users, [[5, 4], [2], [3, 3]])
+        create_catalog(products=12)
+
+    def assertSameOutput(self, serializer_class, queryset):
+        renderer = JSONRenderer()
+        regular = renderer.render(serializer_class(instance=queryset.all(), many=True).data)
+        self.assertEqual(renderer.render(serializer_class.fast_data(queryset.all())), regular)
+
+    def test_fast_data_equals_serializer_data(self):
+        for serializer_class, queryset in cases():
+            with self.subTest(serializer=serializer_class.__name__):
+                self.assertTrue(queryset.exists())
+                self.assertSameOutput(serializer_class, queryset)
+
+    def test_fast_data_of_selected_product_fields(self):
+        for fields in (['name', 'price'], ['id', 'category', 'is_active'], ['photo', 'discount']):
+            with self.subTest(fields=fields):
+                allowed_fields = ProductDynamicModelSerializer.select_fields(fields)
+                serializer_class = ProductDynamicModelSerializer.for_fields(allowed_fields)
+                self.assertSameOutput(serializer_class, Product.objects.only(*allowed_fields).order_by('id'))
+
+    def test_one_class_and_reader_per_field_set(self):
+        names = [field.name for field in Product._meta.concrete_fields]
+        field_sets = [fields for n in range(1, len(names) + 1) for fields in combinations(names, n)][:100]
+        classes = [ProductDynamicModelSerializer.for_fields(fields) for fields in field_sets]
+        for serializer_class in classes:
+            compile_reader(serializer_class)
+        readers = compile_reader.cache_info().currsize
+        # requested again after more than 64 other field sets: the same classes, no new readers
+        self.assertEqual([ProductDynamicModelSerializer.for_fields(fields) for fields in field_sets], classes)
+        for serializer_class in classes:
+            compile_reader(serializer_class)
+        self.assertEqual(compile_reader.cache_info().currsize, readers)
+
+    def test_fast_data_runs_the_same_queries(self):
+        for serializer_class, queryset in cases():
+            with self.subTest(serializer=serializer_class.__name__):
+                with CaptureQueriesContext(connection) as regular:
+                    serializer_class(instance=queryset.all(), many=True).data
+                with CaptureQueriesContext(connection) as fast:
+                    serializer_class.fast_data(queryset.all())
+                self.assertEqual(len(fast), len(regular))
+
+
+class ORJSONTests(BaseTestCase):
+    data = {
+        'datetime': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+        'naive': datetime(2026, 1, 2, 3, 4, 5, 678901),
+        'date': date(2026, 1, 2),
+        'time': time(3, 4, 5, 678901),
+        'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+        'text': 'line\u2028separator',
+        'nested': [{'id': 1}, (2, 3)],
+        1: 'non-string key',
+    }
+
+    def test_renderer_output_of_drf(self):
+        self.assertEqual(json.loads(ORJSONRenderer().render(self.data)), json.loads(JSONRenderer().render(self.data)))
+        self.assertIn(b'\\u2028', ORJSONRenderer().render(self.data))
+        self.assertEqual(ORJSONRenderer().render({'price': Decimal('1.10')}), b'{"price":"1.10"}')
+
+    def test_json_response_output_of_django(self):
+        data = {**self.data, 'duration': timedelta(days=1, seconds=5), 'price': Decimal('1.10')}
+        self.assertEqual(json.loads(JsonResponse(data).content), json.loads(DjangoJsonResponse(data).content))
+        self.assertEqual(json.loads(JsonResponse(data).content)['datetime'], '2026-01-02T03:04:05.678Z')
+
+    def test_nan_is_null(self):
+        self.assertEqual(dumps([float('nan'), float('inf')]), b'[null,null]')
+
+    def test_request_bodies(self):
+        response = self.client.post('/api/test-order/', data='{"broken": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+        parsed = ORJSONParser().parse(BytesIO('{"name": "caf\u00e9"}'.encode('latin-1')),
+                                      parser_context={'encoding': 'latin-1'})
+        self.assertEqual(parsed, {'name': 'caf\u00e9'})
+
+
+class GeoTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_orders(20, create_catalog(products=3))
+        rng = Random(23)
+        points = [(rng.uniform(-60, 60), rng.uniform(179.5, 180)) for _ in range(40)]
+        points += [(rng.uniform(-60, 60), rng.uniform(-180, -179.5)) for _ in range(40)]
+        # around (0, 180), on both sides
+        points += [(rng.uniform(-0.5, 0.5), rng.uniform(179.5, 180)) for _ in range(10)]
+        points += [(rng.uniform(-0.5, 0.5), rng.uniform(-180, -179.5)) for _ in range(10)]
+        points += [(rng.uniform(89.9, 90), rng.uniform(-180, 180)) for _ in range(20)]
+        Order.objects.bulk_create(
+            Order(phone_number='+998900000000', status='delivered', amount=1,
+                  latitude=Decimal(f'{latitude:.6f}'), longitude=Decimal(f'{longitude:.6f}'))
+            for latitude, longitude in points
+        )
+
+    def brute_force_box(self, min_lat, min_lon, max_lat, max_lon):
+        ids = set()
+        for pk, latitude, longitude in Order.objects.values_list('pk', 'latitude', 'longitude'):
+            # a box past +-180 continues on the other side
+            shifted = (longitude + shift for shift in (-360, 0, 360))
+            if min_lat <= latitude <= max_lat and any(min_lon <= value <= max_lon for value in shifted):
+                ids.add(pk)
+        return ids
+
+    def test_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.encode(-90, -180, 3), '000')
+        self.assertEqual(geo.encode(90, 180, 3), 'zzz')
+        self.assertEqual((geo.next_prefix('u4p'), geo.next_prefix('u4z'), geo.next_prefix('zz')), ('u4q', 'u5', '~'))
+        order = Order.objects.first()
+        self.assertEqual(order.geohash, geo.encode(order.latitude, order.longitude))
+
+    def test_within_matches_brute_force(self):
+        orders = list(Order.objects.values_list('latitude', 'longitude'))
+        for latitude, longitude, radius in [(*orders[0], 1000), (*orders[1], 20_000), (41.3, 69.25, 100_000),
+                                            (0, 179.99, 100_000), (89.95, 0, 50_000)]:
+            with self.subTest(latitude=latitude, longitude=longitude, radius=radius):
+                expected = sorted(
+                    (geo.distance(latitude, longitude, order.latitude, order.longitude), order.pk)
+                    for order in Order.objects.all()
+                    if geo.distance(latitude, longitude, order.latitude, order.longitude) <= radius
+                )
+                self.assertTrue(expected)
+                found = Order.objects.within(latitude, longitude, radius)
+                self.assertEqual([(order.distance, order.pk) for order in found], expected)
+
+    def test_in_box_matches_brute_force(self):
+        for box in [(41.25, 69.15, 41.35, 69.3), (-60, 179.5, 60, 180.5), (-60, -180.5, 60, -179.5),
+                    (-90, -180, 90, 180), (89.9, -180, 90, 180)]:
+            with self.subTest(box=box):
+                expected = self.brute_force_box(*box)
+                self.assertTrue(expected)
+                self.assertEqual(set(Order.objects.in_box(*box).values_list('pk', flat=True)), expected)
+
+    def test_split_box(self):
+        self.assertEqual(geo.split_box(0, 170, 10, 190), [(0, 170, 10, 180), (0, -180, 10, -170)])
+        self.assertEqual(geo.split_box(0, -190, 10, -170), [(0, 170, 10, 180), (0, -180, 10, -170)])
+        self.assertEqual(geo.split_box(-95, -200, 95, 200), [(-90, -180, 90, 180)])
+
+    def test_nearby_endpoint(self):
+        ids = lambda response: {row['id'] for row in response.json()['response']}
+        response = self.client.get('/api/orders/nearby/', {'bbox': '179.5,-60,-179.5,60', 'limit': 1000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ids(response), self.brute_force_box(-60, 179.5, 60, 180.5))
+        response = self.client.get('/api/orders/nearby/', {'latitude': 0, 'longitude': 179.99, 'radius': 100_000})
+        distances = [row['distance'] for row in response.json()['response']]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(self.client.get('/api/orders/nearby/', {'latitude': 0}).status_code, 400)
+
+
+class RevenueRollupTests(BaseTestCase):
+    keys = {
+        ProductRevenue: ('product_id', 'status'),
+        CategoryRevenue: ('product__category_id', 'status'),
+        StatusRevenue: ('status',),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        create_orders(30, create_catalog(products=6))
+
+    def assertRollupsMatchOrders(self):
+        for rollup, keys in self.keys.items():
+            orders = Order.objects.all() if rollup is StatusRevenue else Order.objects.filter(product__isnull=False)
+            expected = {
+                tuple(row[key] for key in keys): (row['count'], row['total_quantity'], row['total_amount'])
+                for row in orders.order_by().values(*keys).annotate(
+                    count=Count('id'), total_quantity=Sum('quantity'), total_amount=Sum('amount'))
+            }
+            columns = [field.attname for field in map(rollup._meta.get_field, rollup.key_fields)]
+            stored = {
+                tuple(row[:-3]): tuple(row[-3:])
+                for row in rollup.objects.values_list(*columns, 'order_count', 'quantity', 'revenue')
+                if any(row[-3:])
+            }
+            with self.subTest(rollup=rollup.__name__):
+                self.assertEqual(stored, expected)
+
+    def other_status(self, order):
+        return next(status for status in Order.OrderStatusChoice.values if status != order.status)
+
+    def test_fixtures_are_rebuilt(self):
+        self.assertTrue(StatusRevenue.objects.exists())
+        self.assertRollupsMatchOrders()
+
+    def test_status_change(self):
+        order = Order.objects.first()
+        order.status = self.other_status(order)
+        order.save()
+        self.assertRollupsMatchOrders()
+
+        order = Order.objects.only('id').last()
+        order.status = self.other_status(Order.objects.get(pk=order.pk))
+        order.amount = 1
+        order.save(update_fields=['status', 'amount'])
+        self.assertRollupsMatchOrders()
+
+    def test_product_change(self):
+        order = Order.objects.filter(product__isnull=False).first()
+        order.product = Product.objects.exclude(pk=order.product_id).first()
+        order.save()
+        order = Order.objects.filter(product__isnull=False).last()
+        order.product = None
+        order.save()
+        self.assertRollupsMatchOrders()
+
+    def test_create_and_delete(self):
+        Order.objects.create(phone_number='+998901234567', longitude='69.240562', latitude='41.311081',
+                             status=Order.OrderStatusChoice.delivered, quantity=2, amount=500,
+                             product=Product.objects.first())
+        Order.objects.first().delete()
+        Order.objects.filter(status=Order.OrderStatusChoice.canceled).delete()
+        self.assertRollupsMatchOrders()
+
+    def test_product_moved_and_deleted(self):
+        product = Product.objects.filter(orders__isnull=False).first()
+        product.category = Category.objects.exclude(pk=product.category_id).first()
+        product.save()
+        self.assertRollupsMatchOrders()
+
+        product.delete()
+        self.assertRollupsMatchOrders()
+
+    def test_report(self):
+        response = self.client.get('/api/reports/revenue/statuses/')
+        expected = {
+            row['status']: row['total'] for row in Order.objects.values('status').annotate(total=Sum('amount'))
+        }
+        self.assertEqual({row['status']: row['revenue'] for row in response.json()['response']}, expected)
+
+    def test_rebuild_after_a_queryset_update(self):
+        # no signals: the rollups are out of date until rebuilt
+        self.assertTrue(Order.objects.filter(status=Order.OrderStatusChoice.canceled).update(amount=F('amount') + 1))
+        Order.rebuild_revenue()
+        self.assertRollupsMatchOrders()
+
+
+class CatalogTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(products=6)
+        catalog.build_snapshot()
+
+    def get(self, gzipped, etag=None):
+        headers = {'Accept-Encoding': 'gzip, deflate' if gzipped else 'identity'}
+        if etag:
+            headers['If-None-Match'] = etag
+        return self.client.get('/api/catalog/', headers=headers)
+
+    def body(self, response):
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return gzip.decompress(content) if response.get('Content-Encoding') == 'gzip' else content
+
+    def test_gzipped_and_plain_bodies(self):
+        gzipped, plain = self.get(True), self.get(False)
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(self.body(gzipped), self.body(plain))
+        categories = Category.objects.prefetch_related('products').order_by('id')
+        expected = CategoryDetailModelSerializer(instance=categories, many=True).data
+        self.assertEqual(json.loads(self.body(plain)), json.loads(dumps(expected)))
+        for response in (gzipped, plain):
+            self.assertIn('Accept-Encoding', response['Vary'])
+        # one strong ETag per body
+        self.assertEqual(gzipped['ETag'], f'"{catalog.current_version()}-gz"')
+        self.assertEqual(plain['ETag'], f'"{catalog.current_version()}"')
+
+    def test_not_modified_only_for_the_same_coding(self):
+        gzip_etag, plain_etag = self.get(True)['ETag'], self.get(False)['ETag']
+        self.assertEqual(self.get(True, gzip_etag).status_code, 304)
+        self.assertEqual(self.get(False, plain_etag).status_code, 304)
+        self.assertEqual(self.get(True, f'{plain_etag}, W/"other"').status_code, 200)
+        response = self.get(False, gzip_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], plain_etag)
+
+    def test_rebuilt_after_a_write(self):
+        eager = celery_app.conf.task_always_eager
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+        celery_app.conf.task_always_eager = True
+        old = self.get(False)
+        self.assertEqual(catalog.build_snapshot(), catalog.current_version())
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Snapshot test')
+        self.assertNotEqual(self.get(False, old['ETag']).status_code, 304)
+        self.assertIn(b'Snapshot test', self.body(self.get(True)))
+
+    def test_first_snapshot_is_built_outside_the_request(self):
+        eager = celery_app.conf.task_always_eager
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+        celery_app.conf.task_always_eager = True
+        directory = os.path.join(self.media_root, 'first-snapshot')
+        with override_settings(CATALOG_SNAPSHOT_DIR=directory):
+            with patch('api.catalog.build_snapshot', wraps=catalog.build_snapshot) as build:
+                with self.captureOnCommitCallbacks() as callbacks:
+                    response = self.get(False)
+                build.assert_not_called()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Cache-Control'], 'no-store')
+                self.assertFalse(response.has_header('ETag'))
+                # the build is scheduled
+                for callback in callbacks:
+                    callback()
+                build.assert_called_once()
+            response = self.get(False)
+            self.assertEqual(response['ETag'], f'"{catalog.current_version()}"')
+            self.assertEqual(response.content, catalog.render_catalog())
+
+    def test_snapshot_removed_while_serving(self):
+        version = catalog.current_version()
+        # the version read first was removed by a rebuild, which made `version` current
+        with patch('api.catalog.current_version', side_effect=['0' * 20, version]):
+            response = self.get(True)
+        self.assertEqual(response['ETag'], f'"{version}-gz"')
+
+        # the snapshot directory is shared by the tests of the class
+        self.addCleanup(catalog.build_snapshot)
+        with self.captureOnCommitCallbacks() as callbacks:
+            os.unlink(catalog.snapshot_path(version))
+            response = self.get(True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertEqual(self.body(response), catalog.render_catalog())
+        self.assertEqual(len(callbacks), 1)
 
-# Create your tests here.
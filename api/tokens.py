@@ -0,0 +1,48 @@
+import json
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+VERIFICATION_MAX_AGE = 300
+
+REGISTER = 'register'
+FORGOT_PASSWORD = 'forgot-password'
+
+
+def _mac(purpose, email, expires, code):
+    # keyed with SECRET_KEY: the 6 digit code can't be brute forced from the token without the key
+    return salted_hmac(f'api.tokens.{purpose}', f'{email}\n{expires}\n{code}', algorithm='sha256').hexdigest()
+
+
+def make_verification_token(email, code, purpose, max_age=VERIFICATION_MAX_AGE):
+    """
+    Token for the verification cookie: the email, an expiry and an HMAC over (purpose, email, expiry, code).
+    Costs one HMAC instead of a PBKDF2 hash of the code.
+    """
+    expires = int(time.time()) + max_age
+    payload = {'email': email, 'exp': expires, 'mac': _mac(purpose, email, expires, code)}
+    return urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def read_verification_token(token):
+    """
+    Payload of `token` or None. Not verified: use `check_verification_token` before trusting it.
+    """
+    try:
+        payload = json.loads(urlsafe_b64decode(token.encode()))
+        return payload if {'email', 'exp', 'mac'} <= payload.keys() else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def check_verification_token(token, code, purpose):
+    """
+    Email the token was issued to, if `code` matches and the token hasn't expired; otherwise None.
+    """
+    payload = read_verification_token(token)
+    if payload is None or not isinstance(payload['exp'], int) or payload['exp'] < time.time():
+        return None
+    if not constant_time_compare(payload['mac'], _mac(purpose, payload['email'], payload['exp'], code)):
+        return None
+    return payload['email']
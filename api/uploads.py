@@ -0,0 +1,131 @@
+"""
+Upload pipeline of Post.file and Employee.cv: the multipart body is streamed into a temporary file in chunks
+and hashed on the way (HashingFileUploadHandler, on the views decorated with `hashing_uploads`), then stored
+under its SHA-256 (ContentAddressedStorage). A file that is already stored is not written again, and a new one
+is moved into place instead of copied. Other uploads keep settings.FILE_UPLOAD_HANDLERS.
+"""
+import hashlib
+import os
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.utils.deconstruct import deconstructible
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from rest_framework.exceptions import APIException
+from rest_framework.status import HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(APIException, RequestDataTooBig):
+    # a 413 from DRF views, a 400 (RequestDataTooBig) from plain Django ones like the admin
+    status_code = HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+
+def max_file_size(field_name):
+    return getattr(settings, 'UPLOAD_MAX_FILE_SIZES', {}).get(field_name, settings.UPLOAD_MAX_FILE_SIZE)
+
+
+def max_request_size():
+    # the biggest file allowed plus the other form fields
+    limits = [settings.UPLOAD_MAX_FILE_SIZE, *getattr(settings, 'UPLOAD_MAX_FILE_SIZES', {}).values()]
+    return max(limits) + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """
+    Writes every uploaded file to a temporary file chunk by chunk and sets `content_hash` (SHA-256 hex) on it.
+    A request whose Content-Length is over the limit is rejected before its body is read, a file is rejected
+    as soon as it goes over settings.UPLOAD_MAX_FILE_SIZE (or its field's UPLOAD_MAX_FILE_SIZES entry).
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > max_request_size():
+            raise UploadTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.limit = max_file_size(self.field_name)
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.file = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        # the default handlers after this one don't open a file of their own
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.limit:
+            self.file.close()
+            raise UploadTooLarge(f'{self.field_name}: files up to {self.limit} bytes are allowed.')
+        self.hash.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.content_hash = self.hash.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def hashing_uploads(view):
+    """
+    Runs the uploads of `view` through HashingFileUploadHandler. Upload handlers can only change before the
+    body is parsed, and a CSRF check parses it, so this is Django's recipe for that: the handler is added in
+    a csrf_exempt outer view, the CSRF check runs in the csrf_protect inner one. Views exempt on their own
+    stay exempt (api_view: DRF's SessionAuthentication checks CSRF when the view reads request.data).
+    """
+    inner = view if getattr(view, 'csrf_exempt', False) else csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, HashingFileUploadHandler(request))
+        return inner(request, *args, **kwargs)
+
+    return wrapper
+
+
+def content_hash(content):
+    if getattr(content, 'content_hash', None):
+        return content.content_hash
+    # files that didn't come through the upload handler (e.g. saved from code)
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible(path='api.uploads.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Saves `posts/report.pdf` as `posts/<hash[:2]>/<hash>.pdf`. Identical content gets the same name, so it is
+    stored once and shared by every row pointing at it; existing files are never written again.
+    """
+
+    def __init__(self, **kwargs):
+        # two uploads of the same new file may race to the same name, the second simply replaces it
+        super().__init__(allow_overwrite=True, **kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = content_hash(content)
+        extension = os.path.splitext(name)[1].lower()[:10]
+        name = os.path.join(os.path.dirname(name), digest[:2], digest + extension).replace('\\', '/')
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+content_storage = ContentAddressedStorage()
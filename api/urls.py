@@ -5,7 +5,8 @@ from api.views import post_list_apiview, post_create_apiview, subjob_list_apivie
     employees_for_subjob, expired_posts, product_create_api_view, order_item_api_view, product_dynamic_fields_api_view, \
     category_detail_api_view, category_create_api_view, order_create_api_view, profile_api_view, \
     products_by_search_api_view, product_activate_api_view, test_order_create_api_view, register_api_view, check_code, \
-    forgot_password_api_view, forgot_password_check_api_view, login_api_view
+    forgot_password_api_view, forgot_password_check_api_view, login_api_view, nearby_orders_api_view, \
+    product_revenue_api_view, category_revenue_api_view, status_revenue_api_view, catalog_api_view
 urlpatterns = [
     path('post', post_list_apiview),
     path('post-create/', post_create_apiview),
@@ -21,8 +22,13 @@ urlpatterns = [
     path('expired-posts/', expired_posts),
     path('create-product/', product_create_api_view),
     path('orders/<int:pk>', order_item_api_view),
+    path('orders/nearby/', nearby_orders_api_view),
+    path('reports/revenue/products/', product_revenue_api_view),
+    path('reports/revenue/categories/', category_revenue_api_view),
+    path('reports/revenue/statuses/', status_revenue_api_view),
     path('product/', product_dynamic_fields_api_view),
     path('category/<int:pk>', category_detail_api_view),
+    path('catalog/', catalog_api_view),
     path('category-create/', category_create_api_view),
     path('order-create/', order_create_api_view),
     path('profile/', profile_api_view),
@@ -1,39 +1,72 @@
 import random
-from datetime import datetime
 from django.contrib.auth import login
-from django.contrib.auth.hashers import make_password
-from django.db.models import Count, Sum, Q
-from django.db.models.fields import FloatField
-from django.db.models.functions import Cast
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db.models import Count, F, Window, Prefetch, prefetch_related_objects
+from django.db.models.functions import Rank
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST
 
-from api.models import Post, SubJob, Employee, User, Category, Order, Product
+from api.cache import cached_detail_response
+from api.catalog import catalog_response
+from api.models import Post, SubJob, Employee, User, Category, Order, Product, OrderItem, ProductRevenue, \
+    CategoryRevenue, StatusRevenue
+from api.pagination import PostKeysetPagination, SubJobKeysetPagination
+from api.renderers import JsonResponse
+from api.reports import revenue_report
+from api.search import search_products
+from api.streaming import is_stream_requested, stream_json_response
 from api.serializers import PostModelSerializer, SubJobModelSerializer, EmployeeModelSerializer, \
     PostDetailModelSerializer, MyPostModelSerializer, TheMostPopularUserModelSerializer, ExpiredPostModelSerializer, \
     ProductModelSerializer, CategoryModelSerializer, OrderModelSerializer, ProductDynamicModelSerializer, \
-    CategoryDetailModelSerializer, ProfileModelSerializer, ProductByCategoryModelSerializer, \
+    CategoryDetailModelSerializer, ProfileModelSerializer, \
     ProductBySearchModelSerializer, TestOrderModelSerializer, RegisterModelSerializer, RegisterCheckModelSerializer, \
-    ForgotPasswordSerializer, ForgotPasswordCheckSerializer, LoginSerializer
+    ForgotPasswordSerializer, ForgotPasswordCheckSerializer, LoginSerializer, NearbyOrderModelSerializer, \
+    NearbyQuerySerializer, RatedEmployeeModelSerializer
+from api.signals import POPULAR_USERS_CACHE_KEY
 from api.tasks import send_email_task
+from api.tokens import make_verification_token, read_verification_token, REGISTER, FORGOT_PASSWORD, \
+    VERIFICATION_MAX_AGE
+from api.uploads import hashing_uploads
+
+
+BULK_CREATE_MAX_ITEMS = 5000
 
 
 def random_code():
     return random.randrange(10 ** 5, 10 ** 6)
 
 
-@extend_schema(tags=['post'], responses=PostModelSerializer)
+stream_parameter = OpenApiParameter(
+    name='stream', description="`1` streams the whole list as a chunked JSON array", type=bool)
+
+cursor_parameters = [
+    OpenApiParameter(name='cursor', description="Opaque `next` cursor from the previous page", type=str),
+    OpenApiParameter(name='page_size', description="Page size (max 500). Enables cursor pagination", type=int),
+    stream_parameter,
+]
+
+
+@extend_schema(tags=['post'], responses=PostModelSerializer, parameters=cursor_parameters)
 @api_view(['GET'])
 def post_list_apiview(request):
     if request.method == 'GET':
-        posts = Post.objects.filter(status=Post.PostStatusChoice.NEW)
-        s = PostModelSerializer(instance=posts, many=True).data
+        # the keyset pages' order, with or without ?stream=1; post_status_deadline_id_idx serves it without a sort
+        posts = Post.objects.open().prefetch_related('jobs').order_by(*PostKeysetPagination.ordering)
+        paginator = PostKeysetPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(posts, request)
+            s = PostModelSerializer(instance=page, many=True).data
+            return JsonResponse({"response": s, "next": paginator.get_next_link()}, status=HTTP_200_OK)
+        if is_stream_requested(request):
+            return stream_json_response(posts, PostModelSerializer, key='response')
+        s = PostModelSerializer.fast_data(posts)
         return JsonResponse({"response": s}, status=HTTP_200_OK)
 
 
+# outermost: the upload handler has to be in place before api_view's Request parses the body
+@hashing_uploads
 @extend_schema(tags=['post'], request=PostModelSerializer)
 @api_view(['POST'])
 def post_create_apiview(request):
@@ -47,11 +80,18 @@ def post_create_apiview(request):
     return JsonResponse({"message": "Something went wrong!"})
 
 
-@extend_schema(tags=['subjob'], responses=SubJobModelSerializer)
+@extend_schema(tags=['subjob'], responses=SubJobModelSerializer, parameters=cursor_parameters)
 @api_view(['GET'])
 def subjob_list_apiview(request):
-    subjobs = SubJob.objects.all()
-    s = SubJobModelSerializer(instance=subjobs, many=True).data
+    subjobs = SubJob.objects.order_by('id')
+    paginator = SubJobKeysetPagination()
+    if paginator.is_requested(request):
+        page = paginator.paginate_queryset(subjobs, request)
+        s = SubJobModelSerializer(instance=page, many=True).data
+        return paginator.get_paginated_response(s)
+    if is_stream_requested(request):
+        return stream_json_response(subjobs, SubJobModelSerializer)
+    s = SubJobModelSerializer.fast_data(subjobs)
     return Response(s)
 
 
@@ -72,18 +112,23 @@ def subjob_list_apiview(request):
 @api_view(['GET'])
 def subjob_detail_apiview(request):
     pk = dict(request.query_params.items()).get('pk')
-    if not SubJob.objects.filter(job_id=pk).exists():
+
+    def build():
+        return SubJobModelSerializer.fast_data(SubJob.objects.filter(job_id=pk)) or None
+
+    response = cached_detail_response(request, 'job', pk, build)
+    if response is None:
         return JsonResponse({"message": f"Subjob with job_id {pk} id not found!"})
-    subjobs = SubJob.objects.filter(job_id=pk)
-    s = SubJobModelSerializer(instance=subjobs, many=True).data
-    return Response(s)
+    return response
 
 
-@extend_schema(tags=['employee'], responses=EmployeeModelSerializer)
+@extend_schema(tags=['employee'], responses=EmployeeModelSerializer, parameters=[stream_parameter])
 @api_view(['GET', 'POST'])
 def employee_list_apiview(request):
-    employees = Employee.objects.all()
-    s = EmployeeModelSerializer(instance=employees, many=True).data
+    employees = Employee.objects.select_related('user').order_by('id')
+    if is_stream_requested(request):
+        return stream_json_response(employees, EmployeeModelSerializer)
+    s = EmployeeModelSerializer.fast_data(employees)
     return Response(s, status=HTTP_200_OK)
 
 
@@ -96,11 +141,14 @@ def employee_detail_apiview(request, pk):
 @extend_schema(tags=['post'], responses=PostDetailModelSerializer)
 @api_view(['GET'])
 def post_detail_apiview(request, pk):
-    if not Post.objects.filter(pk=pk).exists():
+    def build():
+        post = Post.objects.select_related('user').filter(pk=pk).first()
+        return PostDetailModelSerializer(instance=post).data if post else None
+
+    response = cached_detail_response(request, 'post', pk, build)
+    if response is None:
         return JsonResponse({"message": f"Post with id {pk} not found!"})
-    post = Post.objects.get(pk=pk)
-    s = PostDetailModelSerializer(instance=post).data
-    return Response(s, status=HTTP_200_OK)
+    return response
 
 
 @extend_schema(tags=['homework-2'], responses=MyPostModelSerializer)
@@ -109,53 +157,57 @@ def get_my_posts(request):
     if not request.user.is_authenticated:
         return JsonResponse({"message": "You have to login to see your posts!"})
     posts = Post.objects.filter(user=request.user)
-    s = MyPostModelSerializer(instance=posts, many=True).data
+    s = MyPostModelSerializer.fast_data(posts)
     return JsonResponse({'customer_name': request.user.get_full_name(), 'posts': s}, status=HTTP_200_OK)
 
 
 @extend_schema(tags=['homework-2'], responses=TheMostPopularUserModelSerializer)
 @api_view(['GET'])
 def the_most_popular(request):
-    users = User.objects.annotate(posts_count=Count('posts')).order_by('-posts_count')
-    fuser = users.first()
-    s = TheMostPopularUserModelSerializer(instance=fuser).data
-    users = User.objects.annotate(posts_count=Count('posts')).exclude(id=fuser.id).order_by('posts_count')
-    my_list = [s]
-
-    for user in users:
-        if user.posts_count >= s.get('posts_count'):
-            ts = TheMostPopularUserModelSerializer(instance=user).data
-            my_list.append(ts)
-        else:
-            break
-    return Response(my_list, status=HTTP_200_OK)
-
-
-@extend_schema(tags=['homework-2'], responses=EmployeeModelSerializer)
+    leaderboard = cache.get(POPULAR_USERS_CACHE_KEY)
+    if leaderboard is None:
+        # every user tied for the most posts, ranked in one query
+        users = User.objects.annotate(
+            posts_count=Count('posts'),
+            rank=Window(Rank(), order_by=F('posts_count').desc()),
+        ).filter(rank=1).order_by('id')
+        leaderboard = TheMostPopularUserModelSerializer(instance=users, many=True).data
+        cache.set(POPULAR_USERS_CACHE_KEY, leaderboard, timeout=None)
+    return Response(leaderboard, status=HTTP_200_OK)
+
+
+@extend_schema(tags=['homework-2'], responses=RatedEmployeeModelSerializer, parameters=[
+    OpenApiParameter(name='k', description="How many employees to return (default 5, max 100)", type=int)
+])
 @api_view(['GET'])
 def the_best_employees(request):
-    employees = Employee.objects.annotate(
-        rating=Sum(Cast('ratings__rating', FloatField())) / Count('ratings')).order_by('-rating', '-experience')[:5]
-    s = EmployeeModelSerializer(instance=employees, many=True).data
+    try:
+        k = min(max(int(request.query_params.get('k', 5)), 1), 100)
+    except ValueError:
+        k = 5
+    # reads the top of employee_rating_avg_idx instead of aggregating the whole ratings table
+    employees = Employee.objects.select_related('user').order_by('-rating_avg', '-experience')[:k]
+    s = RatedEmployeeModelSerializer.fast_data(employees)
     return Response(s, status=HTTP_200_OK)
 
 
 @extend_schema(tags=['homework-2'], responses=EmployeeModelSerializer)
 @api_view(['GET'])
 def employees_for_subjob(request):
-    employees = Employee.objects.filter(experience__gte=3)
-    s = EmployeeModelSerializer(instance=employees, many=True).data
+    employees = Employee.objects.select_related('user').filter(experience__gte=3)
+    s = EmployeeModelSerializer.fast_data(employees)
     return JsonResponse({"Subjob name": "Front end", "employees": s}, status=HTTP_200_OK)
 
 
-@extend_schema(tags=['homework-2'], responses=ExpiredPostModelSerializer)
+@extend_schema(tags=['homework-2'], responses=ExpiredPostModelSerializer, parameters=[stream_parameter])
 @api_view(['GET'])
 def expired_posts(request):
-    now = datetime.now()
-    posts = Post.objects.filter(deadline__lt=now)
-    if not posts.exists():
+    posts = Post.objects.expired().order_by('id')
+    if is_stream_requested(request):
+        return stream_json_response(posts, ExpiredPostModelSerializer)
+    s = ExpiredPostModelSerializer.fast_data(posts)
+    if not s:
         return JsonResponse({'message': 'There is not any expired post!'})
-    s = ExpiredPostModelSerializer(instance=posts, many=True).data
     return Response(s, status=HTTP_200_OK)
 
 
@@ -163,6 +215,15 @@ def expired_posts(request):
 @api_view(['POST'])
 def product_create_api_view(request):
     data = request.data
+    if isinstance(data, list):
+        s = ProductModelSerializer(data=data, many=True, max_length=BULK_CREATE_MAX_ITEMS)
+        if s.is_valid():
+            products = s.save()
+            prefetch_related_objects(products, 'category')
+            serialized_products = ProductModelSerializer(instance=products, many=True).data
+            return JsonResponse({"Products created": serialized_products}, status=HTTP_201_CREATED)
+        return JsonResponse(s.errors, safe=False, status=HTTP_400_BAD_REQUEST)
+
     s = ProductModelSerializer(data=data)
     if s.is_valid():
         product = s.save()
@@ -175,9 +236,9 @@ def product_create_api_view(request):
 @extend_schema(tags=['Order'], responses=OrderModelSerializer)
 @api_view(['GET'])
 def order_item_api_view(request, pk):
-    if not Order.objects.filter(id=pk).exists():
+    order = OrderModelSerializer.setup_eager_loading(Order.objects.filter(id=pk)).first()
+    if order is None:
         return JsonResponse({"message": f"Order with id {pk} not found!"})
-    order = Order.objects.get(id=pk)
     serialized_order = OrderModelSerializer(instance=order).data
     return JsonResponse(serialized_order, status=HTTP_200_OK)
     # try:
@@ -188,6 +249,66 @@ def order_item_api_view(request, pk):
     #     return JsonResponse({"message": f"Order with id {pk} not found!"})
 
 
+@extend_schema(tags=['Order'], responses=NearbyOrderModelSerializer, parameters=[
+    OpenApiParameter(name="latitude", description="Markaz kengligi (radius bilan)", type=float),
+    OpenApiParameter(name="longitude", description="Markaz uzunligi (radius bilan)", type=float),
+    OpenApiParameter(name="radius", description="Radius, metr (max 100 km). Eng yaqinlari birinchi", type=float),
+    OpenApiParameter(name="bbox", description="`min_lon,min_lat,max_lon,max_lat`, radius o'rniga", type=str),
+    OpenApiParameter(name="status", description="Faqat shu statusdagi buyurtmalar", type=str,
+                     enum=Order.OrderStatusChoice.values),
+    OpenApiParameter(name="limit", description="Natijalar soni (default 100, max 1000)", type=int),
+])
+@api_view(['GET'])
+def nearby_orders_api_view(request):
+    params = NearbyQuerySerializer(data=request.query_params)
+    if not params.is_valid():
+        return JsonResponse(params.errors, status=HTTP_400_BAD_REQUEST)
+    query = params.validated_data
+    orders = Order.objects.all()
+    if query.get('status'):
+        orders = orders.filter(status=query['status'])
+    if query.get('bbox'):
+        orders = orders.in_box(*query['bbox']).order_by('id')[:query['limit']]
+    else:
+        orders = orders.within(query['latitude'], query['longitude'], query['radius'], limit=query['limit'])
+    s = NearbyOrderModelSerializer(instance=orders, many=True).data
+    return JsonResponse({"response": s}, status=HTTP_200_OK)
+
+
+revenue_parameters = [
+    OpenApiParameter(name="status", description="Faqat shu statusdagi buyurtmalar", type=str),
+    OpenApiParameter(name="limit", description="Natijalar soni (default hammasi, max 1000)", type=int),
+]
+
+
+def revenue_limit(request):
+    try:
+        return min(max(int(request.query_params.get('limit', 1000)), 1), 1000)
+    except ValueError:
+        return 1000
+
+
+@extend_schema(tags=['reports'], parameters=revenue_parameters)
+@api_view(['GET'])
+def product_revenue_api_view(request):
+    s = revenue_report(ProductRevenue, status=request.query_params.get('status'), limit=revenue_limit(request))
+    return JsonResponse({"response": s}, status=HTTP_200_OK)
+
+
+@extend_schema(tags=['reports'], parameters=revenue_parameters)
+@api_view(['GET'])
+def category_revenue_api_view(request):
+    s = revenue_report(CategoryRevenue, status=request.query_params.get('status'), limit=revenue_limit(request))
+    return JsonResponse({"response": s}, status=HTTP_200_OK)
+
+
+@extend_schema(tags=['reports'])
+@api_view(['GET'])
+def status_revenue_api_view(request):
+    s = revenue_report(StatusRevenue)
+    return JsonResponse({"response": s}, status=HTTP_200_OK)
+
+
 @extend_schema(tags=['Product'], responses=ProductModelSerializer, parameters=[
     OpenApiParameter(
         name="fields",
@@ -200,40 +321,55 @@ def order_item_api_view(request, pk):
         },
         explode=False,
         style="form",  # Query param uchun mos format
-        required=True  # Ixtiyoriy
+        required=False  # Ixtiyoriy
     )
 ])
 @api_view(['GET'])
 def product_dynamic_fields_api_view(request):
-    allowed_fields = request.query_params.get('fields').split(',')
-    products = Product.objects.all()
-    s = ProductDynamicModelSerializer(instance=products, many=True).data
-    i = 0
-    for product in s:
-        keys_to_remove = []
-        for key in product.keys():
-            if key not in allowed_fields:
-                keys_to_remove.append(key)
-        for k in keys_to_remove:
-            s[i].pop(k)
-        i += 1
+    fields = request.query_params.get('fields')
+    if not fields:
+        s = ProductDynamicModelSerializer.fast_data(Product.objects.all())
+        return Response(s)
+    allowed_fields = ProductDynamicModelSerializer.select_fields(fields.split(','))
+    # faqat so'ralgan ustunlar SELECT qilinadi
+    products = Product.objects.only(*allowed_fields or ['id'])
+    serializer_class = ProductDynamicModelSerializer.for_fields(allowed_fields)
+    s = serializer_class.fast_data(products)
     return Response(s)
 
 
 @extend_schema(tags=['homework-3'], responses=CategoryDetailModelSerializer)
 @api_view(['GET'])
 def category_detail_api_view(request, pk):
-    if not Category.objects.filter(id=pk).exists():
+    def build():
+        category = Category.objects.filter(id=pk).first()
+        return CategoryDetailModelSerializer(instance=category).data if category else None
+
+    response = cached_detail_response(request, 'category', pk, build)
+    if response is None:
         return JsonResponse({"message": f"Category with id {pk} not found!"})
-    category = Category.objects.get(id=pk)
-    s = CategoryDetailModelSerializer(instance=category).data
-    return Response(s, status=HTTP_200_OK)
+    return response
+
+
+@extend_schema(tags=['homework-3'], responses=CategoryDetailModelSerializer(many=True))
+@api_view(['GET'])
+def catalog_api_view(request):
+    # butun katalog: tayyor gzip fayl, bazaga so'rov yo'q
+    return catalog_response(request)
 
 
 @extend_schema(tags=['homework-3'], responses=CategoryModelSerializer, request=CategoryModelSerializer)
 @api_view(['POST'])
 def category_create_api_view(request):
     data = request.data
+    if isinstance(data, list):
+        s = CategoryModelSerializer(data=data, many=True, max_length=BULK_CREATE_MAX_ITEMS)
+        if s.is_valid():
+            categories = s.save()
+            return JsonResponse(CategoryModelSerializer(instance=categories, many=True).data, safe=False,
+                                status=HTTP_201_CREATED)
+        return JsonResponse(s.errors, safe=False, status=HTTP_400_BAD_REQUEST)
+
     s = CategoryModelSerializer(data=data)
     if s.is_valid():
         category = s.save()
@@ -246,6 +382,16 @@ def category_create_api_view(request):
 @api_view(['POST'])
 def order_create_api_view(request):
     data = request.data
+    if isinstance(data, list):
+        s = OrderModelSerializer(data=data, many=True, max_length=BULK_CREATE_MAX_ITEMS)
+        if s.is_valid():
+            orders = s.save()
+            # new orders have no items yet: an empty prefetch saves a query per order
+            prefetch_related_objects(orders, 'user', Prefetch('order_items', queryset=OrderItem.objects.none()))
+            return JsonResponse(OrderModelSerializer(instance=orders, many=True).data, safe=False,
+                                status=HTTP_201_CREATED)
+        return JsonResponse(s.errors, safe=False, status=HTTP_400_BAD_REQUEST)
+
     s = OrderModelSerializer(data=data)
     if s.is_valid():
         order = s.save()
@@ -271,11 +417,11 @@ def profile_api_view(request):
     return JsonResponse(s)
 
 
-@extend_schema(tags=['homework-3'], responses=ProductByCategoryModelSerializer, parameters=[
+@extend_schema(tags=['homework-3'], responses=ProductBySearchModelSerializer, parameters=[
     OpenApiParameter(
         name="search",
         description=(
-                "..."
+                "Nom yoki tavsif bo'yicha qidiruv. Har bir so'z prefiks sifatida qidiriladi"
         ),
         type={
             "type": "string",
@@ -283,13 +429,18 @@ def profile_api_view(request):
         explode=False,
         style="form",
         required=True
-    )
+    ),
+    OpenApiParameter(name="limit", description="Natijalar soni (default 50, max 200)", type=int),
 ])
 @api_view(['GET'])
 def products_by_search_api_view(request):
     search = request.query_params.get('search', None)
     if search:
-        products = Product.objects.filter(Q(name__icontains=search) | Q(description__icontains=search))
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 200)
+        except ValueError:
+            limit = 50
+        products = search_products(search, limit=limit)
         s = ProductBySearchModelSerializer(instance=products, many=True).data
         return Response(s, status=HTTP_200_OK)
     return JsonResponse({"message": "Please send request with serach!"})
@@ -362,8 +513,8 @@ def register_api_view(request):
         email = data.get("email")
         send_email_task.delay(to_email=email, code=code)
         response = Response("Send code email address !", status=HTTP_200_OK)
-        response.set_cookie("tgjtyhfgdsrtyhfgd", make_password(str(code)), max_age=300)
-        response.set_cookie("qwertyuiosdfghvcvbhgbnhgbn", email, max_age=300)
+        response.set_cookie("tgjtyhfgdsrtyhfgd", make_verification_token(email, code, REGISTER),
+                            max_age=VERIFICATION_MAX_AGE)
         return response
     elif user and user.is_active:
         return Response("Already exists email !", status=HTTP_400_BAD_REQUEST)
@@ -377,15 +528,13 @@ def check_code(request):
 
     code = data.get('code')
     verify_code = request.COOKIES.get('tgjtyhfgdsrtyhfgd')
-    email = request.COOKIES.get('qwertyuiosdfghvcvbhgbnhgbn')
+    token = read_verification_token(verify_code)
 
-    if not verify_code or not email:
+    if not token:
         return JsonResponse({"message": "Code is expired!"})
-    #
-    # if not check_password(code, verify_code):
-    #     return JsonResponse({"message": "Incorrect code!"})
 
-    data['email'] = email
+    # the email is only trusted once validate_code has checked the token's HMAC
+    data['email'] = token['email']
     data['code'] = code
     data['verify_code'] = verify_code
 
@@ -405,8 +554,8 @@ def forgot_password_api_view(request):
         code = random_code()
         send_email_task.delay(to_email=data.get('email'), code=code)
         response = JsonResponse({"message": "Code send to your email!"})
-        response.set_cookie('zawsxedcrfvtbgyh', data.get('email'), max_age=300)
-        response.set_cookie('sedrfgvbhhytfrfgvbh', make_password(str(code)), max_age=300)
+        response.set_cookie('sedrfgvbhhytfrfgvbh', make_verification_token(data.get('email'), code, FORGOT_PASSWORD),
+                            max_age=VERIFICATION_MAX_AGE)
         return response
     return JsonResponse(s.errors)
 
@@ -415,8 +564,9 @@ def forgot_password_api_view(request):
 @api_view(['POST'])
 def forgot_password_check_api_view(request):
     data = request.data.copy()
-    data['email'] = request.COOKIES.get('zawsxedcrfvtbgyh')
     data['verify_code'] = request.COOKIES.get('sedrfgvbhhytfrfgvbh')
+    token = read_verification_token(data['verify_code'])
+    data['email'] = token['email'] if token else None
 
     s = ForgotPasswordCheckSerializer(data=data)
 
@@ -432,7 +582,6 @@ def login_api_view(request):
     data = request.data
     s = LoginSerializer(data=data)
     if s.is_valid():
-        user = User.objects.get(email=s.validated_data.get('email'))
-        login(request, user)
+        login(request, s.validated_data['user'])
         return JsonResponse({"message": "successfully login!"})
     return JsonResponse(s.errors)
@@ -23,6 +23,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
+    'api.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +62,51 @@ DATABASES = {
     }
 }
 
+# DATABASE_PROFILE=production tunes SQLite for several workers: WAL lets reads run while an order is being
+# written, connections are kept between requests and writers wait for the lock instead of failing.
+# The pragmas are applied to every new connection (api/db.py).
+DATABASE_PROFILE = getenv('DATABASE_PROFILE', 'development')
+SQLITE_PRODUCTION_SETTINGS = {
+    'CONN_MAX_AGE': int(getenv('DATABASE_CONN_MAX_AGE', '600')),
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'timeout': float(getenv('SQLITE_BUSY_TIMEOUT', '20')),  # seconds
+        # take the write lock at BEGIN, a read lock upgraded later fails without waiting for the busy timeout
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': int(getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),  # bytes
+    'cache_size': -int(getenv('SQLITE_CACHE_SIZE', str(64 * 1024))),  # KiB (negative: size instead of pages)
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRAGMAS = {}
+if DATABASE_PROFILE == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION_SETTINGS)
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS
+
+# Read replicas (api/routers.py): DATABASE_REPLICAS=/path/to/replica.sqlite3[,...] adds an alias per database.
+# GET requests read from them, writes and everything after a write go to `default`. Clients stay on `default`
+# for DATABASE_REPLICA_LAG seconds after a write.
+DATABASE_REPLICAS = []
+for i, name in enumerate(filter(None, getenv('DATABASE_REPLICAS', '').split(','))):
+    DATABASE_REPLICAS.append(f'replica{i + 1}')
+    DATABASES[f'replica{i + 1}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICA_LAG = int(getenv('DATABASE_REPLICA_LAG', '5'))
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+# Response cache of the detail endpoints (api/cache.py). Local memory is per process: with several
+# workers, point this at a shared backend so that version bumps reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -91,6 +138,20 @@ STATICFILES_DIRS = [join(BASE_DIR, 'static')]
 MEDIA_URL = 'media/'
 MEDIA_ROOT = join(BASE_DIR, 'media')
 
+# Post.file and Employee.cv uploads (api/uploads.py) are streamed to a temporary file while hashed and stored
+# once per content, up to these sizes. The views that take them set their own upload handler (hashing_uploads),
+# every other upload keeps Django's. Keep FILE_UPLOAD_TEMP_DIR on the filesystem of MEDIA_ROOT, so they are
+# moved, not copied.
+UPLOAD_MAX_FILE_SIZE = 10 * 1024 * 1024  # bytes
+UPLOAD_MAX_FILE_SIZES = {'cv': 5 * 1024 * 1024}  # per form field
+
+# Gzipped catalog snapshots served by /api/catalog/ (api/catalog.py), rebuilt by a Celery task at most once per
+# CATALOG_SNAPSHOT_DELAY seconds after Product/Category writes. The debounce key is in the default cache, so
+# with LocMemCache it is per process: each worker process schedules its own rebuild.
+CATALOG_SNAPSHOT_DIR = join(BASE_DIR, 'snapshots')
+CATALOG_SNAPSHOT_DELAY = 2  # seconds
+CATALOG_SNAPSHOT_KEEP = 2  # older versions kept besides the current one
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -103,6 +164,16 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny'
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # orjson (api/renderers.py, api/parsers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -116,7 +187,7 @@ SPECTACULAR_SETTINGS = {
 
 AUTH_USER_MODEL = 'api.User'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
@@ -124,3 +195,49 @@ EMAIL_HOST_USER = 'bapeold107@gmail.com'
 EMAIL_HOST_PASSWORD = 'ypatddsjruazvmnd '
 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
+
+# Posts past their deadline are moved to `expired` by api.tasks.expire_posts_task (run `celery -A root beat`)
+POST_EXPIRY_INTERVAL = 60  # seconds
+POST_EXPIRY_BATCH_SIZE = 1000  # rows per UPDATE
+CELERY_BEAT_SCHEDULE = {
+    'expire-posts': {'task': 'api.tasks.expire_posts_task', 'schedule': POST_EXPIRY_INTERVAL},
+}
+
+# Verification emails (api/mail.py): queued in Redis and sent in batches over one pooled SMTP connection
+# per worker. Non-SMTP backends (locmem in tests, console) skip the queue.
+EMAIL_QUEUE_URL = getenv('EMAIL_QUEUE_URL', CELERY_BROKER_URL)
+EMAIL_BATCH_WINDOW = 2  # seconds to collect messages before a batch is sent
+EMAIL_BATCH_SIZE = 50
+EMAIL_RATE_LIMIT = 20  # messages per second
+
+# Threads that verify password hashes for the async login (api/auth.py)
+PASSWORD_HASH_WORKERS = 4
+
+# List endpoints serialize straight from values_list() tuples (api/fast_serializers.py); False uses the
+# regular DRF serializers
+API_FAST_SERIALIZERS = True
+
+# api.middleware.PerformanceMiddleware: a sampled request runs every query through a timing wrapper, gets a
+# Server-Timing header and logs one JSON line to `api.performance`. API_PERF_SAMPLE_RATE is the sampled share
+# of requests, 0..1: 1% by default, set it to 1 to measure everything while profiling, 0 turns it off.
+API_PERF_SAMPLE_RATE = float(getenv('API_PERF_SAMPLE_RATE', '0.01'))
+# queries per request above which a request is logged as a warning; per view overrides below
+API_PERF_QUERY_BUDGET = 20
+API_PERF_QUERY_BUDGETS = {
+    'post_list_apiview': 5,
+    'subjob_list_apiview': 5,
+    'order_item_api_view': 5,
+    'category_detail_api_view': 5,
+    'the_best_employees': 5,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.performance': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}